@@ -0,0 +1,229 @@
+# Batch runner: independent guest programs farmed out to a pool of worker
+# processes, each job with its own step budget, wall-clock timeout and
+# memory cap. Results are yielded as jobs complete, not in submission order.
+#   python batch.py prog1.src prog2.mci ... [--workers N] [--timeout S]
+#                   [--max-steps N] [--memory MB] [--json]
+#
+# Workers are reused across jobs. A job that runs past its timeout, or
+# takes its worker down with it, costs that worker: it is killed and a
+# fresh one takes its place. The memory cap is an address-space limit
+# (RLIMIT_AS, POSIX only) on top of what the idle worker already maps, so
+# an oversized guest fails with MemoryError instead of swapping the host.
+import argparse
+import json
+import multiprocessing as mp
+import os
+import sys
+import time
+from multiprocessing.connection import wait
+from typing import Dict, Iterable, Iterator, Optional
+
+try:
+    import resource
+except ImportError:  # not available on Windows: memory caps are ignored
+    resource = None
+
+from image import is_image, load_image
+from main import compile_source, read_source_from_file
+from vm import ENGINES, load_machine_code, run_machine_code
+
+STATUSES = ('ok', 'error', 'steps', 'timeout', 'memory', 'crashed')
+
+class Job:
+    def __init__(self, name: str, source: Optional[str] = None, image: Optional[str] = None,
+                 max_steps: int = 500_000, timeout: Optional[float] = None,
+                 memory: Optional[int] = None, engine: str = 'switch'):
+        if (source is None) == (image is None):
+            raise ValueError("A job needs exactly one of source or image")
+        self.name = name
+        self.source = source        # program text, compiled in the worker
+        self.image = image          # path of a binary image, loaded by the worker
+        self.max_steps = max_steps
+        self.timeout = timeout      # wall-clock seconds, compile included
+        self.memory = memory        # extra address space in bytes
+        self.engine = engine
+
+def job_from_file(path: str, **limits) -> Job:
+    if is_image(path):
+        return Job(path, image=path, **limits)
+    return Job(path, source=read_source_from_file(path), **limits)
+
+# ========== Worker side ==========
+
+def _mapped_bytes() -> int:
+    try:
+        with open('/proc/self/statm') as fh:
+            return int(fh.read().split()[0]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError):
+        return 0
+
+def _execute(job: Job, baseline: int) -> Dict:
+    limit = None
+    if resource is not None and job.memory is not None:
+        limit = resource.getrlimit(resource.RLIMIT_AS)
+        soft = baseline + job.memory
+        if limit[1] != resource.RLIM_INFINITY:
+            soft = min(soft, limit[1])
+        resource.setrlimit(resource.RLIMIT_AS, (soft, limit[1]))
+    t0 = time.perf_counter()
+    try:
+        if job.image is not None:
+            prog = load_image(job.image)
+        else:
+            prog = load_machine_code(compile_source(job.source))
+        res = run_machine_code(prog, max_steps=job.max_steps, engine=job.engine)
+        out = {'status': 'ok', 'registers': res['registers'], 'output': res['output'],
+               'steps': res['stats']['steps']}
+    except MemoryError:
+        out = {'status': 'memory', 'error': f"Memory limit exceeded ({job.memory} bytes)."}
+    except RuntimeError as e:
+        status = 'steps' if str(e).startswith('Execution step limit exceeded') else 'error'
+        out = {'status': status, 'error': str(e)}
+    except Exception as e:
+        out = {'status': 'error', 'error': f"{type(e).__name__}: {e}"}
+    finally:
+        if limit is not None:
+            resource.setrlimit(resource.RLIMIT_AS, limit)
+    out['time'] = time.perf_counter() - t0
+    return out
+
+def _worker(conn) -> None:
+    # guest PRINTs are already collected in the result's 'output'
+    sys.stdout = open(os.devnull, 'w')
+    baseline = _mapped_bytes()
+    while True:
+        try:
+            msg = conn.recv()
+        except EOFError:
+            break
+        if msg is None:
+            break
+        jid, job = msg
+        conn.send((jid, _execute(job, baseline)))
+
+# ========== Pool side ==========
+
+class _Worker:
+    def __init__(self, ctx):
+        self.conn, child = ctx.Pipe()
+        self.proc = ctx.Process(target=_worker, args=(child,), daemon=True)
+        self.proc.start()
+        child.close()
+        self.job = None        # (jid, Job) being run
+        self.deadline = None
+        self.started = 0.0
+
+    def submit(self, jid: int, job: Job) -> None:
+        self.job = (jid, job)
+        self.started = time.monotonic()
+        self.deadline = self.started + job.timeout if job.timeout is not None else None
+        self.conn.send((jid, job))
+
+    def kill(self) -> None:
+        self.proc.kill()
+        self.proc.join()
+        self.conn.close()
+
+class BatchRunner:
+    def __init__(self, workers: Optional[int] = None, ctx=None):
+        self.ctx = ctx or mp.get_context()
+        self.workers = [_Worker(self.ctx) for _ in range(workers or os.cpu_count() or 1)]
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self) -> None:
+        for w in self.workers:
+            try:
+                w.conn.send(None)
+            except OSError:
+                pass
+        for w in self.workers:
+            w.proc.join(1)
+            if w.proc.is_alive():
+                w.proc.kill()
+                w.proc.join()
+            w.conn.close()
+        self.workers = []
+
+    def _replace(self, i: int) -> None:
+        self.workers[i].kill()
+        self.workers[i] = _Worker(self.ctx)
+
+    def run(self, jobs: Iterable[Job]) -> Iterator[Dict]:
+        # Yields one result dict per job as it completes: 'job' (submission
+        # index), 'name', 'status' (one of STATUSES), 'time' and either
+        # 'registers'/'output'/'steps' or 'error'.
+        pending = iter(enumerate(jobs))
+
+        def feed(w: _Worker) -> int:
+            nxt = next(pending, None)
+            w.job = None
+            if nxt is not None:
+                w.submit(*nxt)
+            return nxt is not None
+
+        busy = sum(feed(w) for w in self.workers)
+        try:
+            while busy:
+                deadlines = [w.deadline for w in self.workers if w.job and w.deadline is not None]
+                timeout = max(0.0, min(deadlines) - time.monotonic()) if deadlines else None
+                ready = wait([w.conn for w in self.workers if w.job], timeout)
+                now = time.monotonic()
+                for i, w in enumerate(self.workers):
+                    if w.job is None:
+                        continue
+                    if w.conn in ready:
+                        try:
+                            _, out = w.conn.recv()
+                        except (EOFError, OSError):
+                            out = {'status': 'crashed', 'time': now - w.started,
+                                   'error': f"Worker died (exit code {w.proc.exitcode})."}
+                            self._replace(i)
+                    elif w.deadline is not None and now >= w.deadline:
+                        out = {'status': 'timeout', 'time': now - w.started,
+                               'error': f"Time limit exceeded ({w.job[1].timeout}s)."}
+                        self._replace(i)
+                    else:
+                        continue
+                    jid, job = w.job
+                    busy += feed(self.workers[i]) - 1
+                    yield {'job': jid, 'name': job.name, **out}
+        finally:
+            # the consumer stopped early: drop whatever is still running
+            for i, w in enumerate(self.workers):
+                if w.job is not None:
+                    self._replace(i)
+
+def run_batch(jobs: Iterable[Job], workers: Optional[int] = None) -> Iterator[Dict]:
+    with BatchRunner(workers) as pool:
+        yield from pool.run(jobs)
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser()
+    ap.add_argument('files', nargs='+', help="program sources or binary images")
+    ap.add_argument('--workers', type=int, default=None, help="default: one per core")
+    ap.add_argument('--timeout', type=float, default=None, help="wall-clock seconds per job")
+    ap.add_argument('--max-steps', type=int, default=500_000)
+    ap.add_argument('--memory', type=int, default=None, metavar='MB', help="memory cap per job")
+    ap.add_argument('--engine', choices=ENGINES, default='switch')
+    ap.add_argument('--json', action='store_true', help="one JSON object per line")
+    args = ap.parse_args()
+
+    memory = args.memory * 2**20 if args.memory is not None else None
+    jobs = [job_from_file(f, max_steps=args.max_steps, timeout=args.timeout,
+                          memory=memory, engine=args.engine) for f in args.files]
+    failed = 0
+    for res in run_batch(jobs, args.workers):
+        failed += res['status'] != 'ok'
+        if args.json:
+            print(json.dumps(res), flush=True)
+        elif res['status'] == 'ok':
+            print(f"{res['name']}: ok {res['steps']} steps {res['time'] * 1000:.1f}ms "
+                  f"output={res['output']}", flush=True)
+        else:
+            print(f"{res['name']}: {res['status']} {res['error']}", flush=True)
+    sys.exit(1 if failed else 0)
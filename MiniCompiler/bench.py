@@ -0,0 +1,67 @@
+# VM engine benchmark on program.src style loops
+#   python bench.py [--repeat N] [--engines switch,closure] [--jit THRESHOLD]
+import argparse
+import time
+
+from main import compile_source
+from vm import ENGINES, load_machine_code, run_machine_code
+
+WORKLOADS = {
+    'count': """
+        x = 1; y = 0;
+        while (x <= 200000) x = x + 1;
+        if (x > 5) y = 100;
+    """,
+    'arith': """
+        i = 0; s = 0;
+        while (i < 50000) {
+            s = s + i * 3 - i / 2;
+            if (s > 100000) s = s - 100000;
+            i = i + 1;
+        }
+    """,
+    'nested': """
+        i = 0; n = 0;
+        while (i < 300) {
+            j = 0;
+            while (j < 300) { n = n + i * j; j = j + 1; }
+            i = i + 1;
+        }
+    """,
+    'calls': """
+        func add(a, b) { return a + b; }
+        i = 0; s = 0;
+        while (i < 20000) { s = add(s, i); i = add(i, 1); }
+    """,
+}
+
+def bench(engines, repeat, jit_threshold=None, fuse=True):
+    columns = [(e, e, None) for e in engines]
+    if jit_threshold is not None:
+        columns.append(('jit', 'switch', jit_threshold))
+    header = f"{'workload':<10}" + "".join(f"{c[0]:>12}" for c in columns) + f"{'speedup':>10}"
+    print(header)
+    print("-" * len(header))
+    for name, src in WORKLOADS.items():
+        prog = load_machine_code(compile_source(src), fuse)
+        times = []
+        for _, engine, threshold in columns:
+            best = float('inf')
+            for _ in range(repeat):
+                prog.jit_loops.clear()
+                t0 = time.perf_counter()
+                run_machine_code(prog, max_steps=50_000_000, engine=engine, jit_threshold=threshold)
+                best = min(best, time.perf_counter() - t0)
+            times.append(best)
+        row = f"{name:<10}" + "".join(f"{t * 1000:>10.1f}ms" for t in times)
+        print(row + f"{times[0] / times[-1]:>9.2f}x")
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser()
+    ap.add_argument('--repeat', type=int, default=3)
+    ap.add_argument('--engines', default=','.join(ENGINES))
+    ap.add_argument('--jit', type=int, default=None, metavar='THRESHOLD',
+                    help='add a column for the switch engine with the loop JIT')
+    ap.add_argument('--no-fuse', action='store_true', help='run without superinstructions')
+    args = ap.parse_args()
+    bench(args.engines.split(','), args.repeat, args.jit, not args.no_fuse)
@@ -0,0 +1,405 @@
+# Control-flow graphs over the tuple IR.
+#
+# build_cfgs() splits generate_ir output into the top-level code and one
+# CFG per FUNC, each a list of basic blocks in layout order. A block holds
+# the LABELs that land on it and its instructions; a JMP, CJZ or RET can
+# only be the last one. Edges are Block references:
+#   succs  [fallthrough] or [fallthrough, CJZ target] or [JMP target],
+#          [] after a RET, at the end of the code or for an unknown label
+#   preds  the blocks with this one in their succs
+# linearize() turns the CFGs back into the tuple list, top-level code first
+# and then FUNC..ENDFUNC per function (the layout codegen produces anyway),
+# adding a JMP wherever a fallthrough successor no longer comes next.
+# Building and linearizing are linear in the number of instructions.
+#
+# SSA form (ssa.py) adds two pseudo-instructions, both gone again after
+# from_ssa():
+#   ('PHI', dst, [operand per pred])   at the top of a block, ops follow preds
+#   ('EXIT', names, [operand, ...])    top-level exits: the values each user
+#                                      variable must hold when the run ends
+from typing import Dict, List, Optional, Tuple
+
+Instr = Tuple
+
+TERMINATORS = ('JMP', 'CJZ', 'RET')
+
+def split_functions(ir_code: List[Instr]):
+    # -> (top-level instrs, [(name, params, instrs)])
+    top: List[Instr] = []
+    funcs = []
+    cur = top
+    for instr in ir_code:
+        if not instr:
+            continue
+        if instr[0] == 'FUNC':
+            cur = []
+            funcs.append((instr[1], instr[2], cur))
+            continue
+        if instr[0] == 'ENDFUNC':
+            cur = top
+            continue
+        cur.append(instr)
+    return top, funcs
+
+def defs_uses(instr: Instr):
+    op = instr[0]
+    if op == 'MOV':
+        return [instr[1]], [instr[2]]
+    if op == 'BIN':
+        return [instr[1]], [instr[3], instr[4]]
+    if op == 'CALL':
+        return ([instr[1]] if instr[1] is not None else []), list(instr[3])
+    if op == 'CJZ':
+        return [], [instr[1]]
+    if op == 'RET':
+        return [], [instr[1]]
+    if op == 'PHI':
+        return [instr[1]], list(instr[2])
+    if op == 'EXIT':
+        return [], list(instr[2])
+    return [], []
+
+def map_uses(instr: Instr, f) -> Instr:
+    # instr with f applied to every name it reads
+    g = lambda x: f(x) if isinstance(x, str) else x
+    op = instr[0]
+    if op == 'MOV':
+        return ('MOV', instr[1], g(instr[2]))
+    if op == 'BIN':
+        return ('BIN', instr[1], instr[2], g(instr[3]), g(instr[4]))
+    if op == 'CALL':
+        return ('CALL', instr[1], instr[2], [g(a) for a in instr[3]])
+    if op == 'CJZ':
+        return ('CJZ', g(instr[1]), instr[2])
+    if op == 'RET':
+        return ('RET', g(instr[1]))
+    if op == 'PHI':
+        return ('PHI', instr[1], [g(a) for a in instr[2]])
+    if op == 'EXIT':
+        return ('EXIT', instr[1], [g(a) for a in instr[2]])
+    return instr
+
+def map_defs(instr: Instr, f) -> Instr:
+    if instr[0] in ('MOV', 'BIN', 'CALL', 'PHI') and instr[1] is not None:
+        return (instr[0], f(instr[1])) + tuple(instr[2:])
+    return instr
+
+def jump_target(instr: Instr) -> Optional[str]:
+    if instr[0] == 'JMP':
+        return instr[1]
+    if instr[0] == 'CJZ':
+        return instr[2]
+    return None
+
+class Block:
+    def __init__(self, index: int):
+        self.index = index        # position in the layout when built
+        self.labels: List[str] = []
+        self.instrs: List[Instr] = []
+        self.succs: List['Block'] = []
+        self.preds: List['Block'] = []
+
+    @property
+    def terminator(self) -> Optional[Instr]:
+        if self.instrs and self.instrs[-1][0] in TERMINATORS:
+            return self.instrs[-1]
+        return None
+
+    def falls_through(self) -> bool:
+        t = self.terminator
+        return t is None or t[0] == 'CJZ'
+
+    def __repr__(self):
+        return f"<Block {self.index} {self.labels}>"
+
+class CFG:
+    def __init__(self, name: Optional[str], params: Optional[List[str]], blocks: List[Block]):
+        self.name = name          # None for the top-level code
+        self.params = params      # None for the top-level code
+        self.blocks = blocks      # layout order, blocks[0] is the entry
+        self.label_count = 0
+
+    @property
+    def entry(self) -> Block:
+        return self.blocks[0]
+
+    def block_of(self) -> Dict[str, Block]:
+        return {label: b for b in self.blocks for label in b.labels}
+
+    def reverse_postorder(self) -> List[Block]:
+        # reachable blocks only; iterative so deep CFGs don't hit the recursion limit
+        order: List[Block] = []
+        seen = {id(self.entry)}
+        stack = [(self.entry, iter(self.entry.succs))]
+        while stack:
+            block, it = stack[-1]
+            for s in it:
+                if id(s) not in seen:
+                    seen.add(id(s))
+                    stack.append((s, iter(s.succs)))
+                    break
+            else:
+                stack.pop()
+                order.append(block)
+        order.reverse()
+        return order
+
+    def remove_unreachable(self) -> int:
+        live = set(self.reverse_postorder())
+        dead = [b for b in self.blocks if b not in live]
+        for b in dead:
+            for s in list(b.succs):
+                if s in live:
+                    self.remove_edge(b, s)
+        if dead:
+            self.blocks = [b for b in self.blocks if b in live]
+        return len(dead)
+
+    def remove_edge(self, p: Block, s: Block) -> None:
+        # drops the edge and the matching phi operands; p's terminator is
+        # left for the caller to fix
+        j = s.preds.index(p)
+        s.preds.pop(j)
+        s.instrs = [('PHI', i[1], i[2][:j] + i[2][j + 1:]) if i[0] == 'PHI' else i
+                    for i in s.instrs]
+        p.succs.remove(s)
+
+    def label(self, block: Block) -> str:
+        # a label for jumping to block, made up if it has none
+        if not block.labels:
+            name = f"L_bb{self.label_count}_{self.name or 'top'}"
+            self.label_count += 1
+            block.labels.append(name)
+        return block.labels[0]
+
+    def instrs(self) -> List[Instr]:
+        # the block that runs off the end of the code has to stay last
+        blocks = [b for b in self.blocks if b.succs or not b.falls_through()]
+        blocks += [b for b in self.blocks if not b.succs and b.falls_through()]
+        out: List[Instr] = []
+        for i, b in enumerate(blocks):
+            out.extend(('LABEL', label) for label in b.labels)
+            nxt = blocks[i + 1] if i + 1 < len(blocks) else None
+            t = b.terminator
+            if t is not None and t[0] == 'JMP' and b.succs and b.succs[0] is nxt:
+                out.extend(b.instrs[:-1])   # jump to the next block
+                continue
+            out.extend(b.instrs)
+            if b.falls_through() and b.succs and b.succs[0] is not nxt:
+                out.append(('JMP', self.label(b.succs[0])))
+        return out
+
+    def retarget(self, p: Block, old: Block, new: Block) -> None:
+        # p's edges to old go to new instead
+        t = p.terminator
+        target = t and jump_target(t)
+        if target is not None and target in old.labels:
+            label = self.label(new)
+            p.instrs[-1] = (t[0], label) if t[0] == 'JMP' else (t[0], t[1], label)
+        p.succs = [new if s is old else s for s in p.succs]
+        new.preds.extend(p for s in p.succs if s is new and p not in new.preds)
+
+    def remove_empty(self) -> int:
+        # fold blocks with no instructions into their successor (outside SSA:
+        # the successor's pred order changes)
+        gone = set()
+        for i, b in enumerate(self.blocks):
+            if b.instrs or len(b.succs) != 1 or b.succs[0] is b:
+                continue
+            s = b.succs[0]
+            if i == len(gone):
+                # b is the current entry: s must be next in the layout, then
+                # becomes the entry and takes over its labels (FUNC_<name> is
+                # how codegen and the VM find the function), which it passes
+                # on again if it is empty too
+                if i + 1 >= len(self.blocks) or self.blocks[i + 1] is not s:
+                    continue
+                s.labels = b.labels + s.labels
+            elif any(l.startswith('FUNC_') for l in b.labels):
+                continue
+            s.preds = [p for p in s.preds if p is not b]
+            for p in list(dict.fromkeys(b.preds)):
+                self.retarget(p, b, s)
+            gone.add(b)
+        if gone:
+            self.blocks = [b for b in self.blocks if b not in gone]
+        return len(gone)
+
+    def split_edge(self, p: Block, s: Block) -> Block:
+        # new empty block on the edge p -> s; s.preds keeps its order
+        n = Block(len(self.blocks))
+        j = p.succs.index(s)
+        p.succs[j] = n
+        s.preds[s.preds.index(p)] = n
+        n.preds, n.succs = [p], [s]
+        if j == 0 and p.falls_through():
+            self.blocks.insert(self.blocks.index(p) + 1, n)
+        else:
+            t = p.terminator
+            p.instrs[-1] = (t[0], self.label(n)) if t[0] == 'JMP' else (t[0], t[1], self.label(n))
+            self.blocks.append(n)
+        return n
+
+    def dominators(self) -> Dict[Block, Block]:
+        # immediate dominators of the reachable blocks (entry -> entry),
+        # Cooper, Harvey & Kennedy's iterative algorithm
+        order = self.reverse_postorder()
+        num = {b: i for i, b in enumerate(order)}
+        idom = {self.entry: self.entry}
+        changed = True
+        while changed:
+            changed = False
+            for b in order[1:]:
+                new = None
+                for p in b.preds:
+                    if p not in idom:
+                        continue
+                    if new is None:
+                        new = p
+                        continue
+                    x, y = p, new
+                    while x is not y:
+                        while num[x] > num[y]:
+                            x = idom[x]
+                        while num[y] > num[x]:
+                            y = idom[y]
+                    new = x
+                if idom.get(b) is not new:
+                    idom[b] = new
+                    changed = True
+        return idom
+
+    def dominance_frontiers(self, idom: Dict[Block, Block]) -> Dict[Block, set]:
+        df = {b: set() for b in idom}
+        for b in idom:
+            preds = [p for p in b.preds if p in idom]
+            if len(preds) < 2:
+                continue
+            for p in preds:
+                runner = p
+                while runner is not idom[b]:
+                    df[runner].add(b)
+                    runner = idom[runner]
+        return df
+
+    def liveness(self) -> 'Liveness':
+        return Liveness(self)
+
+class Liveness:
+    # Live names at block boundaries, as int bitsets over self.names so
+    # that programs with thousands of variables stay cheap. A PHI reads its
+    # operand at the end of the matching predecessor.
+    def __init__(self, cfg: CFG):
+        self.index: Dict[str, int] = {}
+        self.names: List[str] = []
+        order = cfg.reverse_postorder()
+        gen, kill, phi_defs, phi_uses = {}, {}, {}, {}
+        for b in order:
+            g = k = pd = 0
+            for instr in b.instrs:
+                d, u = defs_uses(instr)
+                if instr[0] == 'PHI':
+                    pd |= self.bit(instr[1])
+                    for p, x in zip(b.preds, instr[2]):
+                        if isinstance(x, str):
+                            phi_uses[p, b] = phi_uses.get((p, b), 0) | self.bit(x)
+                    continue
+                for x in u:
+                    if isinstance(x, str):
+                        g |= self.bit(x) & ~k
+                for x in d:
+                    k |= self.bit(x)
+            gen[b], kill[b], phi_defs[b] = g, k | pd, pd
+        self.live_in = dict.fromkeys(order, 0)
+        self.live_out = dict.fromkeys(order, 0)
+        changed = True
+        while changed:
+            changed = False
+            for b in reversed(order):
+                out = 0
+                for s in b.succs:
+                    if s in self.live_in:
+                        out |= (self.live_in[s] & ~phi_defs[s]) | phi_uses.get((b, s), 0)
+                new = gen[b] | (out & ~kill[b])
+                if new != self.live_in[b] or out != self.live_out[b]:
+                    self.live_in[b], self.live_out[b] = new, out
+                    changed = True
+
+    def bit(self, name: str) -> int:
+        i = self.index.get(name)
+        if i is None:
+            i = self.index[name] = len(self.names)
+            self.names.append(name)
+        return 1 << i
+
+    def decode(self, bits: int) -> set:
+        out = set()
+        while bits:
+            low = bits & -bits
+            out.add(self.names[low.bit_length() - 1])
+            bits ^= low
+        return out
+
+    def is_live_in(self, b: Block, name: str) -> bool:
+        i = self.index.get(name)
+        return i is not None and b in self.live_in and bool(self.live_in[b] >> i & 1)
+
+    def out_of(self, b: Block) -> set:
+        return self.decode(self.live_out.get(b, 0))
+
+def dominator_tree(idom: Dict[Block, Block]) -> Dict[Block, List[Block]]:
+    children = {b: [] for b in idom}
+    for b, d in idom.items():
+        if b is not d:
+            children[d].append(b)
+    return children
+
+def build_cfg(instrs: List[Instr], name: Optional[str] = None,
+              params: Optional[List[str]] = None) -> CFG:
+    blocks: List[Block] = []
+    cur: Optional[Block] = None
+    for instr in instrs:
+        op = instr[0]
+        if op == 'LABEL':
+            if cur is None or cur.instrs:
+                cur = Block(len(blocks))
+                blocks.append(cur)
+            cur.labels.append(instr[1])
+            continue
+        if cur is None:
+            cur = Block(len(blocks))
+            blocks.append(cur)
+        cur.instrs.append(instr)
+        if op in TERMINATORS:
+            cur = None
+    if not blocks:
+        blocks.append(Block(0))
+
+    cfg = CFG(name, params, blocks)
+    by_label = cfg.block_of()
+    for i, b in enumerate(blocks):
+        nxt = blocks[i + 1] if i + 1 < len(blocks) else None
+        if b.falls_through() and nxt is not None:
+            b.succs.append(nxt)
+        target = b.terminator and jump_target(b.terminator)
+        if target is not None and target in by_label:
+            b.succs.append(by_label[target])
+    for b in blocks:
+        for s in b.succs:
+            s.preds.append(b)
+    return cfg
+
+def build_cfgs(ir_code: List[Instr]) -> List[CFG]:
+    # [0] is the top-level code, then one CFG per FUNC in order
+    top, funcs = split_functions(ir_code)
+    return [build_cfg(top)] + [build_cfg(body, name, params) for name, params, body in funcs]
+
+def linearize(cfgs: List[CFG]) -> List[Instr]:
+    out = cfgs[0].instrs()
+    for g in cfgs[1:]:
+        out.append(('FUNC', g.name, g.params))
+        out.extend(g.instrs())
+        out.append(('ENDFUNC', g.name))
+    # labels nothing jumps to any more (FUNC_ labels mark function entries)
+    targets = {jump_target(i) for i in out if i[0] in ('JMP', 'CJZ')}
+    return [i for i in out if i[0] != 'LABEL' or i[1] in targets or i[1].startswith('FUNC_')]
@@ -7,59 +7,81 @@ RELOP_MAP = {
     '>': 'GT', '<': 'LT', '==': 'EQ', '!=': 'NE', '>=': 'GE', '<=': 'LE'
 }
 
+BUILTINS = {'print'}
+
 def tok(x: Operand) -> str:
     return str(x)
 
 def generate_machine_code(ir_code: List[Instr]) -> List[str]:
     mc: List[str] = []
-    functions = set()
+    bodies: List[List[str]] = []  # function bodies, placed after the top-level code
+    functions = {instr[1] for instr in ir_code if instr and instr[0] == 'FUNC'}
+    out = mc
+    skip = None   # the RET folded into a TAILCALL
 
-    for instr in ir_code:
-        if not instr:
+    for k, instr in enumerate(ir_code):
+        if not instr or k == skip:
             continue
         op = instr[0]
         if op == 'FUNC':
-            _, name, _params = instr
-            functions.add(name)
+            out = []
+            bodies.append(out)
             continue  # marker only
+        if op == 'ENDFUNC':
+            out = mc
+            continue
         if op == 'LABEL':
             _, name = instr
-            mc.append(f"LABEL {name}")
+            out.append(f"LABEL {name}")
             continue
         if op == 'JMP':
-            mc.append(f"JMP {instr[1]}")
+            out.append(f"JMP {instr[1]}")
             continue
         if op == 'CJZ':
             _, cond, label = instr
-            mc.append(f"JZ {tok(cond)}, {label}")
+            out.append(f"JZ {tok(cond)}, {label}")
             continue
         if op == 'MOV':
             _, dst, src = instr
-            mc.append(f"MOV {tok(dst)}, {tok(src)}")
+            out.append(f"MOV {tok(dst)}, {tok(src)}")
             continue
         if op == 'BIN':
             _, dst, bop, a, b = instr
             if bop in ('+','-','*','/'):
-                mc.append(f"{bop} {tok(dst)}, {tok(a)}, {tok(b)}")
+                out.append(f"{bop} {tok(dst)}, {tok(a)}, {tok(b)}")
             else:
-                mc.append(f"{RELOP_MAP[bop]} {tok(dst)}, {tok(a)}, {tok(b)}")
+                out.append(f"{RELOP_MAP[bop]} {tok(dst)}, {tok(a)}, {tok(b)}")
             continue
         if op == 'CALL':
             _, dst, name, args = instr
+            if name in BUILTINS and name not in functions:
+                for a in args:
+                    out.append(f"PRINT {tok(a)}")
+                continue
+            # 'CALL t, f / RET t' in a function: the callee returns for us
+            nxt = ir_code[k + 1] if k + 1 < len(ir_code) else None
+            if out is not mc and dst is not None and nxt == ('RET', dst) and name in functions:
+                out.append(", ".join([f"TAILCALL {name}"] + [tok(a) for a in args]))
+                skip = k + 1
+                continue
             # move args to _arg{i}
             for i, a in enumerate(args):
-                mc.append(f"MOV _arg{i}, {tok(a)}")
-            mc.append(f"CALL {name}, {len(args)}")
+                out.append(f"MOV _arg{i}, {tok(a)}")
+            out.append(f"CALL {name}, {len(args)}")
             if dst is not None:
-                mc.append(f"MOV {tok(dst)}, _ret")
+                out.append(f"MOV {tok(dst)}, _ret")
             continue
         if op == 'RET':
             _, val = instr
-            mc.append(f"RET {tok(val)}")
+            out.append(f"RET {tok(val)}")
             continue
-        mc.append("// UNKNOWN: " + repr(instr))
+        out.append("// UNKNOWN: " + repr(instr))
 
     # Bootstrap: if 'main' defined, call it automatically at end
     if 'main' in functions:
         mc.append("CALL main, 0")
-    return mc
\ No newline at end of file
+    if bodies:
+        mc.append("HALT")
+        for body in bodies:
+            mc.extend(body)
+    return mc
@@ -0,0 +1,146 @@
+# Compile-time evaluation of pure guest functions (the 'eval' and 'calls'
+# passes).
+#
+# A function is pure when all it reads are its parameters and its own
+# locals (no globals copied in on CALL) and it only calls pure functions:
+# no print, nothing a caller could observe except the value it returns.
+# 'CALL t, f, [3, 4]' with f pure and constant arguments - literals on the
+# linear IR before inlining ('eval'), or whatever sccp proved ('calls') - is run
+# here on the linear IR of f, with the VM's semantics (locals start at 0,
+# '/' by zero is 0), and becomes 'MOV t, <result>'. A call that doesn't
+# return within EVAL_STEPS instructions, nests deeper than EVAL_DEPTH calls
+# or computes a value outside int64 (what an image's constant pool holds) is
+# left for run time. Every value the evaluator keeps is in int64, so the
+# operands of '*' never exceed 64 bits either.
+#
+# One ConstEvaluator lives for one compile. Its memo table holds every
+# (function, arguments) it has settled, nested calls included, so repeated
+# calls - and recursive ones like fib - are evaluated once; failures are
+# remembered too.
+import re
+from typing import Dict, List, Optional, Set, Tuple
+
+from cfg import CFG, defs_uses, split_functions
+from optimizer import ARITH, RELOP, fold
+
+EVAL_STEPS = 10000
+EVAL_DEPTH = 200
+INT_MIN, INT_MAX = -2**63, 2**63 - 1
+
+ARG = re.compile(r'_arg\d+$')
+
+class _GiveUp(Exception):
+    pass
+
+def _pure(funcs: Dict[str, Tuple[List[str], List[tuple]]]) -> Set[str]:
+    calls: Dict[str, Set[str]] = {}
+    pure = set()
+    for name, (params, code) in funcs.items():
+        written = set(params)
+        read = set()
+        ok = True
+        for instr in code:
+            if instr[0] not in ('MOV', 'BIN', 'CALL', 'CJZ', 'JMP', 'LABEL', 'RET'):
+                ok = False
+            if instr[0] == 'BIN' and instr[2] not in ARITH | RELOP:
+                ok = False
+            d, u = defs_uses(instr)
+            written.update(d)
+            read.update(x for x in u if isinstance(x, str) and not ARG.match(x))
+        calls[name] = {i[2] for i in code if i[0] == 'CALL'}
+        if ok and read <= written:
+            pure.add(name)
+    # drop functions that call something impure or unknown (print) until
+    # nothing changes
+    changed = True
+    while changed:
+        changed = False
+        for name in list(pure):
+            if not calls[name] <= pure:
+                pure.discard(name)
+                changed = True
+    return pure
+
+class ConstEvaluator:
+    def __init__(self, ir_code: List[tuple], steps: int = EVAL_STEPS):
+        _, funcs = split_functions(ir_code)
+        self.funcs = {name: (params, code) for name, params, code in funcs}
+        self.labels = {name: {i[1]: k for k, i in enumerate(code) if i[0] == 'LABEL'}
+                       for name, (_, code) in self.funcs.items()}
+        self.pure = _pure(self.funcs)
+        self.steps = steps
+        self.memo: Dict[Tuple[str, Tuple[int, ...]], Optional[int]] = {}
+
+    def call(self, name: str, args: List[int]) -> Optional[int]:
+        # -> the result, or None when it can't be had at compile time
+        key = (name, tuple(args))
+        if key not in self.memo:
+            if name not in self.pure or len(args) != len(self.funcs[name][0]):
+                self.memo[key] = None
+            else:
+                try:
+                    self.memo[key] = self._run(name, key[1], [self.steps], 0)
+                except _GiveUp:
+                    self.memo[key] = None
+        return self.memo[key]
+
+    def _run(self, name: str, args: Tuple[int, ...], budget: List[int], depth: int) -> int:
+        key = (name, args)
+        if self.memo.get(key) is not None:
+            return self.memo[key]
+        if depth > EVAL_DEPTH or len(args) != len(self.funcs[name][0]):
+            raise _GiveUp
+        code, labels = self.funcs[name][1], self.labels[name]
+        if not all(INT_MIN <= a <= INT_MAX for a in args):
+            raise _GiveUp
+        env: Dict[str, int] = {f'_arg{j}': a for j, a in enumerate(args)}
+        val = lambda x: x if isinstance(x, int) else env.get(x, 0)
+        pc = 0
+        while pc < len(code):
+            budget[0] -= 1
+            if budget[0] < 0:
+                raise _GiveUp
+            instr = code[pc]
+            op = instr[0]
+            pc += 1
+            if op == 'MOV' or op == 'BIN':
+                v = val(instr[2]) if op == 'MOV' else fold(instr[2], val(instr[3]), val(instr[4]))
+                if not INT_MIN <= v <= INT_MAX:
+                    raise _GiveUp
+                env[instr[1]] = v
+            elif op == 'CJZ':
+                if val(instr[1]) == 0:
+                    pc = labels[instr[2]]
+            elif op == 'JMP':
+                pc = labels[instr[1]]
+            elif op == 'CALL':
+                r = self._run(instr[2], tuple(val(a) for a in instr[3]), budget, depth + 1)
+                if instr[1] is not None:
+                    env[instr[1]] = r
+            elif op == 'RET':
+                if not INT_MIN <= val(instr[1]) <= INT_MAX:
+                    raise _GiveUp
+                self.memo[key] = val(instr[1])
+                return self.memo[key]
+        raise _GiveUp   # fell off the end
+
+def eval_calls(instrs: List[tuple], ev: ConstEvaluator) -> Tuple[List[tuple], int]:
+    # CALLs of pure functions on constant arguments -> MOV of the result
+    out, n = [], 0
+    for instr in instrs:
+        if instr[0] == 'CALL' and all(isinstance(a, int) for a in instr[3]):
+            r = ev.call(instr[2], instr[3])
+            if r is not None:
+                n += 1
+                if instr[1] is not None:
+                    out.append(('MOV', instr[1], r))
+                continue
+        out.append(instr)
+    return out, n
+
+def fold_calls(g: CFG, ev: ConstEvaluator) -> int:
+    n = 0
+    for b in g.blocks:
+        b.instrs, k = eval_calls(b.instrs, ev)
+        n += k
+    return n
@@ -0,0 +1,123 @@
+# Guest-level profiler for the register VM (run_machine_code(profile=True)).
+# The switch engine bumps one counter per executed ip and calls call()/ret()
+# on CALL/RET; everything else is derived from those when the report is
+# built:
+#   functions  calls, inclusive steps (outermost activation only, so
+#              recursion is not counted twice) and exclusive steps
+#   instructions  per-ip counts with the source line
+#   loops      iterations per label: backward jumps taken to it. A JMP is
+#              taken every time it runs; a JZ or fused compare-branch (what
+#              closes a loop after jump threading) as often as it runs
+#              minus the times it falls through to the next ip, which is
+#              that ip's count less the jumps any branch took to it
+#   stacks     exclusive steps per call path, as collapsed() lines
+import json
+from typing import Dict, List, Optional, Tuple
+
+from vm import BRANCH_OF, Op, Program
+
+CMP_BRANCHES = frozenset(BRANCH_OF.values())
+
+def _target(instr) -> Optional[int]:
+    op = instr[0]
+    if op is Op.JMP:
+        return instr[1]
+    if op is Op.JZ:
+        return instr[2]
+    if op in CMP_BRANCHES:
+        return instr[4]
+    return None
+
+class Profiler:
+    def __init__(self, prog: Program):
+        self.prog = prog
+        n = len(prog.functions)
+        self.counts = [0] * len(prog.code)
+        self.calls = [0] * n
+        self.inclusive = [0] * n
+        self.active = [0] * n
+        self.active[0] = 1
+        # open activations: [start step, steps spent in callees, path, fid]
+        self.frames: List[list] = [[0, 0, (prog.functions[0].name,), 0]]
+        self.stacks: Dict[Tuple[str, ...], int] = {}
+        self.steps = 0
+
+    def call(self, fid: int, steps: int) -> None:
+        self.calls[fid] += 1
+        self.active[fid] += 1
+        path = self.frames[-1][2] + (self.prog.functions[fid].name,)
+        self.frames.append([steps, 0, path, fid])
+
+    def ret(self, steps: int) -> None:
+        start, child, path, fid = self.frames.pop()
+        incl = steps - start
+        self.stacks[path] = self.stacks.get(path, 0) + incl - child
+        self.frames[-1][1] += incl
+        self.active[fid] -= 1
+        if not self.active[fid]:
+            self.inclusive[fid] += incl
+
+    def finish(self, steps: int) -> None:
+        # close whatever is still open (a top-level RET, HALT)
+        while len(self.frames) > 1:
+            self.ret(steps)
+        start, child, path, _ = self.frames[0]
+        self.stacks[path] = self.stacks.get(path, 0) + steps - start - child
+        self.inclusive[0] = steps
+        self.frames = []
+        self.steps = steps
+
+    def report(self) -> Dict:
+        prog = self.prog
+        exclusive = [0] * len(prog.functions)
+        for ip, n in enumerate(self.counts):
+            exclusive[prog.owner[ip]] += n
+        functions = {
+            f.name: {'calls': self.calls[fid], 'inclusive': self.inclusive[fid],
+                     'exclusive': exclusive[fid]}
+            for fid, f in enumerate(prog.functions)
+        }
+        instructions = [
+            {'ip': ip, 'count': n, 'function': prog.functions[prog.owner[ip]].name,
+             'source': prog.source[ip]}
+            for ip, n in enumerate(self.counts) if n
+        ]
+        at = {}
+        for name, ip in prog.labels.items():
+            at.setdefault(ip, name)
+        counts = self.counts
+        targets = {ip: _target(instr) for ip, instr in enumerate(prog.code)}
+        into: Dict[int, List[int]] = {}    # ip -> branches that can jump to it
+        for ip, target in targets.items():
+            if target is not None:
+                into.setdefault(target, []).append(ip)
+        taken: Dict[int, int] = {}
+
+        def taken_at(ip: int) -> int:
+            if prog.code[ip][0] is Op.JMP:
+                return counts[ip]
+            if ip not in taken:
+                taken[ip] = 0   # branches into each other's next ip: a cycle
+                nxt = ip + 1
+                after = 0
+                if nxt < len(counts):
+                    after = counts[nxt] - sum(taken_at(k) for k in into.get(nxt, ()) if k != ip)
+                taken[ip] = counts[ip] - min(max(after, 0), counts[ip])
+            return taken[ip]
+
+        loops: Dict[str, int] = {}
+        for ip, target in targets.items():
+            if target is None or target > ip or target not in at:
+                continue
+            n = taken_at(ip)
+            if n > 0:
+                loops[at[target]] = loops.get(at[target], 0) + n
+        return {'steps': self.steps, 'functions': functions,
+                'instructions': instructions, 'loops': loops}
+
+    def to_json(self, indent: int = 2) -> str:
+        return json.dumps(self.report(), indent=indent)
+
+    def collapsed(self) -> str:
+        # flamegraph.pl / speedscope input: 'a;b;c <steps>' per line
+        return "\n".join(f"{';'.join(path)} {n}" for path, n in sorted(self.stacks.items()) if n)
@@ -0,0 +1,189 @@
+# Binary program images: a loaded Program saved after codegen, so deployed
+# scripts skip lexing, parsing, optimization and machine-code decoding.
+#
+# Layout (little-endian, every section 8-byte aligned):
+#   header   magic, version, flags and the section sizes below
+#   consts   int64 constant pool
+#   code     (op, a, b, c, d) int32 per instruction, -1 for unused operands;
+#            CALLA/TAILCALL b is an offset into argpool, EVAL b / TRAP a a
+#            string index
+#   argpool  int32 CALLA/TAILCALL argument lists as [count, slot, ...]
+#   funcs    (name, entry, slots, outputs, imports) int32 per function
+#   symtab   int32 per function: (name string or -1, const index or -1) per
+#            slot, then its output slots, then (global, local) import pairs
+#   labels   (name, ip) int32 pairs
+#   fused    (kind, count) int32 pairs
+#   source   int32 string index per instruction (FLAG_SOURCE only)
+#   strings  (offset, length) int32 pairs into the utf-8 blob, then the blob
+#
+# load_image() reads the file in one go and unpacks each section in bulk
+# with struct.iter_unpack into the Program the VM runs; nothing is re-parsed
+# or re-decoded from text, but each process holds its own decoded copy.
+import struct
+from typing import Dict, List, Tuple
+
+from vm import Function, Op, Program
+
+MAGIC = b'MCIM'
+VERSION = 1
+FLAG_SOURCE = 1
+
+HEADER = struct.Struct('<4sHH12I')
+INSTR = struct.Struct('<5i')
+OPS = tuple(sorted(Op, key=int))
+
+class ImageError(Exception):
+    pass
+
+def _int32s(values) -> bytes:
+    return struct.pack(f'<{len(values)}i', *values)
+
+def _pad(buf: bytearray):
+    buf.extend(b'\0' * (-len(buf) % 8))
+
+def _field(v) -> int:
+    return -1 if v is None else v
+
+def image_bytes(prog: Program, source: bool = True) -> bytes:
+    strings: Dict[str, int] = {}
+    def sid(s: str) -> int:
+        return strings.setdefault(s, len(strings))
+
+    consts: Dict[int, int] = {}
+    def cid(v: int) -> int:
+        if not -2**63 <= v < 2**63:
+            raise ImageError(f"Constant out of range for an image: {v}")
+        return consts.setdefault(v, len(consts))
+
+    code: List[int] = []
+    argpool: List[int] = []
+    for op, a, b, c, d in prog.code:
+        if op is Op.CALLA or op is Op.TAILCALL:
+            argpool.append(len(b))
+            argpool.extend(b)
+            b = len(argpool) - len(b) - 1
+        elif op is Op.EVAL:
+            b = sid(b)
+        elif op is Op.TRAP:
+            a = sid(a)
+        code += [op, _field(a), _field(b), _field(c), _field(d)]
+
+    funcs: List[int] = []
+    symtab: List[int] = []
+    for f in prog.functions:
+        funcs += [sid(f.name), f.entry, len(f.names), len(f.outputs), len(f.imports)]
+        for name, value in zip(f.names, f.template):
+            symtab += [sid(name), -1] if name else [-1, cid(value)]
+        symtab += f.outputs
+        for g, l in f.imports:
+            symtab += [g, l]
+
+    labels = [x for name, ip in prog.labels.items() for x in (sid(name), ip)]
+    fused = [x for kind, n in prog.fused.items() for x in (sid(kind), n)]
+    src = [sid(s) for s in prog.source] if source else []
+
+    blob = bytearray()
+    index: List[int] = []
+    for s in strings:
+        data = s.encode('utf-8')
+        index += [len(blob), len(data)]
+        blob += data
+
+    out = bytearray(HEADER.pack(
+        MAGIC, VERSION, FLAG_SOURCE if source else 0,
+        len(consts), len(prog.code), len(argpool), len(prog.functions), len(symtab),
+        len(prog.labels), len(prog.fused), len(strings), len(blob), prog.nargs, prog.halt_ip, 0))
+    _pad(out)
+    out += struct.pack(f'<{len(consts)}q', *consts)
+    for section in (code, argpool, funcs, symtab, labels, fused, src, index):
+        out += _int32s(section)
+        _pad(out)
+    out += blob
+    return bytes(out)
+
+def write_image(prog: Program, path: str, source: bool = True) -> int:
+    data = image_bytes(prog, source)
+    with open(path, 'wb') as fh:
+        fh.write(data)
+    return len(data)
+
+def is_image(path: str) -> bool:
+    try:
+        with open(path, 'rb') as fh:
+            return fh.read(len(MAGIC)) == MAGIC
+    except OSError:
+        return False
+
+def _none(v: int):
+    return None if v == -1 else v
+
+def decode_image(buf) -> Program:
+    mv = memoryview(buf)
+    if len(mv) < HEADER.size or bytes(mv[:4]) != MAGIC:
+        raise ImageError("Not a program image")
+    (_, version, flags, n_consts, n_code, n_argpool, n_funcs, n_symtab,
+     n_labels, n_fused, n_strings, n_blob, nargs, halt_ip, _) = HEADER.unpack_from(mv)
+    if version != VERSION:
+        raise ImageError(f"Unsupported image version {version} (expected {VERSION})")
+
+    pos = HEADER.size + (-HEADER.size % 8)
+    def section(fmt: str, count: int, width: int):
+        nonlocal pos
+        view = mv[pos:pos + count * width]
+        pos += count * width
+        pos += -pos % 8
+        return struct.iter_unpack(fmt, view) if count else iter(())
+
+    consts = [v for v, in section('<q', n_consts, 8)]
+    raw_code = list(section('<5i', n_code, 20))
+    argpool = [v for v, in section('<i', n_argpool, 4)]
+    raw_funcs = list(section('<5i', n_funcs, 20))
+    symtab = [v for v, in section('<i', n_symtab, 4)]
+    raw_labels = list(section('<2i', n_labels, 8))
+    raw_fused = list(section('<2i', n_fused, 8))
+    raw_source = [v for v, in section('<i', n_code if flags & FLAG_SOURCE else 0, 4)]
+    index = list(section('<2i', n_strings, 8))
+    blob = bytes(mv[pos:pos + n_blob])
+    strings = [blob[o:o + n].decode('utf-8') for o, n in index]
+
+    code = []
+    for op, a, b, c, d in raw_code:
+        op = OPS[op]
+        if op is Op.CALLA or op is Op.TAILCALL:
+            b = tuple(argpool[b + 1:b + 1 + argpool[b]])
+        elif op is Op.EVAL:
+            b = strings[b]
+        elif op is Op.TRAP:
+            a = strings[a]
+        code.append((op, _none(a), _none(b), _none(c), _none(d)))
+
+    functions = []
+    k = 0
+    for name, entry, n_slots, n_outputs, n_imports in raw_funcs:
+        names, template = [], []
+        for i in range(n_slots):
+            s, v = symtab[k + 2 * i], symtab[k + 2 * i + 1]
+            names.append(strings[s] if s >= 0 else '')
+            template.append(consts[v] if v >= 0 else 0)
+        k += 2 * n_slots
+        outputs = symtab[k:k + n_outputs]
+        k += n_outputs
+        imports = tuple((symtab[k + 2 * i], symtab[k + 2 * i + 1]) for i in range(n_imports))
+        k += 2 * n_imports
+        functions.append(Function(strings[name], entry, names, template, outputs, imports))
+
+    # regions are contiguous: each function runs up to the next one's entry,
+    # the HALT sentinel and traps after the code belong to the top level
+    owner = [0] * n_code
+    for fid, f in enumerate(functions[1:], 1):
+        end = functions[fid + 1].entry if fid + 1 < len(functions) else halt_ip
+        owner[f.entry:end] = [fid] * (end - f.entry)
+
+    source = [strings[s] for s in raw_source] if raw_source else [f'// {c[0].name}' for c in code]
+    labels = {strings[s]: ip for s, ip in raw_labels}
+    fused = {strings[s]: n for s, n in raw_fused}
+    return Program(code, source, labels, functions, owner, nargs, halt_ip, fused)
+
+def load_image(path: str) -> Program:
+    with open(path, 'rb') as fh:
+        return decode_image(fh.read())
@@ -0,0 +1,173 @@
+# Inlining of small guest functions into their callers, on linear IR before
+# the CFG/SSA passes (which then fold the arguments into the copied body).
+#
+# A call 'CALL t, f, [a0, a1]' becomes
+#     MOV p0', a0 / MOV p1', a1       the prologue, reading the args directly
+#     MOV x', 0 ...                   every local starts out 0, as in a frame
+#     <f's body, names and labels renamed>
+#     MOV t, v' / JMP L_ret           for each 'RET v'
+#     LABEL L_ret
+# Everything f writes gets a fresh temp name, so nothing leaks into the
+# caller's registers. Names f only reads are globals the VM copies in on
+# CALL; the caller sees the same values as long as it doesn't write them
+# itself (a function can't write a global), which is checked per call site.
+#
+# Only functions that can't reach themselves in the call graph and whose
+# body is at most 'budget' instructions are inlined. Callees are handled
+# before their callers, so a helper built from inlined helpers is measured
+# at its inlined size. The FUNC definitions stay: 'main' is called by name
+# and other call sites may have been left alone.
+import re
+from typing import Dict, List, Set
+
+from cfg import defs_uses, split_functions
+
+INLINE_BUDGET = 24   # body instructions (labels not counted)
+
+TEMP_NAME = re.compile(r'%t(\d+)$')
+ARG = re.compile(r'_arg(\d+)$')
+
+def _body(name: str, params: List[str], code: List[tuple]):
+    # -> the instructions after the prologue when the function has the
+    # IRBuilder shape 'LABEL FUNC_f / MOV p, _argi ...' and reads _argN
+    # nowhere else
+    if not code or code[0] != ('LABEL', f'FUNC_{name}'):
+        return None
+    n = len(params)
+    if code[1:1 + n] != [('MOV', p, f'_arg{j}') for j, p in enumerate(params)]:
+        return None
+    body = code[1 + n:]
+    for instr in body:
+        if instr[0] == 'LABEL' and instr[1] == f'FUNC_{name}':
+            return None
+        if any(isinstance(x, str) and ARG.match(x) for x in defs_uses(instr)[1]):
+            return None
+    return body
+
+def _recursive(funcs: Dict[str, List[tuple]]) -> Set[str]:
+    calls = {f: {i[2] for i in code if i[0] == 'CALL' and i[2] in funcs}
+             for f, code in funcs.items()}
+    out = set()
+    for f in funcs:
+        seen, work = set(), list(calls[f])
+        while work:
+            g = work.pop()
+            if g == f:
+                out.add(f)
+                break
+            if g not in seen:
+                seen.add(g)
+                work.extend(calls[g])
+    return out
+
+def _order(funcs: Dict[str, List[tuple]]) -> List[str]:
+    # callees before callers (postorder of the call graph)
+    out, seen = [], set()
+    for root in funcs:
+        if root in seen:
+            continue
+        seen.add(root)
+        work = [(root, iter({i[2] for i in funcs[root] if i[0] == 'CALL'}))]
+        while work:
+            f, it = work[-1]
+            g = next(it, None)
+            if g is None:
+                work.pop()
+                out.append(f)
+            elif g in funcs and g not in seen:
+                seen.add(g)
+                work.append((g, iter({i[2] for i in funcs[g] if i[0] == 'CALL'})))
+    return out
+
+def _size(body: List[tuple]) -> int:
+    return sum(1 for i in body if i[0] != 'LABEL')
+
+def inline_calls(ir_code: List[tuple], budget: int = INLINE_BUDGET) -> List[tuple]:
+    top, funcs = split_functions(ir_code)
+    if not funcs or budget <= 0:
+        return ir_code
+    params = {name: ps for name, ps, _ in funcs}
+    code = {name: c for name, _, c in funcs}
+    recursive = _recursive(code)
+
+    counter = 0
+    for instr in top + [i for c in code.values() for i in c]:
+        d, u = defs_uses(instr)
+        for x in d + u:
+            m = TEMP_NAME.match(str(x))
+            if m:
+                counter = max(counter, int(m.group(1)) + 1)
+    sites = iter(range(1 << 30))
+
+    def fresh() -> str:
+        nonlocal counter
+        counter += 1
+        return f'%t{counter - 1}'
+
+    def expand(caller: List[tuple], caller_writes: Set[str], bodies) -> List[tuple]:
+        out = []
+        for instr in caller:
+            body = bodies.get(instr[2]) if instr[0] == 'CALL' else None
+            if body is None or len(instr[3]) != len(params[instr[2]]):
+                out.append(instr)
+                continue
+            callee_writes = set(params[instr[2]])
+            reads = set()
+            for i in body:
+                d, u = defs_uses(i)
+                callee_writes.update(d)
+                reads.update(x for x in u if isinstance(x, str))
+            if (reads - callee_writes) & caller_writes:
+                out.append(instr)   # the callee's global is shadowed here
+                continue
+            _, dst, name, args = instr
+            site = next(sites)
+            names = {x: fresh() for x in sorted(callee_writes)}
+            labels = {i[1]: f'{i[1]}_in{site}' for i in body if i[0] == 'LABEL'}
+            done = f'L_ret_{name}_{site}'
+            rn = lambda x: names.get(x, x)
+            out.extend(('MOV', names[p], a) for p, a in zip(params[name], args))
+            out.extend(('MOV', names[x], 0) for x in sorted(callee_writes - set(params[name])))
+            for i in body:
+                op = i[0]
+                if op == 'LABEL':
+                    out.append(('LABEL', labels[i[1]]))
+                elif op == 'RET':
+                    if dst is not None:
+                        out.append(('MOV', dst, rn(i[1])))
+                    out.append(('JMP', done))
+                elif op == 'JMP':
+                    out.append(('JMP', labels.get(i[1], i[1])))
+                elif op == 'CJZ':
+                    out.append(('CJZ', rn(i[1]), labels.get(i[2], i[2])))
+                elif op == 'MOV':
+                    out.append(('MOV', rn(i[1]), rn(i[2])))
+                elif op == 'BIN':
+                    out.append(('BIN', rn(i[1]), i[2], rn(i[3]), rn(i[4])))
+                elif op == 'CALL':
+                    out.append(('CALL', None if i[1] is None else rn(i[1]), i[2],
+                                [rn(a) for a in i[3]]))
+                else:
+                    out.append(i)
+            out.append(('LABEL', done))
+        return out
+
+    def writes(c: List[tuple]) -> Set[str]:
+        return {d for i in c for d in defs_uses(i)[0]}
+
+    bodies: Dict[str, List[tuple]] = {}
+    for name in _order(code):
+        c = code[name]
+        if bodies:
+            c = code[name] = expand(c, writes(c) | set(params[name]), bodies)
+        body = _body(name, params[name], c)
+        if body is not None and name not in recursive and _size(body) <= budget:
+            bodies[name] = body
+    top = expand(top, set(), bodies)
+
+    out = list(top)
+    for name, ps, _ in funcs:
+        out.append(('FUNC', name, ps))
+        out.extend(code[name])
+        out.append(('ENDFUNC', name))
+    return out
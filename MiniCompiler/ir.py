@@ -1,3 +1,4 @@
+import re
 from typing import List, Tuple, Union
 
 Instr = Tuple
@@ -8,9 +9,11 @@ class IRBuilder:
         self.code: List[Instr] = []
         self.temp_count = 0
         self.label_count = 0
+        self.func = None        # (name, params) of the FUNCDEF being lowered
+        self.tail_sites = []    # where its self tail calls reset the locals
 
     def new_temp(self) -> str:
-        t = f"t{self.temp_count}"
+        t = f"%t{self.temp_count}"
         self.temp_count += 1
         return t
 
@@ -64,6 +67,11 @@ class IRBuilder:
             self.emit(('CALL', tmp, fname, args))
             return
         if tag == 'RETURN':
+            call = node[1]
+            if call is not None and call[0] == 'CALL_EXPR' and self.func is not None \
+                    and call[1] == self.func[0] and len(call[2]) == len(self.func[1]):
+                self.emit_tail_call(call[2])
+                return
             if node[1] is None:
                 self.emit(('RET', 0))
             else:
@@ -104,9 +112,16 @@ class IRBuilder:
             # move implicit arg registers to params
             for i, p in enumerate(params):
                 self.emit(('MOV', p, f'_arg{i}'))
+            start = len(self.code)
+            outer = self.func, self.tail_sites
+            self.func, self.tail_sites = (name, params), []
             self.emit_block(body)
             # ensure function ends
             self.emit(('RET', 0))
+            if self.tail_sites:
+                self.finish_tail_calls(name, params, start)
+            self.func, self.tail_sites = outer
+            self.emit(('ENDFUNC', name))
             return
         if tag == 'PROGRAM':
             for s in node[1]:
@@ -114,6 +129,36 @@ class IRBuilder:
             return
         raise ValueError(f"Unsupported stmt: {node}")
 
+    # Self tail calls: 'return f(a, b)' inside f rebinds the parameters and
+    # jumps back to the top of the body instead of growing the VM callstack.
+    # The new values are all read before any parameter is written, and the
+    # locals go back to 0 as they would in a fresh frame.
+    def emit_tail_call(self, arg_nodes):
+        name, params = self.func
+        args = [self.emit_expr(a) for a in arg_nodes]
+        for i, a in enumerate(args):
+            if isinstance(a, str) and not TEMP.match(a) and a != params[i]:
+                t = self.new_temp()
+                self.emit(('MOV', t, a))
+                args[i] = t
+        for p, a in zip(params, args):
+            if a != p:
+                self.emit(('MOV', p, a))
+        self.tail_sites.append(len(self.code))
+        self.emit(('JMP', f'L_tail_{name}'))
+
+    def finish_tail_calls(self, name: str, params: List[str], start: int):
+        # the resets only now that all the function's locals are known
+        body = self.code[start:]
+        local = sorted({i[1] for i in body if i[0] in ('MOV', 'BIN', 'CALL') and i[1] is not None
+                        and i[1] not in params and not TEMP.match(i[1])})
+        for at in reversed(self.tail_sites):
+            self.code[at:at] = [('MOV', x, 0) for x in local]
+        self.code.insert(start, ('LABEL', f'L_tail_{name}'))
+
+
+TEMP = re.compile(r'%t\d+$')   # new_temp() names: no identifier has a '%'
+
 
 def generate_ir(ast) -> List[Instr]:
     b = IRBuilder()
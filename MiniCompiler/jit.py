@@ -0,0 +1,181 @@
+# Hot-loop JIT: lowers a VM loop region to a Python function
+#
+# A loop is the ip range [header, latch] where code[latch] is 'JMP header'.
+# The region is turned into Python source that keeps every register in a
+# local variable and runs the loop as a real 'while True'. Nested loops,
+# if/else diamonds, 'break' and 'continue' are recovered from the jump
+# layout IRBuilder produces; any other jump becomes a side exit that writes
+# the locals back to the frame and returns the target ip to the interpreter.
+#
+# The generated function has the signature fn(regs, budget) -> (ip, steps)
+# and counts executed VM instructions exactly like the interpreter does.
+from typing import Callable, Dict, List, Optional, Tuple
+
+from vm import Op, Program
+
+ARITH_FMT = {
+    Op.ADD: '{b} + {c}', Op.SUB: '{b} - {c}', Op.MUL: '{b} * {c}',
+    Op.DIV: '{b} // {c} if {c} != 0 else 0',
+    Op.GT: '1 if {b} > {c} else 0', Op.LT: '1 if {b} < {c} else 0',
+    Op.EQ: '1 if {b} == {c} else 0', Op.NE: '1 if {b} != {c} else 0',
+    Op.GE: '1 if {b} >= {c} else 0', Op.LE: '1 if {b} <= {c} else 0',
+}
+# compare-and-branch superinstruction -> its relop
+BRANCH_RELOP = {op: Op(op - Op.GTJZ + Op.GT)
+                for op in (Op.GTJZ, Op.LTJZ, Op.EQJZ, Op.NEJZ, Op.GEJZ, Op.LEJZ)}
+# Instructions a compiled region may contain
+JIT_OPS = set(ARITH_FMT) | set(BRANCH_RELOP) | {Op.MOV, Op.JMP, Op.JZ}
+
+EXIT = '#exit '   # placeholder line, expanded once all written registers are known
+
+class Unsupported(Exception):
+    pass
+
+class LoopCompiler:
+    def __init__(self, prog: Program, header: int, latch: int):
+        self.prog = prog
+        self.code = prog.code
+        self.header = header
+        self.latch = latch
+        fn = prog.functions[prog.owner[header]]
+        self.template = fn.template
+        self.consts = {s for s, n in enumerate(fn.names) if n == ''}
+        self.lines: List[str] = []
+        self.used: Dict[int, None] = {}     # register slots, in first-use order
+        self.written: Dict[int, None] = {}
+        self.pending = 0                    # executed instructions not yet added to steps
+        # inner loop headers -> last back-edge ip
+        self.backedges: Dict[int, int] = {}
+        for ip in range(header, latch + 1):
+            op, a = self.code[ip][:2]
+            if op not in JIT_OPS or self.prog.owner[ip] != self.prog.owner[header]:
+                raise Unsupported(f'{op.name} at ip {ip}')
+            if op is Op.JMP and header <= a < ip:
+                self.backedges[a] = max(ip, self.backedges.get(a, a))
+
+    # ----- operands -----
+    def reg(self, slot: int) -> str:
+        if slot in self.consts:
+            return repr(self.template[slot])
+        self.used.setdefault(slot)
+        return f'r{slot}'
+
+    def dst(self, slot: int) -> str:
+        self.written.setdefault(slot)
+        return self.reg(slot)
+
+    # ----- emission -----
+    def emit(self, depth: int, text: str):
+        self.lines.append('    ' * depth + text)
+
+    def flush(self, depth: int):
+        if self.pending:
+            self.emit(depth, f'steps += {self.pending}')
+            self.pending = 0
+
+    def side_exit(self, depth: int, ip: int):
+        self.flush(depth)
+        self.emit(depth, f'{EXIT}{ip}')
+
+    def jump(self, depth: int, target: int, loops: List[Tuple[int, int]], follow: int, tail: bool):
+        # Emit the transfer of control to target at the end of a straight-line run
+        if tail and target == follow:
+            self.flush(depth)
+            return
+        if loops and target == loops[-1][0]:
+            self.flush(depth)
+            self.emit(depth, 'continue')
+        elif len(loops) > 1 and target == loops[-1][1]:
+            self.flush(depth)
+            self.emit(depth, 'break')
+        else:
+            self.side_exit(depth, target)
+
+    def loop(self, depth: int, header: int, latch: int, loops: List[Tuple[int, int]]):
+        self.flush(depth)
+        self.emit(depth, 'while True:')
+        self.emit(depth + 1, 'if steps >= budget:')
+        self.emit(depth + 2, f'{EXIT}{header}')
+        self.range(depth + 1, header, latch + 1, loops + [(header, latch + 1)], header)
+
+    def range(self, depth: int, start: int, end: int, loops: List[Tuple[int, int]], follow: int):
+        # Emit ips [start, end); falling off the end continues at follow
+        ip = start
+        size = len(self.lines)
+        while ip < end:
+            if ip != loops[-1][0] and ip in self.backedges and self.backedges[ip] < end:
+                latch = self.backedges[ip]
+                self.loop(depth, ip, latch, loops)
+                ip = latch + 1
+                continue
+            op, a, b, c, d = self.code[ip]
+            self.pending += 1
+            if op is Op.MOV:
+                self.emit(depth, f'{self.dst(a)} = {self.reg(b)}')
+                ip += 1
+            elif op in ARITH_FMT:
+                expr = ARITH_FMT[op].format(b=self.reg(b), c=self.reg(c))
+                self.emit(depth, f'{self.dst(a)} = {expr}')
+                ip += 1
+            elif op is Op.JMP:
+                self.jump(depth, a, loops, follow, ip == end - 1)
+                ip += 1
+            elif op in BRANCH_RELOP:
+                expr = ARITH_FMT[BRANCH_RELOP[op]].format(b=self.reg(b), c=self.reg(c))
+                self.emit(depth, f'{self.dst(a)} = {expr}')
+                ip = self.branch(depth, ip, self.reg(a), d, end, loops, follow)
+            else:  # JZ a, b
+                ip = self.branch(depth, ip, self.reg(a), b, end, loops, follow)
+        self.flush(depth)
+        if len(self.lines) == size:
+            self.emit(depth, 'pass')
+
+    def branch(self, depth: int, ip: int, cond: str, target: int, end: int,
+               loops: List[Tuple[int, int]], follow: int) -> int:
+        self.flush(depth)
+        if ip < target and (target < end or target == follow):
+            join = target
+            jop, ja = self.code[target - 1][:2]
+            if jop is Op.JMP and target - 1 > ip and target < ja and (ja < end or ja == follow):
+                join = ja
+            self.emit(depth, f'if {cond}:')
+            if join == target:
+                self.range(depth + 1, ip + 1, target, loops, target)
+                return target
+            # if/else diamond: then-part ends with 'JMP join'
+            self.range(depth + 1, ip + 1, target - 1, loops, join)
+            self.emit(depth + 1, 'steps += 1')
+            self.emit(depth, 'else:')
+            self.range(depth + 1, target, join, loops, join)
+            return join
+        self.emit(depth, f'if not {cond}:')
+        self.jump(depth + 1, target, loops, -1, False)
+        return ip + 1
+
+    def build(self) -> str:
+        self.loop(1, self.header, self.latch, [])
+        out = [f'def loop_{self.header}(regs, budget):']
+        out += [f'    r{s} = regs[{s}]' for s in self.used]
+        out.append('    steps = 0')
+        for line in self.lines:
+            text = line.lstrip()
+            if not text.startswith(EXIT):
+                out.append(line)
+                continue
+            # side exit: write registers back, resume the interpreter at ip
+            pad = line[:len(line) - len(text)]
+            out += [f'{pad}regs[{s}] = r{s}' for s in self.written]
+            out.append(f'{pad}return {text[len(EXIT):]}, steps')
+        return '\n'.join(out) + '\n'
+
+def loop_source(prog: Program, header: int, latch: int) -> str:
+    return LoopCompiler(prog, header, latch).build()
+
+def compile_loop(prog: Program, header: int, latch: int) -> Optional[Callable]:
+    try:
+        src = loop_source(prog, header, latch)
+    except Unsupported:
+        return None
+    ns: Dict[str, object] = {}
+    exec(compile(src, f'<jit loop {header}>', 'exec'), ns)
+    return ns[f'loop_{header}']
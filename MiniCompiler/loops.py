@@ -0,0 +1,280 @@
+# Loop passes over SSA form.
+#
+# find_loops() returns the natural loops of a CFG, innermost first: one per
+# header, made of every block that reaches a back edge to it (a jump to a
+# block that dominates the jumping one) without passing the header. The
+# WHILE lowering gives exactly one such loop per statement: the header is
+# the L_cond_ block and the back edge is the body's closing JMP.
+#
+# preheader() gives a loop a single block that runs right before the header
+# on every entry, which is where licm() puts the pure computations whose
+# operands never change inside the loop and strength_reduce() sets up the
+# running sums that replace multiplications by a loop counter.
+from typing import Dict, List, Set
+
+from cfg import CFG, Block, defs_uses, map_uses
+from ssa import TEMP, base, is_version, new_version, stable
+
+class Loop:
+    def __init__(self, header: Block, blocks: Set[Block], latches: List[Block]):
+        self.header = header
+        self.blocks = blocks      # header included
+        self.latches = latches    # blocks with a back edge to the header
+
+    def __repr__(self):
+        return f"<Loop {self.header.labels} {len(self.blocks)} blocks>"
+
+def find_loops(g: CFG) -> List[Loop]:
+    idom = g.dominators()
+    def dominates(a: Block, b: Block) -> bool:
+        while b is not a:
+            if b is idom[b]:
+                return False
+            b = idom[b]
+        return True
+
+    latches: Dict[Block, List[Block]] = {}
+    for b in idom:
+        for s in b.succs:
+            if s in idom and dominates(s, b):
+                latches.setdefault(s, []).append(b)
+    loops = []
+    for h, tails in latches.items():
+        body = {h}
+        work = list(tails)
+        while work:
+            b = work.pop()
+            if b not in body:
+                body.add(b)
+                work.extend(p for p in b.preds if p in idom)
+        loops.append(Loop(h, body, tails))
+    loops.sort(key=lambda l: len(l.blocks))
+    return loops
+
+def preheader(g: CFG, loop: Loop) -> Block:
+    # the single outside predecessor if it only leads here, else a new block
+    # placed right before the header that all entering edges go through
+    h = loop.header
+    outside = [j for j, p in enumerate(h.preds) if p not in loop.blocks]
+    if len(outside) == 1 and len(h.preds[outside[0]].succs) == 1:
+        return h.preds[outside[0]]
+    inside = [j for j in range(len(h.preds)) if j not in outside]
+    pre = Block(len(g.blocks))
+    pre.preds = [h.preds[j] for j in outside]
+    phis = []
+    for k, instr in enumerate(h.instrs):
+        if instr[0] != 'PHI':
+            break
+        ops = [instr[2][j] for j in outside]
+        if len(set(ops)) == 1:
+            v = ops[0]
+        else:
+            v = new_version(g, instr[1])
+            phis.append(('PHI', v, ops))
+        h.instrs[k] = ('PHI', instr[1], [v] + [instr[2][j] for j in inside])
+    pre.instrs = phis
+    for p in dict.fromkeys(pre.preds):
+        # jumps are retargeted; a fallthrough into h now falls into pre,
+        # which sits right before it (linearize adds a JMP otherwise)
+        t = p.terminator
+        if t is not None and t[0] == 'JMP':
+            p.instrs[-1] = ('JMP', g.label(pre))
+        elif t is not None and t[0] == 'CJZ' and p.succs[1] is h:
+            p.instrs[-1] = ('CJZ', t[1], g.label(pre))
+        p.succs = [pre if s is h else s for s in p.succs]
+    h.preds = [pre] + [h.preds[j] for j in inside]
+    pre.succs = [h]
+    g.blocks.insert(g.blocks.index(h), pre)
+    return pre
+
+def licm(g: CFG) -> int:
+    # Hoists MOVs and BINs whose operands are constants, stable names or
+    # versions defined outside the loop (or by something already hoisted).
+    # Everything the IR computes is pure and can't trap ('/' by zero is 0),
+    # so running it once before the loop is always safe; a loop that runs
+    # zero times just pays for it once. A value that flows into a phi in
+    # the loop stays put: out of SSA it would come back as a copy on every
+    # iteration. Inner loops go first, so whatever they hoist into an outer
+    # loop's body gets another chance there.
+    is_stable = stable(g)
+    hoisted = 0
+    loops = find_loops(g)
+    for loop in loops:
+        inside, merged = set(), set()
+        for b in loop.blocks:
+            for instr in b.instrs:
+                inside.update(defs_uses(instr)[0])
+                if instr[0] == 'PHI':
+                    merged.update(instr[2])
+        moved = []
+        order = [b for b in g.reverse_postorder() if b in loop.blocks]
+        changed = True
+        while changed:
+            changed = False
+            for b in order:
+                keep = []
+                for instr in b.instrs:
+                    if instr[0] in ('MOV', 'BIN') and is_stable(instr[1]) \
+                            and instr[1] not in merged and all(
+                            is_stable(x) and x not in inside for x in defs_uses(instr)[1]):
+                        moved.append(instr)
+                        inside.discard(instr[1])
+                        changed = True
+                    else:
+                        keep.append(instr)
+                b.instrs = keep
+        if not moved:
+            continue
+        pre = preheader(g, loop)
+        for outer in loops:
+            if loop.header in outer.blocks and outer is not loop:
+                outer.blocks.add(pre)
+        at = len(pre.instrs) - (pre.terminator is not None)
+        pre.instrs[at:at] = moved
+        hoisted += len(moved)
+    return hoisted
+
+# ========== Induction variables ==========
+
+RELOPS = ('<', '<=', '>', '>=', '==', '!=')
+FLIPPED = {'<': '>', '<=': '>=', '>': '<', '>=': '<=', '==': '==', '!=': '!='}
+
+def _step(instr, phi: str):
+    # 'BIN n, +, phi, c' / 'BIN n, +, c, phi' / 'BIN n, -, phi, c' -> c or -c
+    if instr is None or instr[0] != 'BIN':
+        return None
+    _, _, bop, x, y = instr
+    if bop == '+' and x == phi and isinstance(y, int):
+        return y
+    if bop == '+' and y == phi and isinstance(x, int):
+        return x
+    if bop == '-' and x == phi and isinstance(y, int):
+        return -y
+    return None
+
+def strength_reduce(g: CFG) -> int:
+    # A basic induction variable is a header phi i.2 = phi(init, i.3) with
+    # i.3 = i.2 + c for a constant c. Each derived one, t = i.2 * k or
+    # t = i.3 * k with k invariant, becomes a phi of its own:
+    #     preheader   r.0 = init * k
+    #     header      r.2 = phi(r.0, r.3)
+    #     after i.3   r.3 = r.2 + c * k
+    # and reads of t read r.2 (or r.3). The loop test 'i.2 < n' becomes
+    # 'r.2 < n * k' for a positive constant k (linear function test
+    # replacement), which leaves the counter dead for DCE. A MUL and an ADD
+    # cost the VM the same step, so this only pays when the counter goes
+    # away: an IV is reduced only if its products, its own increment and
+    # tests that can be replaced are all that read it. At top level only
+    # temps are reduced: a user variable has to end up in its register,
+    # which would cost the copy the multiplication was replaced to save.
+    is_stable = stable(g)
+    readers: Dict[str, List[tuple]] = {}
+    reduced = 0
+    for loop in find_loops(g):
+        if not readers:   # (again after an inner loop was rewritten)
+            for b in g.blocks:
+                for instr in b.instrs:
+                    for x in set(defs_uses(instr)[1]):
+                        if isinstance(x, str):
+                            readers.setdefault(x, []).append(instr)
+        h = loop.header
+        if len(loop.latches) != 1 or len(h.preds) != 2 or loop.latches[0] not in h.preds:
+            continue
+        inside = set()
+        where: Dict[str, tuple] = {}
+        for b in loop.blocks:
+            for instr in b.instrs:
+                for d in defs_uses(instr)[0]:
+                    inside.add(d)
+                    where[d] = (b, instr)
+        invariant = lambda x: is_stable(x) and x not in inside
+
+        latch = h.preds.index(loop.latches[0])
+        ivs = {}   # phi -> (init, next, step, phi instr)
+        for instr in h.instrs:
+            if instr[0] != 'PHI':
+                break
+            nxt = instr[2][latch]
+            c = _step(where.get(nxt, (None, None))[1], instr[1])
+            if c is not None and invariant(instr[2][1 - latch]):
+                ivs[instr[1]] = (instr[2][1 - latch], nxt, c, instr)
+
+        plans = []   # (phi, [(mul, operand read, k)], [tests], k for the tests)
+        for phi, (init, nxt, c, phi_instr) in ivs.items():
+            inc = where[nxt][1]
+            muls, tests, other = [], [], False
+            for x in (phi, nxt):
+                for instr in readers.get(x, ()):
+                    if instr is inc or instr is phi_instr:
+                        continue
+                    if instr[0] == 'BIN' and instr[2] == '*' and is_version(instr[1]) \
+                            and (g.name is not None or TEMP.match(base(instr[1]))) \
+                            and instr[1] in inside:
+                        k = instr[4] if instr[3] == x else instr[3]
+                        if k != x and invariant(k):
+                            muls.append((instr, x, k))
+                            continue
+                    if x == phi and instr[0] == 'BIN' and instr[2] in RELOPS:
+                        y = instr[4] if instr[3] == x else instr[3]
+                        if y != x and invariant(y):
+                            tests.append(instr)
+                            continue
+                    other = True
+            positive = [k for _, _, k in muls if isinstance(k, int) and k > 0]
+            if muls and not other and (positive or not tests):
+                plans.append((phi, muls, tests, positive[0] if tests else None))
+        if not plans:
+            continue
+
+        pre = preheader(g, loop)
+        at = len(pre.instrs) - (pre.terminator is not None)
+        entry = h.preds.index(pre)     # preheader() may reorder the preds
+        def pre_bin(name: str, a, b):
+            nonlocal at
+            if isinstance(a, int) and isinstance(b, int):
+                return a * b
+            if a in (0, 1):
+                return b if a else 0
+            v = new_version(g, name)
+            pre.instrs.insert(at, ('BIN', v, '*', a, b))
+            at += 1
+            return v
+
+        rename: Dict[str, str] = {}
+        replace: Dict[int, tuple] = {}
+        for phi, muls, tests, test_k in plans:
+            init, nxt, c, _ = ivs[phi]
+            made: Dict[object, tuple] = {}   # k -> (r phi, r next)
+            for instr, x, k in muls:
+                if k not in made:
+                    d = instr[1]
+                    r0 = pre_bin(d, init, k)
+                    step = pre_bin(d, c, k)
+                    r2, r3 = new_version(g, d), new_version(g, d)
+                    ops = [None, None]
+                    ops[entry], ops[1 - entry] = r0, r3
+                    h.instrs.insert(0, ('PHI', r2, ops))
+                    b, inc = where[nxt]
+                    b.instrs.insert(b.instrs.index(inc) + 1, ('BIN', r3, '+', r2, step))
+                    made[k] = (r2, r3)
+                r2, r3 = made[k]
+                rename[instr[1]] = r2 if x == phi else r3
+                replace[id(instr)] = None
+                reduced += 1
+            for instr in tests:
+                _, d, bop, x, y = instr
+                r2 = made[test_k][0]
+                if x == phi:
+                    replace[id(instr)] = ('BIN', d, bop, r2, pre_bin(d, y, test_k))
+                else:
+                    replace[id(instr)] = ('BIN', d, FLIPPED[bop], r2, pre_bin(d, x, test_k))
+
+        for b in g.blocks:
+            new = []
+            for instr in b.instrs:
+                instr = replace.get(id(instr), instr)
+                if instr is not None:
+                    new.append(map_uses(instr, lambda x: rename.get(x, x)))
+            b.instrs = new
+        readers = {}
+    return reduced
@@ -1,4 +1,6 @@
 # Mini Compiler Main Script (clean, sectioned output)
+import argparse
+import ast as pyast
 import sys, os, shutil
 from typing import Any, List, Tuple
 
@@ -6,9 +8,16 @@ from lexer import tokenize
 from my_parser import Parser
 from semantic import build_symbol_table
 from ir import generate_ir
-from optimizer import optimize_ir
+from consteval import EVAL_STEPS
+from inline import INLINE_BUDGET
+from passes import LEVELS, PASSES, PassManager, pipeline
+from regalloc import REGISTERS
 from codegen import generate_machine_code
-from vm import run_machine_code
+from vm import load_machine_code, run_machine_code
+from pybackend import generate_python, run_python_code
+from image import is_image, load_image, write_image
+
+BACKENDS = ('vm', 'py')
 
 # ========== Pretty Printing Helpers ==========
 ANSI = {
@@ -125,6 +134,8 @@ def format_ir(ir_code):
         if op == 'FUNC':
             _, name, params = instr
             out.append(f"FUNC {name}({', '.join(params)})")
+        elif op == 'ENDFUNC':
+            out.append(f"ENDFUNC {instr[1]}")
         elif op == 'LABEL':
             out.append(f"LABEL {instr[1]}")
         elif op == 'JMP':
@@ -139,7 +150,8 @@ def format_ir(ir_code):
             out.append(f"{d} = {a} {bop} {b}")
         elif op == 'CALL':
             _, d, name, args = instr
-            out.append(f"{d} = CALL {name}({', '.join(map(str, args))})")
+            call = f"CALL {name}({', '.join(map(str, args))})"
+            out.append(call if d is None else f"{d} = {call}")
         elif op == 'RET':
             _, v = instr
             out.append(f"RET {v}")
@@ -155,7 +167,7 @@ def format_machine_code(code: List[str]) -> str:
         if line.startswith('LABEL'):
             out.append("")
             out.append(c(line, 'yellow'))
-        elif line.startswith(('JZ', 'JMP')):
+        elif line.startswith(('JZ', 'JMP', 'HALT')):
             out.append(c(line, 'cyan'))
         elif line.startswith(('GT','LT','EQ','NE','GE','LE')):
             out.append(c(line, 'blue'))
@@ -170,15 +182,7 @@ def read_source_from_file(path: str) -> str:
         return fh.read()
 
 
-def run_source(code: str) -> None:
-    header("Source Code")
-    print(c("""""" + code.strip() + """""", 'green'))
-
-    # LEXER
-    tokens_full = tokenize(code)  # [(KIND, LEXEME, LINE, COL)]
-    header("Tokens")
-    print(format_tokens(tokens_full))
-
+def parser_tokens(tokens_full):
     # For the parser, convert to (KIND, VALUE) as it expects
     tokens = []
     for kind, lexeme, ln, col in tokens_full:
@@ -187,9 +191,71 @@ def run_source(code: str) -> None:
             tokens.append((kind, int(lexeme)))
         else:
             tokens.append((kind, lexeme))
+    return tokens
+
+
+def compile_source(code: str, level: int = 2, eval_steps: int = EVAL_STEPS) -> List[str]:
+    # Whole pipeline without the printing, source -> machine code
+    ast = Parser(parser_tokens(tokenize(code))).parse()
+    pm = PassManager(LEVELS[level], eval_steps=eval_steps)
+    return pm.run_mc(generate_machine_code(pm.run_ir(generate_ir(ast))))
+
+
+def print_result(res) -> None:
+    print("Registers:", res.get('registers'))
+    print("Output:", res.get('output'))
+    stats = res.get('stats', {})
+    fused = ", ".join(f"{k}={v}" for k, v in stats.get('fused', {}).items())
+    print("Steps:", stats.get('steps'), f"(fused: {fused})" if fused else "")
+
+
+def execute(prog, profile: str = None, flamegraph: str = None) -> None:
+    header("Execution")
+    res = run_machine_code(prog, profile=bool(profile or flamegraph))
+    print_result(res)
+    prof = res.get('profile')
+    if prof is None:
+        return
+    header("Profile")
+    report = prof.report()
+    width = max(len(name) for name in report['functions'])
+    for name, f in report['functions'].items():
+        print(f"{name.ljust(width)}  calls={f['calls']}  inclusive={f['inclusive']}  exclusive={f['exclusive']}")
+    for label, n in report['loops'].items():
+        print(f"loop {label}: {n} iterations")
+    if profile:
+        with open(profile, 'w', encoding='utf-8') as fh:
+            fh.write(prof.to_json())
+        print(f"Wrote {profile}")
+    if flamegraph:
+        with open(flamegraph, 'w', encoding='utf-8') as fh:
+            fh.write(prof.collapsed() + "\n")
+        print(f"Wrote {flamegraph}")
+
+
+def run_image(path: str, profile: str = None, flamegraph: str = None) -> None:
+    # Precompiled image: no lexing, parsing, optimization or decoding
+    execute(load_image(path), profile, flamegraph)
+
+
+def run_source(code: str, backend: str = 'vm', image: str = None,
+               profile: str = None, flamegraph: str = None,
+               inline_budget: int = INLINE_BUDGET, registers: int = REGISTERS,
+               passes: List[str] = LEVELS[2], time_passes: bool = False,
+               verify: bool = False, eval_steps: int = EVAL_STEPS) -> None:
+    pm = PassManager(passes, debug=verify, inline_budget=inline_budget, registers=registers,
+                     eval_steps=eval_steps)
+
+    header("Source Code")
+    print(c("""""" + code.strip() + """""", 'green'))
+
+    # LEXER
+    tokens_full = tokenize(code)  # [(KIND, LEXEME, LINE, COL)]
+    header("Tokens")
+    print(format_tokens(tokens_full))
 
     # PARSER
-    parser = Parser(tokens)
+    parser = Parser(parser_tokens(tokens_full))
     ast = parser.parse()
     header("AST")
     print(format_ast(ast))
@@ -210,27 +276,80 @@ def run_source(code: str) -> None:
     print(format_ir(ir_code))
 
     # Optimizer
-    optimized_ir = optimize_ir(ir_code)
+    optimized_ir = pm.run_ir(ir_code)
     header("Optimized IR")
     print(format_ir(optimized_ir))
 
+    if backend == 'py':
+        # Python backend: IR -> ast.Module -> bytecode
+        module = generate_python(optimized_ir)
+        header("Python Code")
+        print(pyast.unparse(module))
+
+        header("Execution")
+        res = run_python_code(compile(module, '<minicompiler>', 'exec'))
+        print("Registers:", res.get('registers'))
+        print("Output:", res.get('output'))
+        if time_passes:
+            header("Passes")
+            print(pm.report())
+        return
+
     # Codegen
-    machine_code = generate_machine_code(optimized_ir)
+    machine_code = pm.run_mc(generate_machine_code(optimized_ir))
     header("Machine Code")
     print(format_machine_code(machine_code))
+    if time_passes:
+        header("Passes")
+        print(pm.report())
+
+    prog = load_machine_code(machine_code if isinstance(machine_code, list) else list(machine_code))
+    if image:
+        size = write_image(prog, image)
+        header("Image")
+        print(f"Wrote {image} ({size} bytes)")
 
     # VM
-    header("Execution")
-    res = run_machine_code(machine_code if isinstance(machine_code, list) else list(machine_code))
-    print("Registers:", res.get('registers'))
-    print("Output:", res.get('output'))
+    execute(prog, profile, flamegraph)
 
 
 if __name__ == "__main__":
+    ap = argparse.ArgumentParser()
+    ap.add_argument('file', nargs='?')
+    ap.add_argument('--backend', choices=BACKENDS, default='vm',
+                    help="vm: machine code on the register VM, py: compile to Python bytecode")
+    ap.add_argument('--emit-image', metavar='PATH',
+                    help="also write the loaded program as a binary image (vm backend)")
+    ap.add_argument('--profile', metavar='PATH',
+                    help="profile the guest program and write the report as JSON (vm backend)")
+    ap.add_argument('--flamegraph', metavar='PATH',
+                    help="write collapsed call stacks for flamegraph tools (vm backend)")
+    ap.add_argument('--inline-budget', type=int, default=INLINE_BUDGET, metavar='N',
+                    help="inline guest functions of at most N IR instructions (0: never)")
+    ap.add_argument('--registers', type=int, default=REGISTERS, metavar='K',
+                    help="registers per function for compiler temps (0: one slot per name)")
+    ap.add_argument('--eval-steps', type=int, default=EVAL_STEPS, metavar='N',
+                    help="evaluate calls of pure functions on constants if they return "
+                         "within N IR instructions (0: never)")
+    ap.add_argument('-O', dest='level', type=int, choices=sorted(LEVELS), default=2,
+                    help="optimization level (0: none, 1: cheap passes, 2: all)")
+    ap.add_argument('--passes', metavar='LIST',
+                    help=f"run these passes instead of an -O level, comma-separated "
+                         f"({','.join(PASSES)}; '' for none)")
+    ap.add_argument('--time-passes', action='store_true',
+                    help="print runs, changes, instructions removed and time per pass")
+    ap.add_argument('--verify-ir', action='store_true',
+                    help="check the IR after every pass and stop at the first broken one")
+    args = ap.parse_args()
+    try:
+        passes = LEVELS[args.level] if args.passes is None else pipeline(args.passes)
+    except ValueError as e:
+        ap.error(str(e))
+
     fname = None
     # prefer first command-line arg
-    if len(sys.argv) > 1:
-        fname = sys.argv[1]
+    if args.file:
+        fname = args.file
     # else look for program.src in current folder
     elif os.path.exists("program.src"):
         fname = "program.src"
@@ -238,6 +357,14 @@ if __name__ == "__main__":
     elif os.path.exists(os.path.join(os.path.dirname(__file__), "program.src")):
         fname = os.path.join(os.path.dirname(__file__), "program.src")
 
+    if fname and is_image(fname):
+        try:
+            run_image(fname, args.profile, args.flamegraph)
+        except Exception as e:
+            header("Error")
+            print(c(type(e).__name__ + ": " + str(e), 'red'))
+        sys.exit(0)
+
     if fname and os.path.exists(fname):
         code = read_source_from_file(fname)
     else:
@@ -251,7 +378,9 @@ if __name__ == "__main__":
         )
 
     try:
-        run_source(code)
+        run_source(code, args.backend, args.emit_image, args.profile, args.flamegraph,
+                   args.inline_budget, args.registers, passes, args.time_passes,
+                   args.verify_ir, args.eval_steps)
     except Exception as e:
         header("Error")
         print(c(type(e).__name__ + ": " + str(e), 'red'))
@@ -1,4 +1,9 @@
-from typing import List, Tuple, Union
+from typing import Dict, List, Tuple, Union
+
+from cfg import CFG, defs_uses, dominator_tree, map_defs, map_uses
+from inline import INLINE_BUDGET
+from regalloc import REGISTERS
+from ssa import is_version, stable
 
 TInstr = Tuple
 TOperand = Union[int, str]
@@ -9,7 +14,366 @@ RELOP = {'<','<=','>','>=','==','!='}
 def is_int(x):
     return isinstance(x, int)
 
-def optimize_ir(ir_code: List[TInstr]) -> List[TInstr]:
+def fold(bop: str, a: int, b: int) -> int:
+    # same results as the VM: '/' floors and gives 0 on division by zero
+    if bop == '+':  return a + b
+    if bop == '-':  return a - b
+    if bop == '*':  return a * b
+    if bop == '/':  return a // b if b != 0 else 0
+    if bop == '<':  return int(a <  b)
+    if bop == '<=': return int(a <= b)
+    if bop == '>':  return int(a >  b)
+    if bop == '>=': return int(a >= b)
+    if bop == '==': return int(a == b)
+    return int(a != b)
+
+def simplify(instr: TInstr) -> TInstr:
+    # algebraic identities: x+0, x-0, x*1, x/1 -> x; x*0 -> 0
+    if instr[0] != 'BIN':
+        return instr
+    _, d, bop, a, b = instr
+    if is_int(a) and is_int(b):
+        return ('MOV', d, fold(bop, a, b))
+    if bop == '+' and (a == 0 or b == 0):
+        return ('MOV', d, b if a == 0 else a)
+    if bop in ('-', '/') and b == (0 if bop == '-' else 1):
+        return ('MOV', d, a)
+    if bop == '*' and (a == 1 or b == 1):
+        return ('MOV', d, b if a == 1 else a)
+    if bop == '*' and (a == 0 or b == 0):
+        return ('MOV', d, 0)
+    return instr
+
+# ========== Sparse conditional constant propagation ==========
+
+BOTTOM = object()   # overdefined; a missing entry means not yet known
+
+def sccp(g: CFG) -> int:
+    # Wegman & Zadeck over SSA: values and reachable edges are discovered
+    # together, so a branch on a constant never makes the other arm's
+    # definitions overdefined. Afterwards constant versions are substituted
+    # into their uses (and their defs dropped), CJZs on constants become
+    # JMPs or fall through, and blocks never reached are deleted.
+    # Returns the number of instructions removed or rewritten.
+    defined = set()
+    uses: Dict[str, List[Tuple]] = {}
+    for b in g.blocks:
+        for instr in b.instrs:
+            d, u = defs_uses(instr)
+            defined.update(d)
+            for x in u:
+                if isinstance(x, str):
+                    uses.setdefault(x, []).append((b, instr))
+
+    values: Dict[str, object] = {}
+
+    def value(x):
+        if isinstance(x, int):
+            return x
+        if is_version(x):
+            return values.get(x)
+        return values.get(x, BOTTOM)
+
+    # entry values: whatever the code defines itself starts out 0; globals,
+    # parameters and pinned names are unknown
+    entry = {x.split('.', 1)[0] for x in defined if is_version(x)}
+    for x in entry:
+        values[x] = 0
+
+    edges = set()
+    reached = set()
+    flow = [(None, g.entry)]
+    ssa_work: List[str] = []
+
+    def lower(x: str, v) -> None:
+        if not is_version(x):
+            return      # a pinned global: other stores and callees see it too
+        old = values.get(x)
+        if old is BOTTOM or (old is not None and v is not BOTTOM and old == v):
+            return
+        values[x] = v if old is None else BOTTOM
+        ssa_work.append(x)
+
+    def visit(b, instr) -> None:
+        op = instr[0]
+        if op == 'PHI':
+            v = None
+            for p, x in zip(b.preds, instr[2]):
+                if (p, b) not in edges:
+                    continue
+                xv = value(x)
+                if xv is None:
+                    continue
+                if xv is BOTTOM or (v is not None and v != xv):
+                    v = BOTTOM
+                    break
+                v = xv
+            if v is not None:
+                lower(instr[1], v)
+        elif op == 'MOV':
+            v = value(instr[2])
+            if v is not None:
+                lower(instr[1], v)
+        elif op == 'BIN':
+            x, y = value(instr[3]), value(instr[4])
+            if instr[2] == '*' and (x == 0 or y == 0) and x is not None and y is not None:
+                lower(instr[1], 0)
+            elif x is None or y is None:
+                return
+            elif x is BOTTOM or y is BOTTOM:
+                lower(instr[1], BOTTOM)
+            else:
+                lower(instr[1], fold(instr[2], x, y))
+        elif op == 'CALL':
+            if instr[1] is not None:
+                lower(instr[1], BOTTOM)
+        elif op == 'CJZ':
+            c = value(instr[1])
+            if c is None:
+                return
+            if c is BOTTOM:
+                flow.extend((b, s) for s in b.succs)
+            elif c != 0:
+                flow.append((b, b.succs[0]))
+            elif len(b.succs) > 1:
+                flow.append((b, b.succs[1]))
+        elif op == 'JMP':
+            flow.extend((b, s) for s in b.succs)
+
+    while flow or ssa_work:
+        while flow:
+            p, b = flow.pop()
+            if p is not None:
+                if (p, b) in edges:
+                    continue
+                edges.add((p, b))
+            first = b not in reached
+            reached.add(b)
+            for instr in b.instrs:
+                if instr[0] == 'PHI' or first:
+                    visit(b, instr)
+            if first and b.falls_through() and not (b.terminator and b.terminator[0] == 'CJZ'):
+                flow.extend((b, s) for s in b.succs)
+        while ssa_work and not flow:
+            for b, instr in uses.get(ssa_work.pop(), ()):
+                if b in reached:
+                    visit(b, instr)
+
+    # Rewrite: drop edges never taken, then substitute the constants (and
+    # simplify what they leave behind)
+    changed = 0
+    for b in list(g.blocks):
+        if b not in reached:
+            continue
+        for s in [s for s in b.succs if (b, s) not in edges]:
+            t = b.terminator
+            if t is not None and t[0] == 'CJZ':
+                if s is b.succs[0]:
+                    b.instrs[-1] = ('JMP', t[2])
+                else:
+                    b.instrs.pop()
+                changed += 1
+            g.remove_edge(b, s)
+    changed += g.remove_unreachable()
+
+    # entry values are substituted too: once the defs on the edges dropped
+    # above are gone, a plain local left out of SSA would read the global
+    def const(x):
+        v = values.get(x) if is_version(x) or x in entry else None
+        return x if v is None or v is BOTTOM else v
+
+    for b in g.blocks:
+        new = []
+        for instr in b.instrs:
+            d = defs_uses(instr)[0]
+            if d and instr[0] != 'CALL' and const(d[0]) != d[0]:
+                changed += 1
+                continue
+            new.append(simplify(map_uses(instr, const)))
+        b.instrs = new
+    return changed
+
+# ========== Dead code elimination ==========
+
+def dce(g: CFG) -> int:
+    # Mark and sweep over SSA: CALLs, branches, RETs, EXITs and stores to
+    # names outside SSA (pinned globals) are live, and so is every def they
+    # transitively read. MOVs, BINs and PHIs nobody needs are deleted, and
+    # a CALL whose result is dead loses its destination so codegen skips
+    # the 'MOV t, _ret'. A name whose every def goes keeps reading its
+    # entry value, 0: uses of the plain name become 0, or out of SSA it
+    # would be a global read the callee copies in on CALL. Returns the
+    # number of instructions changed.
+    def_at: Dict[str, Tuple] = {}
+    work: List[Tuple] = []
+    for b in g.blocks:
+        for instr in b.instrs:
+            d = defs_uses(instr)[0]
+            for x in d:
+                def_at[x] = instr
+            if instr[0] not in ('MOV', 'BIN', 'PHI') or not is_version(d[0]):
+                work.append(instr)
+    live_defs = set()
+    marked = {id(i) for i in work}
+    while work:
+        for x in defs_uses(work.pop())[1]:
+            if not isinstance(x, str) or x in live_defs:
+                continue
+            live_defs.add(x)
+            instr = def_at.get(x)
+            if instr is not None and id(instr) not in marked:
+                marked.add(id(instr))
+                work.append(instr)
+
+    entry = {x.split('.', 1)[0] for x in def_at if is_version(x)}
+    zero = lambda x: 0 if x in entry else x
+    changed = 0
+    for b in g.blocks:
+        new = []
+        for instr in b.instrs:
+            if id(instr) not in marked:
+                changed += 1
+                continue
+            if any(x in entry for x in defs_uses(instr)[1]):
+                instr = map_uses(instr, zero)
+                changed += 1
+            if instr[0] == 'CALL' and instr[1] is not None and instr[1] not in live_defs \
+                    and is_version(instr[1]):
+                instr = ('CALL', None, instr[2], instr[3])
+                changed += 1
+            new.append(instr)
+        b.instrs = new
+    return changed
+
+# ========== Copy propagation and temp coalescing ==========
+
+def coalesce_temps(g: CFG) -> int:
+    # 'BIN t.1, +, a, b / MOV x.2, t.1' -> 'BIN x.2, +, a, b' whenever the
+    # MOV is the temp's only use: in SSA renaming the single def is enough
+    count: Dict[str, int] = {}
+    for b in g.blocks:
+        for instr in b.instrs:
+            for x in defs_uses(instr)[1]:
+                if isinstance(x, str):
+                    count[x] = count.get(x, 0) + 1
+    rename: Dict[str, str] = {}
+    for b in g.blocks:
+        for instr in b.instrs:
+            if instr[0] == 'MOV' and is_version(instr[1]) and is_version(instr[2]) \
+                    and count[instr[2]] == 1:
+                rename[instr[2]] = instr[1]
+    if not rename:
+        return 0
+    def final(x):
+        while x in rename:
+            x = rename[x]
+        return x
+    for b in g.blocks:
+        new = []
+        for instr in b.instrs:
+            if instr[0] == 'MOV' and instr[2] in rename:
+                continue
+            new.append(map_defs(instr, final))
+        b.instrs = new
+    return len(rename)
+
+def propagate_copies(g: CFG) -> int:
+    # 'MOV x.2, y' -> later reads of x.2 read y. y has to keep its value
+    # wherever x.2 is read: an SSA version, or in a function a global (the
+    # caller can't run while it does). _argN is call scratch, so only a
+    # function that makes no calls can keep reading it; top-level names
+    # outside SSA are pinned. Phi operands are left alone: propagating into
+    # them only makes out-of-SSA add copies.
+    calls = any(i[0] == 'CALL' for b in g.blocks for i in b.instrs)
+    copies: Dict[str, str] = {}
+    for b in g.blocks:
+        for instr in b.instrs:
+            if instr[0] != 'MOV' or not is_version(instr[1]):
+                continue
+            src = instr[2]
+            if is_version(src) or (g.name is not None and isinstance(src, str)
+                                   and not (calls and src.startswith('_arg'))):
+                copies[instr[1]] = src
+    if not copies:
+        return 0
+    def final(x):
+        while x in copies:
+            x = copies[x]
+        return x
+    changed = 0
+    for b in g.blocks:
+        new = []
+        for instr in b.instrs:
+            if instr[0] != 'PHI':
+                rewritten = map_uses(instr, final)
+                changed += rewritten != instr
+                instr = rewritten
+            new.append(instr)
+        b.instrs = new
+    return changed
+
+# ========== Global value numbering ==========
+
+COMMUTATIVE = {'+', '*', '==', '!='}
+
+def gvn(g: CFG) -> int:
+    # Dominator-based value numbering: walking the dominator tree with a
+    # scoped table, a BIN whose (op, operands) was already computed in a
+    # dominating block is dropped and its reads go to the earlier result.
+    # Every block sees its own earlier instructions first, so this is the
+    # local pass too. SSA names never change value, which is what makes a
+    # table entry stay valid; names that can change (pinned top-level
+    # names, _argN once the function makes calls) are never put in one.
+    is_stable = stable(g)
+    same: Dict[str, str] = {}
+    def vn(x):
+        while x in same:
+            x = same[x]
+        return x
+
+    table: Dict[Tuple, str] = {}
+    idom = g.dominators()
+    children = dominator_tree(idom)
+    work = [(g.entry, None)]
+    while work:
+        b, added = work.pop()
+        if added is not None:
+            for key in added:
+                del table[key]
+            continue
+        added = []
+        new = []
+        for instr in b.instrs:
+            if instr[0] == 'PHI':
+                ops = {vn(x) for x in instr[2]}
+                if len(ops) == 1 and is_version(instr[1]):
+                    op = ops.pop()
+                    if op != instr[1] and is_stable(op):
+                        same[instr[1]] = op
+                        continue
+            elif instr[0] == 'BIN' and is_version(instr[1]):
+                _, d, bop, x, y = instr
+                x, y = vn(x), vn(y)
+                if is_stable(x) and is_stable(y):
+                    if bop in COMMUTATIVE and str(x) > str(y):
+                        x, y = y, x
+                    key = (bop, x, y)
+                    if key in table:
+                        same[d] = table[key]
+                        continue
+                    table[key] = d
+                    added.append(key)
+            new.append(instr)
+        b.instrs = new
+        work.append((b, added))
+        work.extend((c, None) for c in children[b])
+    if same:
+        for b in g.blocks:
+            b.instrs = [map_uses(i, vn) for i in b.instrs]
+    return len(same)
+
+def fold_ir(ir_code: List[TInstr]) -> List[TInstr]:
+    # linear IR: BINs on two constants become MOVs, 'MOV x, x' goes away
     out: List[TInstr] = []
     for instr in ir_code:
         if not instr:
@@ -17,28 +381,17 @@ def optimize_ir(ir_code: List[TInstr]) -> List[TInstr]:
         op = instr[0]
         if op == 'BIN':
             _, dst, bop, a, b = instr
-            if is_int(a) and is_int(b):
-                if bop in ARITH or bop in RELOP:
-                    if bop == '+':  val = a + b
-                    elif bop == '-': val = a - b
-                    elif bop == '*': val = a * b
-                    elif bop == '/': val = a // b if b != 0 else 0
-                    elif bop == '<':  val = int(a <  b)
-                    elif bop == '<=': val = int(a <= b)
-                    elif bop == '>':  val = int(a >  b)
-                    elif bop == '>=': val = int(a >= b)
-                    elif bop == '==': val = int(a == b)
-                    elif bop == '!=': val = int(a != b)
-                    out.append(('MOV', dst, val))
-                    continue
-        out.append(instr)
-
-    # Remove MOV x,x
-    tmp = []
-    for instr in out:
-        if instr[0] == 'MOV' and isinstance(instr[2], str) and instr[1] == instr[2]:
+            if is_int(a) and is_int(b) and (bop in ARITH or bop in RELOP):
+                out.append(('MOV', dst, fold(bop, a, b)))
+                continue
+        if op == 'MOV' and isinstance(instr[2], str) and instr[1] == instr[2]:
             continue
-        tmp.append(instr)
-    out = tmp
+        out.append(instr)
+    return out
 
-    return out
\ No newline at end of file
+def optimize_ir(ir_code: List[TInstr], inline_budget: int = INLINE_BUDGET,
+                registers: int = REGISTERS) -> List[TInstr]:
+    # the IR part of the -O2 pipeline (passes.py drives it)
+    from passes import LEVELS, PassManager
+    pm = PassManager(LEVELS[2], inline_budget=inline_budget, registers=registers)
+    return pm.run_ir(ir_code)
@@ -0,0 +1,367 @@
+# Optimization pass manager.
+#
+# A pipeline is a list of pass names; each pass belongs to one stage and the
+# stages always run in this order, whatever order the list gives them in:
+#   ir     linear IR, once each in list order (eval, inline, fold)
+#   ssa    per CFG in SSA form, to a fixed point: a worklist starts with every
+#          pass in list order and a pass that changes something puts the
+#          others back on it (at most MAX_RUNS runs per pass and CFG)
+#   post   all CFGs together after SSA destruction, once each (regalloc)
+#   mc     machine-code lines from codegen, to a fixed point like ssa
+# The CFGs are only built when a ssa or post pass is asked for, so -O0
+# hands the IR from the lowering to codegen unchanged. A name the passes
+# leave without any write still gets 0 in its frame (keep_names()).
+#
+# Every run is timed and its instruction count taken before and after;
+# report() prints runs, changes, instructions removed and time per pass.
+# With debug=True the IR is verified after every pass and a VerifyError
+# names the pass that broke it.
+import time
+from collections import deque
+from typing import Callable, Dict, List, Optional, Set
+
+from cfg import CFG, build_cfgs, defs_uses, jump_target, linearize, split_functions
+from consteval import EVAL_STEPS, ConstEvaluator, eval_calls, fold_calls
+from inline import INLINE_BUDGET, inline_calls
+from loops import licm, strength_reduce
+from optimizer import coalesce_temps, dce, fold_ir, gvn, propagate_copies, sccp
+from peephole import drop_moves, drop_next_jumps, drop_unreachable, thread_jumps
+from regalloc import REGISTERS, allocate
+from ssa import TEMP, from_ssa, is_version, to_ssa
+from vm import dest_name
+
+MAX_RUNS = 4
+
+class VerifyError(Exception):
+    pass
+
+class Pass:
+    def __init__(self, name: str, stage: str, run: Callable, doc: str):
+        self.name = name
+        self.stage = stage
+        self.run = run      # ir/mc: code -> (code, changes); ssa: CFG -> changes;
+                            # post: [CFG] -> changes
+        self.doc = doc
+
+def _linear(f):
+    def run(code, pm):
+        new = f(code, pm)
+        return new, int(new != code)
+    return run
+
+PASSES: Dict[str, Pass] = {p.name: p for p in [
+    Pass('eval', 'ir', lambda ir, pm: eval_calls(ir, pm.consts),
+         "evaluate pure functions on literal arguments"),
+    Pass('inline', 'ir', _linear(lambda ir, pm: inline_calls(ir, pm.inline_budget)),
+         "inline small non-recursive functions"),
+    Pass('fold', 'ir', _linear(lambda ir, pm: fold_ir(ir)), "fold constant BINs, drop MOV x, x"),
+    Pass('sccp', 'ssa', lambda g, pm: sccp(g), "sparse conditional constant propagation"),
+    Pass('calls', 'ssa', lambda g, pm: fold_calls(g, pm.consts),
+         "evaluate pure functions on constant arguments"),
+    Pass('coalesce', 'ssa', lambda g, pm: coalesce_temps(g), "write results straight to their copy"),
+    Pass('copies', 'ssa', lambda g, pm: propagate_copies(g), "copy propagation"),
+    Pass('gvn', 'ssa', lambda g, pm: gvn(g), "global value numbering"),
+    Pass('licm', 'ssa', lambda g, pm: licm(g), "loop-invariant code motion"),
+    Pass('ivsr', 'ssa', lambda g, pm: strength_reduce(g), "induction-variable strength reduction"),
+    Pass('dce', 'ssa', lambda g, pm: dce(g), "dead code elimination"),
+    Pass('regalloc', 'post', lambda cfgs, pm: allocate(cfgs, pm.registers),
+         "linear-scan register allocation"),
+    Pass('thread', 'mc', lambda mc, pm: thread_jumps(mc), "jump threading"),
+    Pass('next', 'mc', lambda mc, pm: drop_next_jumps(mc), "drop jumps to the next line"),
+    Pass('unreachable', 'mc', lambda mc, pm: drop_unreachable(mc), "drop unreachable code"),
+    Pass('moves', 'mc', lambda mc, pm: drop_moves(mc), "drop redundant MOVs"),
+]}
+
+LEVELS = {
+    0: [],
+    1: ['fold', 'sccp', 'coalesce', 'copies', 'dce', 'regalloc', 'thread', 'next', 'unreachable', 'moves'],
+    2: ['eval', 'inline', 'fold', 'sccp', 'calls', 'coalesce', 'copies', 'gvn', 'licm', 'ivsr', 'dce',
+        'regalloc', 'thread', 'next', 'unreachable', 'moves'],
+}
+
+def pipeline(spec: str) -> List[str]:
+    # 'sccp,dce,...' -> pass names, checked
+    names = [n.strip() for n in spec.split(',') if n.strip()]
+    unknown = [n for n in names if n not in PASSES]
+    if unknown:
+        raise ValueError(f"unknown pass: {', '.join(unknown)} (known: {', '.join(PASSES)})")
+    return names
+
+class PassStats:
+    def __init__(self, name: str):
+        self.name = name
+        self.runs = 0
+        self.changes = 0
+        self.removed = 0
+        self.seconds = 0.0
+
+def _size(code) -> int:
+    # instructions, not counting labels
+    if isinstance(code, CFG):
+        return sum(1 for b in code.blocks for i in b.instrs if i[0] != 'LABEL')
+    if code and isinstance(code[0], CFG):
+        return sum(_size(g) for g in code)
+    return sum(1 for i in code if (i[0] if isinstance(i, tuple) else i.split()[0]) != 'LABEL')
+
+def _by_frame(code: list):
+    # linear IR or machine code -> (frame, names written, names read) per
+    # instruction; frame is the function's name, None for the top level
+    cur = None
+    for i in code:
+        if isinstance(i, tuple):
+            if i[0] in ('FUNC', 'ENDFUNC'):
+                cur = i[1] if i[0] == 'FUNC' else None
+                yield cur, [], []
+                continue
+            d, u = defs_uses(i)
+            yield cur, d, [x for x in u if isinstance(x, str)]
+        else:
+            parts = i.split()
+            if parts[0] == 'LABEL':
+                if parts[1].startswith('FUNC_'):
+                    cur = parts[1][len('FUNC_'):]
+                    yield cur, [], []
+                continue
+            # every operand counts as read: labels and callees only ever
+            # cost an unneeded 'MOV x, 0' below
+            yield cur, [d for d in [dest_name(parts)] if d is not None], \
+                [p.rstrip(',') for p in parts[1:]]
+
+def frame_names(code: list) -> Dict[Optional[str], Set[str]]:
+    # names each frame writes, which is what the VM goes by: a top-level
+    # user variable is reported in 'registers', a name a function writes
+    # anywhere is its local, anything else it reads is the global
+    out: Dict[Optional[str], Set[str]] = {None: set()}
+    for cur, defs, _ in _by_frame(code):
+        out.setdefault(cur, set()).update(
+            d for d in defs if not d.startswith('_arg') and d != '_ret'
+            and not (cur is None and TEMP.match(d)))
+    return out
+
+def keep_names(code: list, before: Dict[Optional[str], Set[str]]) -> list:
+    # names whose every write was optimized away (they sat in code that never
+    # runs, or were 'x = x') still hold 0: a top-level name gets 'MOV x, 0' up
+    # front to stay in 'registers', and a local that is still read gets it
+    # where its function starts, to stay local instead of reading the global
+    mc = bool(code) and isinstance(code[0], str)
+    mov = lambda x: f"MOV {x}, 0" if mc else ('MOV', x, 0)
+    now = frame_names(code)
+    read: Dict[Optional[str], Set[str]] = {}
+    for cur, _, uses in _by_frame(code):
+        read.setdefault(cur, set()).update(uses)
+    out = [mov(x) for x in sorted(before[None] - now[None])]
+    for i in code:
+        out.append(i)
+        if mc:
+            label = i.split()[1] if i.startswith('LABEL ') else ''
+        else:
+            label = i[1] if i[0] == 'LABEL' else ''
+        if label.startswith('FUNC_'):
+            f = label[len('FUNC_'):]
+            lost = (before.get(f, set()) - now.get(f, set())) & read.get(f, set())
+            out.extend(mov(x) for x in sorted(lost))
+    return out
+
+class PassManager:
+    def __init__(self, passes: List[str], debug: bool = False,
+                 inline_budget: int = INLINE_BUDGET, registers: int = REGISTERS,
+                 eval_steps: int = EVAL_STEPS):
+        self.passes = [PASSES[n] for n in passes]
+        self.debug = debug
+        self.inline_budget = inline_budget
+        self.registers = registers
+        self.eval_steps = eval_steps
+        self.consts: Optional[ConstEvaluator] = None   # the memo table lives here
+        self.stats: Dict[str, PassStats] = {p.name: PassStats(p.name) for p in self.passes}
+
+    def stage(self, name: str) -> List[Pass]:
+        return [p for p in self.passes if p.stage == name]
+
+    def _run(self, p: Pass, code):
+        stats = self.stats[p.name]
+        before = _size(code)
+        t0 = time.perf_counter()
+        if p.stage in ('ssa', 'post'):
+            changes = p.run(code, self)
+            after = code
+        else:
+            after, changes = p.run(code, self)
+        stats.seconds += time.perf_counter() - t0
+        stats.runs += 1
+        stats.changes += changes
+        stats.removed += before - _size(after)
+        if self.debug:
+            try:
+                if p.stage == 'mc':
+                    verify_mc(after)
+                elif p.stage == 'ir':
+                    verify_ir(after)
+                elif p.stage == 'ssa':
+                    verify_cfg(after, ssa=True)
+                else:
+                    for g in after:
+                        verify_cfg(g)
+            except VerifyError as e:
+                raise VerifyError(f"after {p.name}: {e}") from None
+        return after, changes
+
+    def _fixed_point(self, passes: List[Pass], code):
+        work = deque(passes)
+        queued = {p.name for p in passes}
+        runs: Dict[str, int] = {}
+        while work:
+            p = work.popleft()
+            queued.discard(p.name)
+            if runs.get(p.name, 0) >= MAX_RUNS:
+                continue
+            runs[p.name] = runs.get(p.name, 0) + 1
+            code, changes = self._run(p, code)
+            if changes:
+                for q in passes:
+                    if q is not p and q.name not in queued:
+                        work.append(q)
+                        queued.add(q.name)
+        return code
+
+    def run_ir(self, ir_code: List[tuple]) -> List[tuple]:
+        ir = [i for i in ir_code if i]
+        frames = frame_names(ir)
+        if 'eval' in self.stats or 'calls' in self.stats:
+            self.consts = ConstEvaluator(ir, self.eval_steps)
+        for p in self.stage('ir'):
+            ir, _ = self._run(p, ir)
+        ssa, post = self.stage('ssa'), self.stage('post')
+        if not ssa and not post:
+            return keep_names(ir, frames)
+        cfgs = build_cfgs(ir)
+        for g in cfgs:
+            g.remove_unreachable()
+        if ssa:
+            to_ssa(cfgs)
+            for g in cfgs:
+                self._fixed_point(ssa, g)
+            from_ssa(cfgs)
+        for p in post:
+            self._run(p, cfgs)
+        return keep_names(linearize(cfgs), frames)
+
+    def run_mc(self, lines: List[str]) -> List[str]:
+        mc = [l.strip() for l in lines if l.strip() and not l.strip().startswith('//')]
+        passes = self.stage('mc')
+        if not passes:
+            return list(lines)
+        before = frame_names(mc)
+        return keep_names(self._fixed_point(passes, mc), before)
+
+    def report(self) -> str:
+        rows = [(s.name, s.runs, s.changes, s.removed, s.seconds * 1000) for s in self.stats.values()]
+        width = max([len(r[0]) for r in rows] + [4])
+        out = [f"{'pass'.ljust(width)}  {'runs':>5} {'changes':>8} {'removed':>8} {'ms':>9}"]
+        for name, runs, changes, removed, ms in rows:
+            out.append(f"{name.ljust(width)}  {runs:>5} {changes:>8} {removed:>8} {ms:>9.2f}")
+        total = sum(r[4] for r in rows)
+        out.append(f"{'total'.ljust(width)}  {'':>5} {'':>8} {sum(r[3] for r in rows):>8} {total:>9.2f}")
+        return "\n".join(out)
+
+# ========== Verification (debug mode) ==========
+
+ARITY = {'MOV': 3, 'BIN': 5, 'CALL': 4, 'CJZ': 3, 'JMP': 2, 'LABEL': 2, 'RET': 2,
+         'FUNC': 3, 'ENDFUNC': 2}
+
+def verify_ir(ir: List[tuple]) -> None:
+    # shapes, FUNC/ENDFUNC nesting and jumps to labels of the same function
+    top, funcs = split_functions(ir)
+    depth = 0
+    for instr in ir:
+        if ARITY.get(instr[0]) != len(instr):
+            raise VerifyError(f"malformed instruction {instr!r}")
+        if instr[0] == 'FUNC':
+            depth += 1
+        elif instr[0] == 'ENDFUNC':
+            depth -= 1
+        if depth not in (0, 1):
+            raise VerifyError("FUNC/ENDFUNC out of balance")
+    if depth:
+        raise VerifyError("FUNC without ENDFUNC")
+    for name, code in [(None, top)] + [(n, c) for n, _, c in funcs]:
+        labels = {i[1] for i in code if i[0] == 'LABEL'}
+        for i in code:
+            t = jump_target(i)
+            if t is not None and t not in labels:
+                raise VerifyError(f"{i!r} in {name or 'top level'} jumps to an unknown label")
+
+def verify_cfg(g: CFG, ssa: bool = False) -> None:
+    where = g.name or 'top level'
+    blocks = set(g.blocks)
+    if len(blocks) != len(g.blocks):
+        raise VerifyError(f"{where}: a block is listed twice")
+    for b in g.blocks:
+        for s in b.succs:
+            if s not in blocks or b not in s.preds:
+                raise VerifyError(f"{where}: edge {b} -> {s} is one-sided")
+        for p in b.preds:
+            if p not in blocks or b not in p.succs:
+                raise VerifyError(f"{where}: edge {p} -> {b} is one-sided")
+        t = b.terminator
+        target = t and jump_target(t)
+        if target is not None and not any(target in s.labels for s in b.succs):
+            raise VerifyError(f"{where}: {b} jumps to {target} but has no edge there")
+        for k, instr in enumerate(b.instrs):
+            if instr[0] in ('LABEL', 'FUNC', 'ENDFUNC'):
+                raise VerifyError(f"{where}: {instr[0]} inside {b}")
+            if instr[0] in ('JMP', 'CJZ', 'RET') and k != len(b.instrs) - 1:
+                raise VerifyError(f"{where}: {instr!r} in the middle of {b}")
+            if instr[0] == 'PHI' and not ssa:
+                raise VerifyError(f"{where}: PHI left after SSA destruction")
+    if not ssa:
+        return
+
+    # single definitions, phis first and one operand per pred, defs
+    # dominating their uses
+    idom = g.dominators()
+    def dominates(a, b) -> bool:
+        while b is not a:
+            if b is idom.get(b, b):
+                return False
+            b = idom[b]
+        return True
+    def_block: Dict[str, object] = {}
+    for b in g.blocks:
+        in_phis = True
+        for instr in b.instrs:
+            if instr[0] == 'PHI':
+                if not in_phis:
+                    raise VerifyError(f"{where}: PHI after other instructions in {b}")
+                if len(instr[2]) != len(b.preds):
+                    raise VerifyError(f"{where}: {instr[1]} has {len(instr[2])} operands, "
+                                      f"{b} has {len(b.preds)} preds")
+            else:
+                in_phis = False
+            for d in defs_uses(instr)[0]:
+                if is_version(d):
+                    if d in def_block:
+                        raise VerifyError(f"{where}: {d} is defined twice")
+                    def_block[d] = b
+    for b in g.blocks:
+        if b not in idom:
+            continue
+        for instr in b.instrs:
+            if instr[0] == 'PHI':
+                uses = [(x, p) for x, p in zip(instr[2], b.preds)]
+            else:
+                uses = [(x, b) for x in defs_uses(instr)[1]]
+            for x, at in uses:
+                if is_version(x) and at in idom:
+                    if x not in def_block:
+                        raise VerifyError(f"{where}: {x} is used but never defined")
+                    if not dominates(def_block[x], at):
+                        raise VerifyError(f"{where}: the definition of {x} does not dominate its use in {at}")
+
+def verify_mc(lines: List[str]) -> None:
+    # what load_machine_code needs: every jump target is a label
+    labels = {l.split()[1] for l in lines if l.startswith('LABEL')}
+    for l in lines:
+        p = [x.rstrip(',') for x in l.split()]
+        t = p[1] if p[0] == 'JMP' else p[2] if p[0] == 'JZ' else None
+        if t is not None and t not in labels:
+            raise VerifyError(f"'{l}' jumps to an unknown label")
@@ -0,0 +1,139 @@
+# Peephole optimizer over the machine-code text codegen produces, before
+# load_machine_code(). Each pass takes the lines and returns (lines, number
+# of changes); peephole() runs the selected ones until nothing changes.
+#
+#   thread       JMP/JZ to a label whose code is 'JMP M' goes to M directly;
+#                a JMP to a RET or HALT becomes a copy of it
+#   next         JMP L / JZ x, L right before 'LABEL L' is dropped
+#   unreachable  code after JMP/RET/HALT/TAILCALL up to the next label that
+#                is jumped to (or starts a function) is dropped
+#   moves        'MOV a, a'; 'MOV a, b / MOV b, a' loses the second MOV and
+#                'MOV a, b / MOV a, c' the first. Argument set-up before a
+#                CALL stays whole so load_machine_code can still fuse it.
+#
+# Labels stay where they are unless they sit in dropped code, so function
+# regions ('LABEL FUNC_<name>' up to the next one) and jump targets mean
+# the same to run_machine_code as before.
+from typing import Dict, List, Optional, Tuple
+
+Lines = List[str]
+
+def _parts(line: str) -> List[str]:
+    return [p.rstrip(',') for p in line.split()]
+
+def _label_at(code: Lines) -> Dict[str, int]:
+    # label -> index of the first instruction after it
+    out, pending = {}, []
+    for i, line in enumerate(code):
+        if line.startswith('LABEL'):
+            pending.append(line.split()[1])
+            continue
+        for name in pending:
+            out[name] = i
+        pending = []
+    for name in pending:
+        out[name] = len(code)
+    return out
+
+def _target(parts: List[str]) -> Optional[str]:
+    if parts[0] == 'JMP':
+        return parts[1]
+    if parts[0] == 'JZ':
+        return parts[2]
+    return None
+
+def thread_jumps(code: Lines) -> Tuple[Lines, int]:
+    at = _label_at(code)
+    def final(label: str) -> str:
+        seen = {label}
+        while label in at and at[label] < len(code):
+            p = _parts(code[at[label]])
+            if p[0] != 'JMP' or p[1] in seen:
+                break
+            label = p[1]
+            seen.add(label)
+        return label
+    out, changed = [], 0
+    for line in code:
+        p = _parts(line)
+        t = _target(p)
+        if t is not None:
+            dest = final(t)
+            nxt = code[at[dest]] if at.get(dest, len(code)) < len(code) else None
+            if p[0] == 'JMP' and nxt is not None and _parts(nxt)[0] in ('RET', 'HALT'):
+                line = nxt
+                changed += 1
+            elif dest != t:
+                line = f"JMP {dest}" if p[0] == 'JMP' else f"JZ {p[1]}, {dest}"
+                changed += 1
+        out.append(line)
+    return out, changed
+
+def drop_next_jumps(code: Lines) -> Tuple[Lines, int]:
+    out, changed = [], 0
+    for i, line in enumerate(code):
+        t = _target(_parts(line))
+        if t is not None:
+            j = i + 1
+            while j < len(code) and code[j].startswith('LABEL'):
+                if code[j].split()[1] == t:
+                    break
+                j += 1
+            if j < len(code) and code[j].startswith('LABEL'):
+                changed += 1
+                continue
+        out.append(line)
+    return out, changed
+
+def drop_unreachable(code: Lines) -> Tuple[Lines, int]:
+    targets = {_target(_parts(l)) for l in code}
+    out, changed, dead = [], 0, False
+    for line in code:
+        if line.startswith('LABEL'):
+            name = line.split()[1]
+            if name in targets or name.startswith('FUNC_'):
+                dead = False
+        if dead:
+            changed += 1
+            continue
+        out.append(line)
+        if line.split()[0] in ('JMP', 'RET', 'HALT', 'TAILCALL'):
+            dead = True
+    return out, changed
+
+def drop_moves(code: Lines) -> Tuple[Lines, int]:
+    out: Lines = []
+    changed = 0
+    for line in code:
+        p = _parts(line)
+        if p[0] == 'MOV':
+            if p[1] == p[2]:
+                changed += 1
+                continue
+            prev = _parts(out[-1]) if out else None
+            if prev and prev[0] == 'MOV':
+                if prev[1] == p[2] and prev[2] == p[1] and not p[1].startswith('_arg'):
+                    changed += 1
+                    continue
+                if prev[1] == p[1]:
+                    out.pop()
+                    changed += 1
+        out.append(line)
+    return out, changed
+
+PASSES = {
+    'thread': thread_jumps,
+    'next': drop_next_jumps,
+    'unreachable': drop_unreachable,
+    'moves': drop_moves,
+}
+
+def peephole(lines, passes=tuple(PASSES)) -> Lines:
+    code = [l.strip() for l in lines if l.strip() and not l.strip().startswith('//')]
+    changed = True
+    while changed:
+        changed = False
+        for name in passes:
+            code, n = PASSES[name](code)
+            changed = changed or n > 0
+    return code
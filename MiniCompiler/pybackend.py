@@ -0,0 +1,282 @@
+# Ahead-of-time Python backend: tuple IR -> ast.Module -> code object
+#
+# Every FUNC..ENDFUNC becomes a Python function and the top-level code
+# becomes __toplevel__(). Labels and jumps are turned back into while/if
+# statements using the layout IRBuilder emits for WHILE and IF; a function
+# whose jumps don't fit that shape is lowered to a 'pc' dispatch loop
+# instead, so any IR still compiles.
+#
+# Semantics follow the VM: ints only, '/' floors and yields 0 on division
+# by zero, relational ops yield 0/1, unassigned registers read as 0, names
+# a function writes are its locals and the rest are read from the globals.
+import ast
+from typing import Dict, List, Tuple
+
+from cfg import defs_uses, split_functions
+from codegen import BUILTINS
+
+Instr = Tuple
+
+class Unsupported(Exception):
+    pass
+
+def mangle(name: str) -> str:
+    # Injective: '_' -> '__', '.' -> '_d', '%' -> '_p', so no guest name can collide
+    return 'v_' + name.replace('_', '__').replace('.', '_d').replace('%', '_p')
+
+def func_name(name: str) -> str:
+    return 'f_' + name
+
+def arg_name(i: int) -> str:
+    return f'_a{i}'
+
+BINOPS = {'+': ast.Add, '-': ast.Sub, '*': ast.Mult}
+CMPOPS = {'<': ast.Lt, '<=': ast.LtE, '>': ast.Gt, '>=': ast.GtE, '==': ast.Eq, '!=': ast.NotEq}
+
+class FunctionLowering:
+    def __init__(self, instrs: List[Instr], functions: set, arg_names: Dict[str, str]):
+        self.functions = functions
+        self.arg_names = arg_names   # '_argN' -> Python parameter name
+        # strip labels, resolving each one to the index of the next instruction
+        self.code: List[Instr] = []
+        self.labels: Dict[str, int] = {}
+        for instr in instrs:
+            if instr[0] == 'LABEL':
+                self.labels[instr[1]] = len(self.code)
+            else:
+                self.code.append(instr)
+        self.backedges: Dict[int, int] = {}
+        for ip, instr in enumerate(self.code):
+            if instr[0] == 'JMP':
+                t = self.target(instr[1])
+                if t <= ip:
+                    self.backedges[t] = max(ip, self.backedges.get(t, t))
+
+    def target(self, label: str) -> int:
+        if label not in self.labels:
+            raise Unsupported(f'Unknown label: {label}')
+        return self.labels[label]
+
+    # ----- expressions -----
+    def operand(self, x) -> ast.expr:
+        if isinstance(x, int):
+            return ast.Constant(x)
+        return ast.Name(self.arg_names.get(x) or mangle(x), ast.Load())
+
+    def store(self, x: str) -> ast.expr:
+        return ast.Name(mangle(x), ast.Store())
+
+    def binop(self, bop: str, a, b) -> ast.expr:
+        left, right = self.operand(a), self.operand(b)
+        if bop in BINOPS:
+            return ast.BinOp(left, BINOPS[bop](), right)
+        if bop == '/':
+            div = ast.BinOp(left, ast.FloorDiv(), right)
+            if isinstance(b, int) and b != 0:
+                return div
+            test = ast.Compare(self.operand(b), [ast.NotEq()], [ast.Constant(0)])
+            return ast.IfExp(test, div, ast.Constant(0))
+        test = ast.Compare(left, [CMPOPS[bop]()], [right])
+        return ast.IfExp(test, ast.Constant(1), ast.Constant(0))
+
+    def call(self, name: str, args) -> ast.expr:
+        if name in BUILTINS and name not in self.functions:
+            fn = '_print'
+        elif name in self.functions:
+            fn = func_name(name)
+        else:
+            return ast.Call(ast.Name('_unknown', ast.Load()), [ast.Constant(name)], [])
+        return ast.Call(ast.Name(fn, ast.Load()), [self.operand(a) for a in args], [])
+
+    def simple(self, instr: Instr) -> List[ast.stmt]:
+        op = instr[0]
+        if op == 'MOV':
+            return [ast.Assign([self.store(instr[1])], self.operand(instr[2]))]
+        if op == 'BIN':
+            _, dst, bop, a, b = instr
+            return [ast.Assign([self.store(dst)], self.binop(bop, a, b))]
+        if op == 'CALL':
+            _, dst, name, args = instr
+            value = self.call(name, args)
+            if dst is None:
+                return [ast.Expr(value)]
+            return [ast.Assign([self.store(dst)], value)]
+        if op == 'RET':
+            return [ast.Return(self.operand(instr[1]))]
+        raise Unsupported(f'Cannot lower {instr!r}')
+
+    # ----- structured lowering -----
+    def jump(self, target: int, loops: List[Tuple[int, int]], follow: int, tail: bool) -> List[ast.stmt]:
+        if tail and target == follow:
+            return []
+        if loops and target == loops[-1][0]:
+            return [ast.Continue()]
+        if loops and target == loops[-1][1]:
+            return [ast.Break()]
+        raise Unsupported(f'Unstructured jump to {target}')
+
+    def range(self, start: int, end: int, loops: List[Tuple[int, int]], follow: int) -> List[ast.stmt]:
+        # Lower [start, end); falling off the end continues at follow
+        out: List[ast.stmt] = []
+        ip = start
+        while ip < end:
+            if (not loops or ip != loops[-1][0]) and ip in self.backedges and self.backedges[ip] < end:
+                latch = self.backedges[ip]
+                body = self.range(ip, latch + 1, loops + [(ip, latch + 1)], ip)
+                out.append(ast.While(ast.Constant(True), body or [ast.Pass()], []))
+                ip = latch + 1
+                continue
+            instr = self.code[ip]
+            op = instr[0]
+            if op == 'JMP':
+                out += self.jump(self.target(instr[1]), loops, follow, ip == end - 1)
+                ip += 1
+            elif op == 'CJZ':
+                ip = self.branch(out, ip, instr[1], self.target(instr[2]), end, loops, follow)
+            else:
+                out += self.simple(instr)
+                ip += 1
+        return out
+
+    def branch(self, out: List[ast.stmt], ip: int, cond, target: int, end: int,
+               loops: List[Tuple[int, int]], follow: int) -> int:
+        test = self.operand(cond)
+        if ip < target and (target < end or target == follow):
+            join = target
+            prev = self.code[target - 1]
+            if prev[0] == 'JMP' and target - 1 > ip:
+                ja = self.target(prev[1])
+                if target < ja and (ja < end or ja == follow):
+                    join = ja
+            if join == target:
+                body = self.range(ip + 1, target, loops, target)
+                out.append(ast.If(test, body or [ast.Pass()], []))
+                return target
+            then = self.range(ip + 1, target - 1, loops, join)
+            other = self.range(target, join, loops, join)
+            out.append(ast.If(test, then or [ast.Pass()], other))
+            return join
+        body = self.jump(target, loops, -1, False)
+        out.append(ast.If(ast.UnaryOp(ast.Not(), test), body, []))
+        return ip + 1
+
+    def structured(self) -> List[ast.stmt]:
+        body = self.range(0, len(self.code), [], len(self.code))
+        return body + [ast.Return(ast.Constant(0))]
+
+    # ----- fallback: pc dispatch loop -----
+    def dispatch(self) -> List[ast.stmt]:
+        starts = sorted({0} | set(self.labels.values()) |
+                        {ip + 1 for ip, i in enumerate(self.code) if i[0] in ('JMP', 'CJZ', 'RET')})
+        starts = [s for s in starts if s <= len(self.code)]
+        pc = lambda ctx: ast.Name('_pc', ctx)
+        goto = lambda t: [ast.Assign([pc(ast.Store())], ast.Constant(t)), ast.Continue()]
+        cases: List[Tuple[int, List[ast.stmt]]] = []
+        for s, e in zip(starts, starts[1:] + [len(self.code) + 1]):
+            body: List[ast.stmt] = []
+            for ip in range(s, min(e, len(self.code))):
+                instr = self.code[ip]
+                if instr[0] == 'JMP':
+                    body += goto(self.target(instr[1]))
+                elif instr[0] == 'CJZ':
+                    body.append(ast.If(ast.UnaryOp(ast.Not(), self.operand(instr[1])),
+                                       goto(self.target(instr[2])), []))
+                else:
+                    body += self.simple(instr)
+            last = self.code[e - 1][0] if s < e <= len(self.code) else None
+            if e > len(self.code):
+                body.append(ast.Return(ast.Constant(0)))
+            elif last not in ('JMP', 'RET'):
+                body += goto(e)
+            cases.append((s, body))
+        chain: List[ast.stmt] = [ast.Return(ast.Constant(0))]
+        for s, body in reversed(cases):
+            test = ast.Compare(pc(ast.Load()), [ast.Eq()], [ast.Constant(s)])
+            chain = [ast.If(test, body, chain)]
+        return [ast.Assign([pc(ast.Store())], ast.Constant(0)),
+                ast.While(ast.Constant(True), chain, [])]
+
+    def lower(self) -> List[ast.stmt]:
+        try:
+            return self.structured()
+        except Unsupported:
+            return self.dispatch()
+
+def init_zero(names: List[str]) -> List[ast.stmt]:
+    if not names:
+        return []
+    return [ast.Assign([ast.Name(mangle(n), ast.Store()) for n in names], ast.Constant(0))]
+
+def generate_python(ir_code: List[Instr]) -> ast.Module:
+    top, funcs = split_functions(ir_code)
+    functions = {name for name, _, _ in funcs}
+
+    def written(instrs):
+        out: Dict[str, None] = {}
+        for instr in instrs:
+            for d in defs_uses(instr)[0]:
+                out.setdefault(d)
+        return list(out)
+
+    def used(instrs):
+        out: Dict[str, None] = {}
+        for instr in instrs:
+            d, u = defs_uses(instr)
+            for x in d + u:
+                if isinstance(x, str):
+                    out.setdefault(x)
+        return list(out)
+
+    globals_ = written(top)
+    body: List[ast.stmt] = [
+        ast.Assign([ast.Name('__outputs__', ast.Store())],
+                   ast.Tuple([ast.Constant(n) for n in globals_], ast.Load())),
+    ]
+
+    for name, params, instrs in funcs:
+        nargs = max([len(params)] + [int(x[4:]) + 1 for x in used(instrs) if x.startswith('_arg') and x[4:].isdigit()])
+        arg_names = {f'_arg{i}': arg_name(i) for i in range(nargs)}
+        own = set(written(instrs))
+        locals_ = [x for x in used(instrs) if x not in arg_names and (x in own or x not in globals_)]
+        args = ast.arguments(posonlyargs=[], args=[ast.arg(arg_name(i)) for i in range(nargs)],
+                             vararg=ast.arg('_extra'), kwonlyargs=[], kw_defaults=[],
+                             kwarg=None, defaults=[ast.Constant(0)] * nargs)
+        fbody = init_zero(locals_) + FunctionLowering(instrs, functions, arg_names).lower()
+        body.append(ast.FunctionDef(func_name(name), args, fbody, [], None))
+
+    top_names = used(top)
+    top_body: List[ast.stmt] = []
+    if top_names:
+        top_body.append(ast.Global([mangle(n) for n in top_names]))
+    top_body += FunctionLowering(top, functions, {}).lower()
+    no_args = ast.arguments(posonlyargs=[], args=[], vararg=None, kwonlyargs=[],
+                            kw_defaults=[], kwarg=None, defaults=[])
+    body.append(ast.FunctionDef('__toplevel__', no_args, top_body, [], None))
+    body += init_zero(top_names)
+    body.append(ast.Expr(ast.Call(ast.Name('__toplevel__', ast.Load()), [], [])))
+    if 'main' in functions:
+        # codegen appends 'CALL main, 0' after the top-level code
+        body.append(ast.Expr(ast.Call(ast.Name(func_name('main'), ast.Load()), [], [])))
+    return ast.fix_missing_locations(ast.Module(body, []))
+
+def compile_python(ir_code: List[Instr], filename: str = '<minicompiler>'):
+    return compile(generate_python(ir_code), filename, 'exec')
+
+def run_python_code(code, *, echo: bool = True):
+    # Run a code object from compile_python; same result shape as run_machine_code
+    output: List[str] = []
+
+    def _print(*vals):
+        for v in vals:
+            output.append(str(v))
+            if echo:
+                print(v)
+        return 0
+
+    def _unknown(name):
+        raise RuntimeError(f'Unknown function: {name}')
+
+    ns = {'_print': _print, '_unknown': _unknown}
+    exec(code, ns)
+    registers = {n: ns[mangle(n)] for n in ns['__outputs__']}
+    return {'registers': registers, 'memory': {}, 'output': output}
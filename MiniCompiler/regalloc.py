@@ -0,0 +1,130 @@
+# Linear-scan register allocation (Poletto & Sarkar) over cfg.CFG, after
+# SSA destruction.
+#
+# IRBuilder numbers temps across the whole program and the SSA passes add
+# versions on top, while the VM gives every distinct name its own frame
+# slot. allocate() maps the names a function computes onto a bounded set of
+# registers '_r0'.. '_rK-1', so a frame holds at most K of them however big
+# the program is. Each name gets one live interval over the code order:
+# instruction i reads at 2i and writes at 2i+1, a name live into a block
+# starts at its first instruction and one live out of it ends after its
+# last. Intervals are handed registers by start point; when all K are taken
+# the one that ends last keeps (is spilled to) a slot of its own under its
+# old name. A 'MOV x, y' gives x the register y just released when it can,
+# and the copies that end up as 'MOV r, r' are deleted.
+#
+# Allocated are the names a function writes except _argN/_ret; at top level
+# only compiler names (temps, SSA versions, _ssaN) that no function reads,
+# since user variables are reported back in the VM's 'registers'. A name
+# whose entry value is read (0 in a fresh frame) keeps its own slot.
+import re
+from typing import Dict, List, Set
+
+from cfg import CFG, defs_uses, map_defs, map_uses
+from ssa import TEMP, base, global_reads, is_version
+
+REGISTERS = 16
+
+SCRATCH = re.compile(r'_(arg\d+|ret)$')
+
+def _allocatable(g: CFG, name: str, shared: Set[str]) -> bool:
+    if SCRATCH.match(name):
+        return False
+    if g.name is not None:
+        return True
+    return name not in shared and (is_version(name) or TEMP.match(base(name)) is not None
+                                   or name.startswith('_ssa'))
+
+def linear_scan(g: CFG, k: int, reg_names: List[str], shared: Set[str] = frozenset()) -> int:
+    # -> number of names spilled
+    live = g.liveness()
+    start: Dict[str, int] = {}
+    end: Dict[str, int] = {}
+    hints: Dict[str, List[str]] = {}
+    def mark(x: str, p: int) -> None:
+        if x not in start or p < start[x]:
+            start[x] = p
+        if x not in end or p > end[x]:
+            end[x] = p
+
+    written = set()
+    entry_read = set()
+    if g.entry in live.live_in:
+        entry_read = set(live.decode(live.live_in[g.entry]))
+    i = 0
+    for b in g.blocks:
+        first = i
+        for instr in b.instrs:
+            d, u = defs_uses(instr)
+            for x in u:
+                if isinstance(x, str):
+                    mark(x, 2 * i)
+            for x in d:
+                mark(x, 2 * i + 1)
+                written.add(x)
+            if instr[0] == 'MOV' and isinstance(instr[2], str):
+                hints.setdefault(instr[1], []).append(instr[2])
+            i += 1
+        if b in live.live_in:
+            for x in live.decode(live.live_in[b]):
+                mark(x, 2 * first)
+            for x in live.decode(live.live_out[b]):
+                mark(x, 2 * max(i - 1, first) + 1)
+
+    names = sorted((x for x in written if x not in entry_read and _allocatable(g, x, shared)),
+                   key=lambda x: (start[x], end[x]))
+    if not names:
+        return 0
+    free = list(reversed(reg_names[:k]))
+    active: List[str] = []      # sorted by end
+    reg: Dict[str, str] = {}
+    spilled = 0
+    for x in names:
+        while active and end[active[0]] < start[x]:
+            free.append(reg[active.pop(0)])
+        if free:
+            r = next((reg[h] for h in hints.get(x, ()) if reg.get(h) in free), None)
+            if r is None:
+                r = free[-1]
+            free.remove(r)
+            reg[x] = r
+        else:
+            last = active[-1]
+            spilled += 1
+            if end[last] <= end[x]:
+                continue
+            reg[x] = reg.pop(last)
+            active.pop()
+        active.append(x)
+        active.sort(key=lambda y: end[y])
+
+    rename = lambda x: reg.get(x, x)
+    for b in g.blocks:
+        new = []
+        for instr in b.instrs:
+            instr = map_defs(map_uses(instr, rename), rename)
+            if instr[0] == 'MOV' and instr[1] == instr[2]:
+                continue
+            new.append(instr)
+        b.instrs = new
+    return spilled
+
+def allocate(cfgs: List[CFG], k: int = REGISTERS) -> int:
+    # -> number of names spilled over all functions; k = 0 leaves every
+    # name in a slot of its own
+    if k <= 0:
+        return 0
+    used = set()
+    for g in cfgs:
+        for b in g.blocks:
+            for instr in b.instrs:
+                d, u = defs_uses(instr)
+                used.update(x for x in d + u if isinstance(x, str))
+    regs = []
+    n = 0
+    while len(regs) < k:
+        if f'_r{n}' not in used:
+            regs.append(f'_r{n}')
+        n += 1
+    shared = global_reads(cfgs)
+    return sum(linear_scan(g, k, regs, shared) for g in cfgs)
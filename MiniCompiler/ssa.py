@@ -0,0 +1,306 @@
+# SSA construction and destruction over cfg.CFG.
+#
+# to_ssa() gives every definition its own name 'x.N'. The plain name 'x'
+# stands for the value on entry: 0 for anything the code defines itself,
+# the parameter or global otherwise (_argN, names a function only reads).
+# Phis are placed on the iterated dominance frontier where the variable is
+# live (pruned SSA) and renamed by a walk over the dominator tree.
+#
+# Two things stay out of SSA to keep the VM's semantics:
+#   - top-level names some function reads are globals the callee copies in
+#     on CALL; they keep their plain name and every def ('pinned')
+#   - a top-level exit has to leave each user variable in its register, so
+#     exits get an ('EXIT', names, values) pseudo-use
+#
+# from_ssa() turns the phis into parallel copies on the incoming edges
+# (splitting critical ones), the EXITs into copies back to the user names,
+# and renames every version to its plain name unless it interferes with a
+# version already given that name.
+from typing import Dict, List, Set
+
+from cfg import CFG, Block, defs_uses, dominator_tree, map_defs, map_uses
+from ir import TEMP   # IRBuilder temps: not reported, no EXIT use
+
+def base(name: str) -> str:
+    return name.split('.', 1)[0]
+
+def is_version(name) -> bool:
+    return isinstance(name, str) and '.' in name
+
+def stable(g: CFG):
+    # -> predicate: does this operand keep its value for as long as g runs?
+    # True for constants and SSA versions; pinned top-level names can be
+    # reassigned, and _argN is rewritten by any call the function makes
+    calls = any(i[0] == 'CALL' for b in g.blocks for i in b.instrs)
+    def check(x) -> bool:
+        if not isinstance(x, str) or is_version(x):
+            return True
+        if g.name is None:
+            return False
+        return not (calls and x.startswith('_arg'))
+    return check
+
+def new_version(g: CFG, name: str) -> str:
+    # a fresh 'x.N' for passes that add definitions to SSA form
+    counters = getattr(g, 'versions', None)
+    if counters is None:
+        counters = g.versions = {}
+        for b in g.blocks:
+            for instr in b.instrs:
+                for d in defs_uses(instr)[0]:
+                    if is_version(d):
+                        v, n = d.split('.', 1)
+                        counters[v] = max(counters.get(v, 0), int(n))
+    v = base(name)
+    counters[v] = counters.get(v, 0) + 1
+    return f'{v}.{counters[v]}'
+
+def global_reads(cfgs: List[CFG]) -> Set[str]:
+    # names some function reads without ever writing them: the VM copies
+    # these in from the top-level frame on every CALL
+    out = set()
+    for g in cfgs[1:]:
+        defs, uses = set(), set()
+        for b in g.blocks:
+            for instr in b.instrs:
+                d, u = defs_uses(instr)
+                defs.update(d)
+                uses.update(x for x in u if isinstance(x, str))
+        out |= {x for x in uses - defs if not x.startswith('_arg')}
+    return out
+
+def _normalize(g: CFG) -> None:
+    # SSA wants an entry block without preds and no doubled edges
+    for b in g.blocks:
+        if len(b.succs) == 2 and b.succs[0] is b.succs[1]:
+            b.instrs.pop()
+            b.succs.pop()
+            b.succs[0].preds.remove(b)
+    if g.entry.preds:
+        n = Block(len(g.blocks))
+        n.succs = [g.entry]
+        g.entry.preds.append(n)
+        g.blocks.insert(0, n)
+
+def _add_exits(g: CFG, names: List[str]) -> None:
+    for b in g.blocks:
+        t = b.terminator
+        if b.succs or (t is not None and t[0] != 'RET'):
+            continue   # a jump to an unknown label traps, nothing is reported
+        exit_ = ('EXIT', tuple(names), list(names))
+        if t is None:
+            b.instrs.append(exit_)
+        else:
+            b.instrs.insert(len(b.instrs) - 1, exit_)
+
+def build_ssa(g: CFG, pinned: Set[str] = frozenset()) -> None:
+    _normalize(g)
+    g.remove_unreachable()
+    g.pinned = set(pinned)
+
+    defsites: Dict[str, List[Block]] = {}
+    for b in g.blocks:
+        for instr in b.instrs:
+            for d in defs_uses(instr)[0]:
+                if d not in pinned:
+                    defsites.setdefault(d, []).append(b)
+    g.locals = set(defsites)
+    if g.name is None:
+        _add_exits(g, sorted(v for v in defsites if not TEMP.match(v)))
+
+    idom = g.dominators()
+    df = g.dominance_frontiers(idom)
+    live = g.liveness()
+    for v, sites in defsites.items():
+        has_phi = set()
+        work = list(dict.fromkeys(sites))
+        sites = set(work)
+        while work:
+            b = work.pop()
+            for f in df[b]:
+                if f in has_phi or not live.is_live_in(f, v):
+                    continue
+                has_phi.add(f)
+                f.instrs.insert(0, ('PHI', v, [v] * len(f.preds)))
+                if f not in sites:
+                    work.append(f)
+
+    counter: Dict[str, int] = {}
+    stacks: Dict[str, List[str]] = {v: [] for v in defsites}
+
+    def cur(x: str) -> str:
+        s = stacks.get(x)
+        return s[-1] if s else x
+
+    def fresh(x: str) -> str:
+        if x not in stacks:
+            return x
+        n = counter[x] = counter.get(x, 0) + 1
+        stacks[x].append(f'{x}.{n}')
+        return stacks[x][-1]
+
+    children = dominator_tree(idom)
+    work = [(g.entry, False)]
+    while work:
+        b, leaving = work.pop()
+        if leaving:
+            for instr in reversed(b.instrs):
+                for d in defs_uses(instr)[0]:
+                    if is_version(d) and base(d) in stacks:
+                        stacks[base(d)].pop()
+            continue
+        new = []
+        for instr in b.instrs:
+            if instr[0] != 'PHI':
+                instr = map_uses(instr, cur)
+            new.append(map_defs(instr, fresh))
+        b.instrs = new
+        for s in b.succs:
+            for j, p in enumerate(s.preds):
+                if p is not b:
+                    continue
+                for k, instr in enumerate(s.instrs):
+                    if instr[0] != 'PHI':
+                        break
+                    ops = list(instr[2])
+                    ops[j] = cur(base(instr[1]))
+                    s.instrs[k] = ('PHI', instr[1], ops)
+        work.append((b, True))
+        work.extend((c, False) for c in reversed(children[b]))
+
+def to_ssa(cfgs: List[CFG]) -> None:
+    pinned = global_reads(cfgs)
+    build_ssa(cfgs[0], pinned)
+    for g in cfgs[1:]:
+        build_ssa(g)
+
+# ========== Destruction ==========
+
+def sequentialize(copies, fresh) -> List[tuple]:
+    # parallel copies [(dst, src)] -> MOVs with the same effect; a cycle is
+    # broken with a temp from fresh()
+    todo = {d: s for d, s in copies if d != s}
+    out = []
+    while todo:
+        read = set(s for s in todo.values() if isinstance(s, str))
+        ready = [d for d in todo if d not in read]
+        if ready:
+            for d in ready:
+                out.append(('MOV', d, todo.pop(d)))
+            continue
+        d, s = next(iter(todo.items()))
+        t = fresh()
+        out.append(('MOV', t, s))
+        for k, v in todo.items():
+            if v == s:
+                todo[k] = t
+    return out
+
+def _interference(g: CFG, groups: Dict[str, Dict[str, None]]) -> Dict[str, Set[str]]:
+    # edges only between names of the same base: those are the only ones
+    # that could end up sharing a register
+    live = g.liveness()
+    mask: Dict[str, int] = {}
+    for v, vs in groups.items():
+        for x in [v, *vs]:
+            if x in live.index:
+                mask[v] = mask.get(v, 0) | live.bit(x)
+    edges: Dict[str, Set[str]] = {}
+    for b in g.blocks:
+        if b not in live.live_out:
+            continue
+        bits = live.live_out[b]
+        for instr in reversed(b.instrs):
+            d, u = defs_uses(instr)
+            for x in d:
+                m = mask.get(base(x))
+                if m is None:
+                    continue
+                xbit = live.bit(x)
+                other = bits & m & ~xbit
+                if instr[0] == 'MOV' and isinstance(instr[2], str):
+                    other &= ~live.bit(instr[2])
+                for y in live.decode(other):
+                    edges.setdefault(x, set()).add(y)
+                    edges.setdefault(y, set()).add(x)
+                bits &= ~xbit
+            for x in u:
+                if isinstance(x, str):
+                    bits |= live.bit(x)
+    return edges
+
+def destroy_ssa(g: CFG) -> None:
+    temps = iter(range(1 << 30))
+    fresh = lambda: f'_ssa{next(temps)}'
+
+    # phis -> copies at the end of each predecessor (on a split edge when
+    # the predecessor branches)
+    for b in list(g.blocks):
+        phis = [i for i in b.instrs if i[0] == 'PHI']
+        if not phis:
+            continue
+        b.instrs = b.instrs[len(phis):]
+        for j, p in enumerate(list(b.preds)):
+            copies = [(phi[1], phi[2][j]) for phi in phis]
+            if len(p.succs) > 1:
+                p = g.split_edge(p, b)
+            at = len(p.instrs) - (p.terminator is not None)
+            p.instrs[at:at] = sequentialize(copies, fresh)
+
+    names = {}
+    versions: Dict[str, Dict[str, None]] = {}
+    for b in g.blocks:
+        for instr in b.instrs:
+            d, u = defs_uses(instr)
+            for x in d + u:
+                if is_version(x):
+                    versions.setdefault(base(x), {})[x] = None
+    edges = _interference(g, versions)
+    for v, vs in versions.items():
+        group = {v}
+        for x in sorted(vs, key=lambda x: int(x.split('.')[1])):
+            if edges.get(x, set()) & group:
+                names[x] = x
+            else:
+                group.add(x)
+                names[x] = v
+    rename = lambda x: names.get(x, x)
+
+    for b in g.blocks:
+        new = []
+        for instr in b.instrs:
+            instr = map_defs(map_uses(instr, rename), rename)
+            if instr[0] == 'EXIT':
+                copies = [(n, x) for n, x in zip(instr[1], instr[2])]
+                movs = sequentialize(copies, fresh)
+                t = b.terminator
+                if movs and t is not None and t[1] in set(instr[1]):
+                    tmp = fresh()
+                    new.append(('MOV', tmp, t[1]))
+                    b.instrs[-1] = ('RET', tmp)
+                new.extend(movs)
+                continue
+            if instr[0] == 'MOV' and instr[1] == instr[2]:
+                continue
+            new.append(instr)
+        b.instrs = new
+
+    if g.name is not None:
+        # a local whose entry value is still read is uninitialized: 0 (a
+        # pass may have deleted all its defs, so ask what build_ssa saw)
+        defined, used = set(), set()
+        for b in g.blocks:
+            for instr in b.instrs:
+                d, u = defs_uses(instr)
+                defined.update(d)
+                used.update(x for x in u if isinstance(x, str))
+        stale = {v for v in g.locals | set(versions) if v in used and v not in defined}
+        if stale:
+            for b in g.blocks:
+                b.instrs = [map_uses(i, lambda x: 0 if x in stale else x) for i in b.instrs]
+    g.pinned = set()
+    g.remove_empty()
+
+def from_ssa(cfgs: List[CFG]) -> None:
+    for g in cfgs:
+        destroy_ssa(g)
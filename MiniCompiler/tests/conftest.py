@@ -0,0 +1,6 @@
+# The compiler is a flat set of modules run from this folder (python main.py),
+# so the tests import them the same way.
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,18 @@
+from batch import Job, run_batch
+
+LOOP = "i = 0; while (i < 1) { i = 0; }"
+
+def test_each_job_gets_its_own_limits_and_status():
+    jobs = [
+        Job('ok', source="x = 6 * 7; print(x);"),
+        Job('steps', source=LOOP, max_steps=1000),
+        Job('error', source="print(f(1));"),
+        Job('timeout', source=LOOP, max_steps=10**12, timeout=0.5),
+        Job('after', source="print(1);"),   # runs on the worker that replaced a killed one
+    ]
+    results = {r['name']: r for r in run_batch(jobs, workers=1)}
+    assert {n: r['status'] for n, r in results.items()} == {
+        'ok': 'ok', 'steps': 'steps', 'error': 'error', 'timeout': 'timeout', 'after': 'ok'}
+    assert results['ok']['output'] == ['42'] and results['ok']['registers']['x'] == 42
+    assert 'Unknown function' in results['error']['error']
+    assert [results[n]['job'] for n in ('ok', 'after')] == [0, 4]
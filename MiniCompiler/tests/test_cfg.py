@@ -0,0 +1,44 @@
+import io
+import contextlib
+
+from cfg import build_cfgs, linearize
+from main import compile_source
+from vm import run_machine_code
+
+def run(src: str, level: int):
+    with contextlib.redirect_stdout(io.StringIO()):
+        return run_machine_code(compile_source(src, level))
+
+def test_remove_empty_keeps_function_entry_label():
+    # DCE drops the unused 'MOV a, _arg0' and leaves the entry block empty
+    src = "func f(a) { while (b < 3) b = b + 1; return b; } print(f(1));"
+    for level in (0, 1, 2):
+        res = run(src, level)
+        assert res['output'] == ['3']
+        assert 'b' not in res['registers']
+
+def test_remove_empty_moves_entry_labels_to_successor():
+    ir = [('FUNC', 'f', ['a']), ('LABEL', 'FUNC_f'), ('JMP', 'L1'), ('LABEL', 'L1'),
+          ('RET', 0), ('ENDFUNC', 'f')]
+    cfgs = build_cfgs(ir)
+    g = cfgs[1]
+    g.entry.instrs = []
+    assert g.remove_empty() == 1
+    assert g.entry.labels[0] == 'FUNC_f'
+    assert ('LABEL', 'FUNC_f') in linearize(cfgs)
+
+def test_while_loop_blocks_edges_dominators_and_liveness():
+    ir = [('MOV', 'i', 0), ('LABEL', 'L_cond'), ('BIN', 't', '<', 'i', 3), ('CJZ', 't', 'L_end'),
+          ('BIN', 'i', '+', 'i', 1), ('JMP', 'L_cond'), ('LABEL', 'L_end'), ('RET', 'i')]
+    g = build_cfgs(ir)[0]
+    entry, cond, body, end = g.blocks
+    assert [s.labels for s in cond.succs] == [[], ['L_end']]
+    assert cond.succs == [body, end] and body.succs == [cond]
+    assert set(cond.preds) == {entry, body}
+    idom = g.dominators()
+    assert idom[body] is cond and idom[end] is cond and idom[cond] is entry
+    assert g.dominance_frontiers(idom)[body] == {cond}
+    live = g.liveness()
+    assert live.out_of(entry) == live.out_of(body) == {'i'}
+    assert not live.is_live_in(entry, 'i')
+    assert linearize([g]) == ir
@@ -0,0 +1,56 @@
+import io
+import contextlib
+import time
+
+from codegen import generate_machine_code
+from consteval import ConstEvaluator
+from image import load_image, write_image
+from ir import generate_ir
+from lexer import tokenize
+from main import compile_source, parser_tokens
+from my_parser import Parser
+from passes import PassManager
+from vm import load_machine_code, run_machine_code
+
+def ir_of(src: str):
+    return generate_ir(Parser(parser_tokens(tokenize(src))).parse())
+
+def run(src: str, level: int = 2):
+    with contextlib.redirect_stdout(io.StringIO()):
+        return run_machine_code(compile_source(src, level))
+
+def test_folds_pure_recursive_call():
+    src = "func fib(n) { if (n < 2) return n; return fib(n - 1) + fib(n - 2); } print(fib(20));"
+    mc = compile_source(src)
+    assert 'PRINT 6765' in mc
+    ev = ConstEvaluator(ir_of(src))
+    assert ev.call('fib', [20]) == 6765
+    assert ev.memo[('fib', (19,))] == 4181
+
+def test_impure_functions_are_left_alone():
+    src = "func h(x) { return x + g; } func p(x) { print(x); return x; } g = 5;"
+    ev = ConstEvaluator(ir_of(src))
+    assert ev.call('h', [1]) is None
+    assert ev.call('p', [1]) is None
+
+def test_gives_up_on_huge_values():
+    src = "func sq(x){ i=0; while(i<22){ x = x*x; i=i+1; } return x; } print(sq(3) > 0);"
+    assert ConstEvaluator(ir_of(src)).call('sq', [3]) is None
+    assert run(src)['output'] == ['1']
+
+def test_huge_loop_does_not_hang_the_compile():
+    src = "func sq(x){ i=0; while(i<40){ x = x*x; i=i+1; } return x; } print(sq(3) > 0);"
+    t0 = time.perf_counter()
+    compile_source(src)
+    assert time.perf_counter() - t0 < 5
+
+def test_results_outside_int64_stay_calls(tmp_path):
+    src = "func big(x) { return x * 4; } r = big(4611686018427387904); print(1);"
+    assert ConstEvaluator(ir_of(src)).call('big', [2**62]) is None
+    pm = PassManager(['eval', 'sccp', 'calls', 'dce'])
+    mc = pm.run_mc(generate_machine_code(pm.run_ir(ir_of(src))))
+    assert any(l.startswith('CALL') for l in mc)
+    path = str(tmp_path / 'big.img')
+    write_image(load_machine_code(mc), path)
+    with contextlib.redirect_stdout(io.StringIO()):
+        assert run_machine_code(load_image(path))['output'] == ['1']
@@ -0,0 +1,148 @@
+# Every program in programs/ at -O0/-O1/-O2 on every way of running it must
+# print the same as the unoptimized program on the switch engine, and leave
+# the same values in the user variables it reports.
+import glob
+import io
+import contextlib
+import os
+import random
+import re
+
+import pytest
+
+from codegen import generate_machine_code
+from image import load_image, write_image
+from ir import generate_ir
+from lexer import tokenize
+from main import parser_tokens
+from my_parser import Parser
+from passes import LEVELS, PASSES, PassManager
+from pybackend import compile_python, run_python_code
+from vm import load_machine_code, run_machine_code
+
+PROGRAMS = sorted(glob.glob(os.path.join(os.path.dirname(__file__), 'programs', '*.src')))
+MAX_STEPS = 10**7
+
+def parse(path: str):
+    with open(path, encoding='utf-8') as fh:
+        return Parser(parser_tokens(tokenize(fh.read()))).parse()
+
+def user(registers):
+    # compiler temps, allocated registers and SSA versions that outlived
+    # from_ssa differ between levels
+    return {k: v for k, v in registers.items() if not re.fullmatch(r'%t\d+|_r\d+|\w+\.\d+', k)}
+
+@pytest.fixture(scope='module')
+def reference():
+    out = {}
+    with contextlib.redirect_stdout(io.StringIO()):
+        for path in PROGRAMS:
+            res = run_machine_code(generate_machine_code(generate_ir(parse(path))), max_steps=MAX_STEPS)
+            out[path] = (res['output'], user(res['registers']))
+    return out
+
+@pytest.mark.parametrize('level', sorted(LEVELS))
+@pytest.mark.parametrize('path', PROGRAMS, ids=[os.path.basename(p)[:-4] for p in PROGRAMS])
+def test_same_output_everywhere(path, level, reference, tmp_path):
+    want_output, want_registers = reference[path]
+    pm = PassManager(LEVELS[level], debug=True)
+    ir = pm.run_ir(generate_ir(parse(path)))
+    mc = pm.run_mc(generate_machine_code(ir))
+
+    runs = {}
+    with contextlib.redirect_stdout(io.StringIO()):
+        for engine in ('switch', 'closure'):
+            runs[engine] = run_machine_code(load_machine_code(mc), max_steps=MAX_STEPS, engine=engine)
+        runs['jit'] = run_machine_code(load_machine_code(mc), max_steps=MAX_STEPS, jit_threshold=1)
+        image = str(tmp_path / 'prog.img')
+        write_image(load_machine_code(mc), image)
+        runs['image'] = run_machine_code(load_image(image), max_steps=MAX_STEPS)
+        runs['py'] = run_python_code(compile_python(ir), echo=False)
+
+    for how, res in runs.items():
+        assert res['output'] == want_output, how
+        got = user(res['registers'])
+        if how == 'py':
+            # the Python backend reports every name the top level writes
+            got = {n: got.get(n, 'missing') for n in want_registers}
+        assert got == want_registers, how
+
+@pytest.mark.parametrize('name', sorted(PASSES))
+@pytest.mark.parametrize('path', PROGRAMS, ids=[os.path.basename(p)[:-4] for p in PROGRAMS])
+def test_each_pass_alone(path, name, reference):
+    # a pass must be correct on its own, not only after the ones a level
+    # runs before it
+    pm = PassManager([name], debug=True)
+    mc = pm.run_mc(generate_machine_code(pm.run_ir(generate_ir(parse(path)))))
+    with contextlib.redirect_stdout(io.StringIO()):
+        res = run_machine_code(load_machine_code(mc), max_steps=MAX_STEPS)
+    assert (res['output'], user(res['registers'])) == reference[path]
+
+# Random programs: a few functions that call only earlier ones (so every
+# run ends), with locals written under conditions or in loops that may not
+# run, returns from loop bodies and globals shared with the top level.
+GLOBALS = ['a', 'b', 'l', 'x']
+
+class Gen:
+    def __init__(self, seed: int):
+        self.rnd = random.Random(seed)
+        self.funcs = []     # (name, number of params)
+        self.loops = 0
+
+    def expr(self, names, depth=0):
+        r = self.rnd.random()
+        if depth > 2 or r < 0.3:
+            return str(self.rnd.randint(0, 9)) if r < 0.15 else self.rnd.choice(names)
+        if r < 0.4 and self.funcs:
+            f, n = self.rnd.choice(self.funcs)
+            return f"{f}({', '.join(self.expr(names, depth + 1) for _ in range(n))})"
+        op = self.rnd.choice(['+', '-', '*', '/', '<', '<=', '>', '>=', '==', '!='])
+        return f"({self.expr(names, depth + 1)} {op} {self.expr(names, depth + 1)})"
+
+    def block(self, names, depth, in_func):
+        return ' '.join(self.stmt(names, depth, in_func) for _ in range(self.rnd.randint(1, 3)))
+
+    def stmt(self, names, depth, in_func):
+        r = self.rnd.random()
+        if depth < 2 and r < 0.2:
+            c = f"i{self.loops}"
+            self.loops += 1
+            body = self.block(names, depth + 1, in_func)
+            return f"{c} = 0; while ({c} < {self.rnd.randint(0, 3)}) {{ {body} {c} = {c} + 1; }}"
+        if depth < 2 and r < 0.4:
+            out = f"if ({self.expr(names)}) {{ {self.block(names, depth + 1, in_func)} }}"
+            if self.rnd.random() < 0.5:
+                out += f" else {{ {self.block(names, depth + 1, in_func)} }}"
+            return out
+        if in_func and r < 0.45:
+            return f"return {self.expr(names)};"
+        if r < 0.6:
+            return f"print({self.expr(names)});"
+        return f"{self.rnd.choice(names[:len(GLOBALS)])} = {self.expr(names)};"
+
+    def program(self) -> str:
+        out = []
+        for k in range(self.rnd.randint(1, 3)):
+            params = [f"p{j}" for j in range(self.rnd.randint(0, 2))]
+            body = self.block(GLOBALS + params, 0, True)
+            out.append(f"func f{k}({', '.join(params)}) {{ {body} return {self.expr(GLOBALS + params)}; }}")
+            self.funcs.append((f"f{k}", len(params)))
+        out.append(self.block(GLOBALS, 0, False))
+        return '\n'.join(out)
+
+def run_source(src: str, level: int):
+    pm = PassManager(LEVELS[level], debug=level > 0)
+    mc = pm.run_mc(generate_machine_code(pm.run_ir(generate_ir(Parser(parser_tokens(tokenize(src))).parse()))))
+    with contextlib.redirect_stdout(io.StringIO()):
+        try:
+            res = run_machine_code(load_machine_code(mc), max_steps=MAX_STEPS)
+        except RuntimeError as e:
+            return str(e)
+    return res['output'], user(res['registers'])
+
+@pytest.mark.parametrize('seed', range(300))
+def test_random_programs(seed):
+    src = Gen(seed).program()
+    want = run_source(src, 0)
+    for level in (1, 2):
+        assert run_source(src, level) == want, f"-O{level}\n{src}"
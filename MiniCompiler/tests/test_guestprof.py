@@ -0,0 +1,50 @@
+import io
+import contextlib
+
+from main import compile_source
+from vm import load_machine_code, run_machine_code
+
+def loops(src: str, level: int):
+    prog = load_machine_code(compile_source(src, level))
+    with contextlib.redirect_stdout(io.StringIO()):
+        return run_machine_code(prog, profile=True)['profile'].report()['loops']
+
+def test_while_loop_counted_at_every_level():
+    src = "i = 0; s = 0; while (i < 10) { s = s + i; i = i + 1; } print(s);"
+    for level in (0, 1, 2):
+        assert sum(loops(src, level).values()) == 10
+
+def test_conditional_back_edge_after_jump_threading():
+    # at -O2 the 'if' exit is threaded into a fused compare-branch back to
+    # the loop header
+    src = "i = 0; s = 0; while (i < 10) { i = i + 1; if (i < 5) { s = s + i; } } print(s);"
+    mc = compile_source(src, 2)
+    prog = load_machine_code(mc)
+    assert prog.fused['cmp_branch'] >= 2
+    assert loops(src, 2) == {'L_cond_0': 10}
+
+def test_back_edge_whose_next_ip_is_a_branch_target():
+    # the first back edge falls through to L_skip, which the forward branch
+    # also jumps to: 3 iterations close there and 6 at the end
+    mc = ["MOV i, 0", "LABEL L_top", "+ i, i, 1",
+          "LT c, i, 4", "JZ c, L_skip",
+          "LT d, i, 0", "JZ d, L_top",
+          "LABEL L_skip", "LT g, i, 10", "EQ h, g, 0", "JZ h, L_top", "HALT"]
+    with contextlib.redirect_stdout(io.StringIO()):
+        res = run_machine_code(load_machine_code(mc), profile=True)
+    assert res['profile'].report()['loops'] == {'L_top': 9}
+
+def test_function_counters_and_stacks():
+    src = "func sq(x) { return x * x; } func f(n) { if (n == 0) { return 0; } return sq(n) + f(n - 1); } print(f(3));"
+    prog = load_machine_code(compile_source(src, 0))
+    with contextlib.redirect_stdout(io.StringIO()):
+        res = run_machine_code(prog, profile=True)
+    report = res['profile'].report()
+    fns = report['functions']
+    assert fns['f']['calls'] == 4 and fns['sq']['calls'] == 3
+    assert sum(f['exclusive'] for f in fns.values()) == report['steps'] == res['stats']['steps']
+    # recursion is counted once: f's outermost call covers all of f and sq
+    assert fns['f']['inclusive'] == fns['f']['exclusive'] + fns['sq']['exclusive']
+    stacks = dict(line.rsplit(' ', 1) for line in res['profile'].collapsed().splitlines())
+    assert '<toplevel>;f;f;f;f' in stacks and '<toplevel>;f;f;f;sq' in stacks
+    assert sum(map(int, stacks.values())) == report['steps']
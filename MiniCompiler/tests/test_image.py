@@ -0,0 +1,38 @@
+import io
+import contextlib
+
+import pytest
+
+from codegen import generate_machine_code
+from image import ImageError, decode_image, image_bytes, load_image, write_image
+from ir import generate_ir
+from lexer import tokenize
+from main import parser_tokens
+from my_parser import Parser
+from vm import load_machine_code, run_machine_code
+
+def program(src: str):
+    ir = generate_ir(Parser(parser_tokens(tokenize(src))).parse())
+    return load_machine_code(generate_machine_code(ir))
+
+def run(prog):
+    with contextlib.redirect_stdout(io.StringIO()):
+        return run_machine_code(prog)
+
+def test_loaded_image_runs_like_the_program(tmp_path):
+    src = "func f(a, b) { return a * b + 9223372036854775807; } x = f(2, 3); print(x); print(f(x, 0));"
+    path = str(tmp_path / 'prog.img')
+    write_image(program(src), path)
+    got, want = run(load_image(path)), run(program(src))
+    assert got['output'] == want['output']
+    assert got['registers'] == want['registers']
+
+def test_rejects_other_files():
+    with pytest.raises(ImageError):
+        decode_image(b'not an image at all, just some bytes')
+
+def test_rejects_other_versions():
+    data = bytearray(image_bytes(program("print(1);")))
+    data[4] += 1
+    with pytest.raises(ImageError):
+        decode_image(bytes(data))
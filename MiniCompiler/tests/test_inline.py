@@ -0,0 +1,60 @@
+import io
+import contextlib
+
+from cfg import split_functions
+from codegen import generate_machine_code
+from inline import inline_calls
+from ir import generate_ir
+from lexer import tokenize
+from main import parser_tokens
+from my_parser import Parser
+from vm import load_machine_code, run_machine_code
+
+def ir_of(src: str):
+    return generate_ir(Parser(parser_tokens(tokenize(src))).parse())
+
+def run(ir):
+    with contextlib.redirect_stdout(io.StringIO()):
+        return run_machine_code(load_machine_code(generate_machine_code(ir)))
+
+def top_calls(ir):
+    top, _ = split_functions(ir)
+    return [i[2] for i in top if i[0] == 'CALL' and i[2] != 'print']
+
+def test_small_helpers_are_inlined_into_each_other():
+    src = ("func sq(x) { return x * x; } func norm(a, b) { return sq(a) + sq(b); } "
+           "print(norm(3, 4)); print(norm(1, 2));")
+    ir = inline_calls(ir_of(src))
+    assert top_calls(ir) == []
+    assert run(ir)['output'] == ['25', '5']
+    # the FUNC definitions stay
+    assert ('FUNC', 'sq', ['x']) in ir and ('FUNC', 'norm', ['a', 'b']) in ir
+
+def test_recursive_and_oversized_functions_stay_calls():
+    src = ("func fact(n) { if (n < 2) return 1; return n * fact(n - 1); } "
+           "func big(x) { x = x + 1; x = x + 2; x = x + 3; x = x + 4; return x; } "
+           "print(fact(5)); print(big(1));")
+    ir = inline_calls(ir_of(src), budget=4)
+    assert top_calls(ir) == ['fact', 'big']
+    assert top_calls(inline_calls(ir_of(src))) == ['fact']
+    assert run(inline_calls(ir_of(src)))['output'] == ['120', '11']
+
+def test_callee_locals_start_at_zero_and_do_not_leak():
+    src = ("func f(c) { if (c) t = 5; return t; } "
+           "t = 7; print(f(1)); print(f(0)); print(t);")
+    ir = inline_calls(ir_of(src))
+    assert top_calls(ir) == []
+    res = run(ir)
+    assert res['output'] == ['5', '0', '7']
+    assert res['registers']['t'] == 7
+
+def test_a_global_the_caller_writes_blocks_inlining():
+    # h reads g from the top level; w writes its own g, so it keeps the
+    # call, which comes along when w itself is inlined
+    src = ("func h() { return g; } func w() { g = 1; return h(); } "
+           "g = 9; print(h()); print(w());")
+    ir = inline_calls(ir_of(src))
+    assert top_calls(ir) == ['h']
+    w = ir[ir.index(('FUNC', 'w', [])):ir.index(('ENDFUNC', 'w'))]
+    assert any(i[0] == 'CALL' and i[2] == 'h' for i in w)
+    assert run(ir)['output'] == ['9', '9']
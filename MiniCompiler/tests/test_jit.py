@@ -0,0 +1,41 @@
+import io
+import contextlib
+
+import pytest
+
+from main import compile_source
+from vm import load_machine_code, run_machine_code
+
+NESTED = """
+s = 0; i = 0;
+while (i < 30) {
+  j = 0;
+  while (j < i) { if (j == 7) { s = s + 2; } else { s = s + j / 3; } j = j + 1; }
+  i = i + 1;
+}
+print(s);
+"""
+
+def run(src: str, **kw):
+    prog = load_machine_code(compile_source(src, 0))
+    with contextlib.redirect_stdout(io.StringIO()):
+        return prog, run_machine_code(prog, **kw)
+
+def test_compiled_loops_run_like_the_interpreter():
+    _, want = run(NESTED)
+    prog, got = run(NESTED, jit_threshold=1)
+    assert any(callable(f) for f in prog.jit_loops.values())
+    assert got['output'] == want['output']
+    assert got['registers'] == want['registers']
+    assert got['stats']['steps'] == want['stats']['steps']
+
+def test_loop_with_a_call_stays_interpreted():
+    src = "func f(x) { return x + 1; } i = 0; while (i < 5) { i = f(i); } print(i);"
+    prog, res = run(src, jit_threshold=1)
+    assert prog.jit_loops and not any(prog.jit_loops.values())
+    assert res['output'] == ['5']
+
+def test_step_limit_holds_inside_a_compiled_loop():
+    _, want = run(NESTED)
+    with pytest.raises(RuntimeError, match='step limit'):
+        run(NESTED, jit_threshold=1, max_steps=want['stats']['steps'] // 2)
@@ -0,0 +1,57 @@
+import io
+import contextlib
+
+from cfg import build_cfgs
+from codegen import generate_machine_code
+from ir import generate_ir
+from lexer import tokenize
+from loops import find_loops
+from main import parser_tokens
+from my_parser import Parser
+from passes import PassManager
+from vm import run_machine_code
+
+def ir_of(src: str):
+    return generate_ir(Parser(parser_tokens(tokenize(src))).parse())
+
+def run(passes, src: str):
+    pm = PassManager(passes, debug=True)
+    ir = pm.run_ir(ir_of(src))
+    with contextlib.redirect_stdout(io.StringIO()):
+        res = run_machine_code(generate_machine_code(ir))
+    return ir, res
+
+NESTED = """
+func f(a, b, n) {
+  s = 0; i = 0;
+  while (i < n) { j = 0; while (j < n) { s = s + a * b + j; j = j + 1; } i = i + 1; }
+  return s;
+}
+print(f(3, 4, 10));
+"""
+
+def test_find_loops_innermost_first():
+    g = build_cfgs(ir_of(NESTED))[1]
+    inner, outer = find_loops(g)
+    assert inner.blocks < outer.blocks
+    assert all(l in inner.blocks for l in inner.latches)
+
+def test_licm_hoists_the_invariant_product_out_of_both_loops():
+    ir, res = run(['licm'], NESTED)
+    _, plain = run([], NESTED)
+    assert res['output'] == plain['output'] == ['1650']
+    mul = next(k for k, i in enumerate(ir) if i[0] == 'BIN' and i[2] == '*')
+    first_loop = next(k for k, i in enumerate(ir) if i[0] == 'LABEL' and i[1].startswith('L_cond'))
+    assert mul < first_loop
+    # run once instead of on each of the 100 inner iterations
+    assert res['stats']['steps'] == plain['stats']['steps'] - 99
+
+def test_strength_reduction_replaces_the_product_and_the_counter():
+    src = "func f(n) { s = 0; i = 0; while (i < n) { s = s + i * 8; i = i + 1; } return s; } print(f(10));"
+    # ivsr wants 'i = i + 1' as one BIN, which coalescing gives it
+    ir, res = run(['coalesce', 'copies', 'ivsr', 'dce'], src)
+    assert res['output'] == ['360']
+    body = ir[next(k for k, i in enumerate(ir) if i[0] == 'LABEL' and i[1].startswith('L_cond')):]
+    assert not any(i[0] == 'BIN' and i[2] == '*' for i in body)
+    # the loop test runs on the running product; i is gone
+    assert not any('i' in i[1:] for i in body if i[0] in ('BIN', 'MOV'))
@@ -0,0 +1,70 @@
+import io
+import contextlib
+
+from codegen import generate_machine_code
+from ir import generate_ir
+from lexer import tokenize
+from main import parser_tokens
+from my_parser import Parser
+from passes import PassManager
+from vm import run_machine_code
+
+def optimize(src: str, passes):
+    pm = PassManager(passes, debug=True)
+    ir = pm.run_ir(generate_ir(Parser(parser_tokens(tokenize(src))).parse()))
+    with contextlib.redirect_stdout(io.StringIO()):
+        res = run_machine_code(generate_machine_code(ir))
+    return ir, res['output']
+
+def ops(ir, op: str):
+    return [i for i in ir if i[0] == op]
+
+def test_sccp_folds_constants_through_branches_and_loops():
+    src = """
+    x = 3; k = 5; i = 0; j = 6;
+    if (x > 2) { y = x * 2; } else { y = 99; }
+    while (i < 10) { i = i + 1; j = k + 1; }
+    print(y); print(j);
+    """
+    ir, out = optimize(src, ['sccp'])
+    assert out == ['6', '6']
+    # the 'if' is gone with its dead arm; the loop test still depends on i
+    assert len(ops(ir, 'CJZ')) == 1
+    assert not any(99 in i for i in ir)
+    assert [i[3] for i in ops(ir, 'CALL')] == [[6], [6]]
+
+def test_dce_drops_dead_stores_but_keeps_effects():
+    src = """
+    func f(a) { d = a * 7; e = d + 1; u = g(a); return a + 1; }
+    func g(a) { print(a); return a; }
+    print(f(4));
+    """
+    ir, out = optimize(src, ['dce'])
+    assert out == ['4', '5']
+    assert not any(i[0] == 'BIN' and i[2] == '*' for i in ir)
+    # the call stays for its print, without storing the unused result
+    assert [i[1] for i in ops(ir, 'CALL') if i[2] == 'g'] == [None]
+
+def test_coalesce_and_copies_remove_assign_through_temp():
+    src = "func f(a, b) { x = a + b; y = x; z = y * 2; return z; } print(f(3, 4));"
+    ir, out = optimize(src, ['coalesce', 'copies', 'dce'])
+    assert out == ['14']
+    # the parameter copies, 'x = %t0', 'y = x' and 'z = %t1' are all gone
+    assert ops(ir, 'MOV') == []
+    assert [i[2] for i in ops(ir, 'BIN')] == ['+', '*']
+
+def test_gvn_reuses_dominating_expressions_only():
+    src = """
+    func f(a, b, c) {
+      x = a * b + c; y = b * a + c;
+      if (c > 0) { z = a * b; } else { z = a - b; }
+      w = a - b;
+      return x + y + z + w;
+    }
+    print(f(2, 3, 1)); print(f(2, 3, 0));
+    """
+    ir, out = optimize(src, ['gvn'])
+    assert out == ['19', '10']
+    # b*a+c is a*b+c; the a-b in the else arm doesn't dominate w's
+    assert [i[2] for i in ops(ir, 'BIN')].count('*') == 1
+    assert [i[2] for i in ops(ir, 'BIN')].count('-') == 2
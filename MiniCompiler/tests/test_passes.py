@@ -0,0 +1,54 @@
+import io
+import contextlib
+
+import pytest
+
+from codegen import generate_machine_code
+from ir import generate_ir
+from lexer import tokenize
+from main import parser_tokens
+from my_parser import Parser
+from passes import LEVELS, PassManager, VerifyError, pipeline, verify_ir, verify_mc
+from vm import load_machine_code, run_machine_code
+
+SRC = "x = 2 + 3; y = x * 4; if (y > 10) { print(y); } else { print(0); } z = y;"
+
+def ir_of(src: str):
+    return generate_ir(Parser(parser_tokens(tokenize(src))).parse())
+
+def test_pipeline_checks_pass_names():
+    assert pipeline(' sccp, dce ,') == ['sccp', 'dce']
+    with pytest.raises(ValueError, match='unknown pass: nope'):
+        pipeline('sccp,nope')
+
+def test_levels_only_add_passes():
+    assert LEVELS[0] == []
+    assert set(LEVELS[1]) < set(LEVELS[2])
+
+def test_report_has_a_row_per_pass_and_a_total():
+    pm = PassManager(LEVELS[1], debug=True)
+    mc = pm.run_mc(generate_machine_code(pm.run_ir(ir_of(SRC))))
+    rows = pm.report().splitlines()
+    assert rows[0].split() == ['pass', 'runs', 'changes', 'removed', 'ms']
+    assert [r.split()[0] for r in rows[1:]] == LEVELS[1] + ['total']
+    assert pm.stats['sccp'].runs >= 1 and pm.stats['sccp'].changes > 0
+    assert int(rows[-1].split()[1]) == sum(s.removed for s in pm.stats.values())
+    with contextlib.redirect_stdout(io.StringIO()):
+        res = run_machine_code(load_machine_code(mc))
+    assert res['output'] == ['20']
+    assert {k: res['registers'][k] for k in 'xyz'} == {'x': 5, 'y': 20, 'z': 20}
+
+def test_no_passes_leaves_the_code_alone():
+    pm = PassManager([])
+    ir = ir_of(SRC)
+    assert pm.run_ir(ir) == ir
+    mc = generate_machine_code(ir)
+    assert pm.run_mc(mc) == mc
+
+def test_verifier_rejects_broken_code():
+    with pytest.raises(VerifyError):
+        verify_ir([('JMP', 'L_nowhere')])
+    with pytest.raises(VerifyError):
+        verify_ir([('FUNC', 'f', []), ('RET', 0)])
+    with pytest.raises(VerifyError):
+        verify_mc(['JMP L_nowhere'])
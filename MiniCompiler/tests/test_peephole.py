@@ -0,0 +1,57 @@
+import io
+import contextlib
+
+from main import compile_source
+from peephole import drop_moves, drop_next_jumps, drop_unreachable, peephole, thread_jumps
+from vm import load_machine_code, run_machine_code
+
+def test_jumps_to_jumps_are_threaded():
+    code = ['JZ x, L1', 'JMP L1', 'LABEL L1', 'JMP L2', 'LABEL L2', 'JMP L3', 'LABEL L3', 'PRINT x']
+    out, n = thread_jumps(code)
+    assert out[:2] == ['JZ x, L3', 'JMP L3']
+    assert n == 3    # L1's JMP L2 goes to L3 as well
+
+def test_jump_to_a_return_becomes_the_return():
+    code = ['LABEL FUNC_f', 'JZ x, L1', 'JMP L1', 'PRINT x', 'LABEL L1', 'RET x']
+    out, n = thread_jumps(code)
+    assert out[2] == 'RET x' and out[1] == 'JZ x, L1' and n == 1
+
+def test_jumps_cycling_among_themselves_are_left_alone():
+    code = ['LABEL A', 'JMP B', 'LABEL B', 'JMP A']
+    out, _ = thread_jumps(code)
+    assert out == ['LABEL A', 'JMP A', 'LABEL B', 'JMP B']
+    assert thread_jumps(out) == (out, 0)
+
+def test_jumps_to_the_next_line_are_dropped():
+    code = ['JZ x, L2', 'LABEL L1', 'LABEL L2', 'PRINT x', 'JMP L3', 'LABEL L3', 'JMP L1']
+    assert drop_next_jumps(code) == (['LABEL L1', 'LABEL L2', 'PRINT x', 'LABEL L3', 'JMP L1'], 2)
+
+def test_code_after_a_jump_is_dropped_up_to_a_jump_target():
+    code = ['JMP L2', 'PRINT 1', 'LABEL L1', 'PRINT 2', 'LABEL L2', 'HALT', 'PRINT 3',
+            'LABEL FUNC_f', 'TAILCALL f', 'RET 0']
+    out, n = drop_unreachable(code)
+    assert out == ['JMP L2', 'LABEL L2', 'HALT', 'LABEL FUNC_f', 'TAILCALL f']
+    assert n == 5
+
+def test_redundant_moves_are_dropped():
+    code = ['MOV a, a', 'MOV a, b', 'MOV b, a', 'MOV c, 1', 'MOV c, 2',
+            'MOV x, _arg0', 'MOV _arg0, x', 'CALL f, 1']
+    out, n = drop_moves(code)
+    # argument set-up stays whole for the CALLA fusion
+    assert out == ['MOV a, b', 'MOV c, 2', 'MOV x, _arg0', 'MOV _arg0, x', 'CALL f, 1']
+    assert n == 3
+
+def test_peephole_keeps_what_programs_print():
+    src = ("func f(n) { s = 0; while (n > 0) { n = n - 1; if (n == 2) { s = s + 10; } else { s = s + 1; } } "
+           "return s; } i = 0; while (i < 3) { print(f(i + 2)); i = i + 1; }")
+    mc = compile_source(src, 0)
+    out = peephole(mc)
+    assert len(out) < len(mc)
+    assert not any(l.startswith('JMP') and f'LABEL {l.split()[1]}' == out[k + 1]
+                   for k, l in enumerate(out[:-1]))
+    with contextlib.redirect_stdout(io.StringIO()):
+        want = run_machine_code(load_machine_code(mc))
+        got = run_machine_code(load_machine_code(out))
+    assert got['output'] == want['output'] == ['2', '12', '13']
+    assert got['registers'] == want['registers']
+    assert got['stats']['steps'] < want['stats']['steps']
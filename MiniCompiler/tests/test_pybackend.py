@@ -0,0 +1,36 @@
+import io
+import contextlib
+
+from codegen import generate_machine_code
+from ir import generate_ir
+from lexer import tokenize
+from main import parser_tokens
+from my_parser import Parser
+from pybackend import compile_python, run_python_code
+from vm import run_machine_code
+
+def both(src: str):
+    ir = generate_ir(Parser(parser_tokens(tokenize(src))).parse())
+    with contextlib.redirect_stdout(io.StringIO()):
+        vm = run_machine_code(generate_machine_code(ir))
+        py = run_python_code(compile_python(ir), echo=False)
+    return vm, py
+
+def test_main_is_called_like_on_the_vm():
+    vm, py = both("func main() { print(7); return 0; }")
+    assert vm['output'] == py['output'] == ['7']
+
+def test_main_runs_after_top_level_code():
+    vm, py = both("g = 3; func main() { print(g * 2); return 0; } print(g);")
+    assert vm['output'] == py['output'] == ['3', '6']
+
+def test_arithmetic_and_scoping_follow_the_vm():
+    vm, py = both("""
+    func f(a) { g = a / 0; return (0 - 7) / 2 + g + h; }
+    func k(n) { if (n < 1) { return 0; } return n + k(n - 1); }
+    g = 5; h = 3;
+    print(f(1)); print(g); print(k(20)); print((2 < 3) + (3 <= 2));
+    """)
+    assert vm['output'] == py['output'] == ['-1', '5', '210', '1']
+    user = lambda regs: {n: v for n, v in regs.items() if not n.startswith('%')}
+    assert user(py['registers']) == user(vm['registers']) == {'g': 5, 'h': 3}
@@ -0,0 +1,41 @@
+import io
+import contextlib
+import re
+
+from codegen import generate_machine_code
+from ir import generate_ir
+from lexer import tokenize
+from main import parser_tokens
+from my_parser import Parser
+from passes import PassManager
+from vm import load_machine_code, run_machine_code
+
+SRC = ("func f(a, b) { return (a + 1) * (b + 2) + (a - b) * (a + b) - (a * 3 + b * 5); } "
+       "x = (1 + 2) * (3 + 4) + (5 - 6) * (7 + 8); print(x); print(f(x, 4));")
+
+def allocated(k: int):
+    pm = PassManager(['regalloc'], debug=True, registers=k)
+    ir = pm.run_ir(generate_ir(Parser(parser_tokens(tokenize(SRC))).parse()))
+    prog = load_machine_code(generate_machine_code(ir))
+    with contextlib.redirect_stdout(io.StringIO()):
+        res = run_machine_code(prog)
+    regs = {x for i in ir for x in i[1:] if isinstance(x, str) and re.fullmatch(r'_r\d+', x)}
+    return pm, prog, regs, res
+
+def test_temps_share_at_most_k_registers():
+    _, plain, _, want = allocated(0)
+    for k in (2, 3, 16):
+        pm, prog, regs, res = allocated(k)
+        assert len(regs) <= k
+        assert res['output'] == want['output'] == ['6', '24']
+        assert res['registers']['x'] == 6
+        # every frame got smaller
+        for a, b in zip(prog.functions, plain.functions):
+            assert len(a.template) < len(b.template)
+
+def test_too_few_registers_spill():
+    pm, _, regs, _ = allocated(2)
+    assert regs == {'_r0', '_r1'}
+    assert pm.stats['regalloc'].changes > 0
+    pm, _, _, _ = allocated(16)
+    assert pm.stats['regalloc'].changes == 0
@@ -0,0 +1,118 @@
+import io
+import contextlib
+
+import pytest
+
+from codegen import generate_machine_code
+from ir import generate_ir
+from lexer import tokenize
+from main import parser_tokens
+from my_parser import Parser
+from vm import Op, load_machine_code, run_machine_code
+
+SRC = """
+func add(a, b) { return a + b; }
+x = 0; s = 0;
+while (x < 5) { s = add(s, x); x = x + 1; }
+add(1, 2);
+print(s);
+"""
+
+def test_registers_do_not_depend_on_fusion():
+    mc = generate_machine_code(generate_ir(Parser(parser_tokens(tokenize(SRC))).parse()))
+    fused, plain = load_machine_code(mc), load_machine_code(mc, fuse_pairs=False)
+    assert fused.fused['call_args'] and not plain.fused.get('call_args')
+    with contextlib.redirect_stdout(io.StringIO()):
+        for engine in ('switch', 'closure'):
+            a = run_machine_code(fused, engine=engine)
+            b = run_machine_code(plain, engine=engine)
+            assert a['registers'] == b['registers']
+            assert a['output'] == b['output'] == ['10']
+            assert not any(n == '_ret' or n.startswith('_arg') for n in a['registers'])
+
+def test_lines_are_decoded_once():
+    prog = load_machine_code(["MOV x, 5", "LABEL L", "+ x, x, -1", "JZ x, E", "JMP L",
+                              "LABEL E", "PRINT x", "HALT"])
+    assert all(isinstance(instr[0], Op) for instr in prog.code)
+    jz, jmp = prog.code[2], prog.code[3]
+    assert (jz[0], jz[2]) == (Op.JZ, prog.labels['E'])
+    assert (jmp[0], jmp[1]) == (Op.JMP, prog.labels['L'])
+    with contextlib.redirect_stdout(io.StringIO()):
+        for engine in ('switch', 'closure'):
+            res = run_machine_code(prog, engine=engine)
+            assert res['output'] == ['0'] and res['registers'] == {'x': 0}
+            # MOV, four rounds of + / JZ / JMP, the last + / JZ, PRINT, HALT
+            assert res['stats']['steps'] == 1 + 4 * 3 + 2 + 2
+
+def test_each_name_gets_one_frame_slot():
+    prog = load_machine_code(["MOV x, 5", "+ y, x, 7", "+ x, x, y", "PRINT x", "HALT"])
+    top = prog.functions[0]
+    assert top.names.count('x') == top.names.count('y') == 1
+    assert len(top.template) == len(top.names)
+    # immediates sit in the frame as constants, names start at 0
+    assert {v for n, v in zip(top.names, top.template) if n == ''} == {5, 7}
+    assert all(v == 0 for n, v in zip(top.names, top.template) if n)
+    with contextlib.redirect_stdout(io.StringIO()):
+        res = run_machine_code(prog)
+    assert res['registers'] == {'x': 17, 'y': 12}
+
+def test_every_call_gets_a_fresh_frame():
+    # a recursive call must not see or clobber its caller's locals, and a
+    # reused frame starts over at 0
+    src = """
+    func count(n) { k = k + 1; if (n > 0) { m = count(n - 1); } return k * 10 + n; }
+    func depth(n) { if (n == 0) { return 0; } d = depth(n - 1); return d + 1; }
+    k = 100;
+    print(count(3)); print(count(0)); print(depth(50)); print(k);
+    """
+    mc = generate_machine_code(generate_ir(Parser(parser_tokens(tokenize(src))).parse()))
+    with contextlib.redirect_stdout(io.StringIO()):
+        for engine in ('switch', 'closure'):
+            res = run_machine_code(mc, engine=engine)
+            assert res['output'] == ['13', '10', '50', '100'], engine
+
+def test_closure_engine_counts_steps_like_the_switch_engine():
+    mc = generate_machine_code(generate_ir(Parser(parser_tokens(tokenize(SRC))).parse()))
+    with contextlib.redirect_stdout(io.StringIO()):
+        switch = run_machine_code(mc, engine='switch')
+        closure = run_machine_code(mc, engine='closure')
+        assert closure['stats']['steps'] == switch['stats']['steps']
+        # the limit holds exactly, not only at the end of a dispatch chunk
+        # (reaching HALT at the limit is not over it)
+        n = switch['stats']['steps']
+        for engine in ('switch', 'closure'):
+            run_machine_code(mc, engine=engine, max_steps=n - 1)
+            with pytest.raises(RuntimeError, match='step limit'):
+                run_machine_code(mc, engine=engine, max_steps=n - 2)
+    with pytest.raises(ValueError, match='Unknown engine'):
+        run_machine_code(mc, engine='threaded')
+
+def test_compare_and_branch_fuse_unless_a_label_splits_them():
+    body = ["MOV i, 0", "LABEL L", "+ i, i, 1", "LT c, i, 3", "JZ c, E", "JMP L", "LABEL E",
+            "PRINT i", "HALT"]
+    split = body[:4] + ["LABEL M"] + body[4:]
+    fused, plain = load_machine_code(body), load_machine_code(split)
+    assert fused.fused['cmp_branch'] == 1 and plain.fused['cmp_branch'] == 0
+    assert len(fused.code) == len(plain.code) - 1
+    with contextlib.redirect_stdout(io.StringIO()):
+        a, b = run_machine_code(fused), run_machine_code(plain)
+    assert a['output'] == b['output'] == ['3']
+    assert a['registers'] == b['registers'] == {'i': 3, 'c': 0}
+
+def test_tail_calls_do_not_grow_the_callstack():
+    src = ("func even(n) { if (n == 0) return 1; return odd(n - 1); } "
+           "func odd(n) { if (n == 0) return 0; return even(n - 1); } "
+           "func sum(n, s) { if (n == 0) return s; return sum(n - 1, s + n); } "
+           "print(even(20001)); print(sum(20000, 0));")
+    ir = generate_ir(Parser(parser_tokens(tokenize(src))).parse())
+    # the self tail call is a loop, the mutual ones TAILCALLs
+    assert not any(i[0] == 'CALL' and i[2] == 'sum' for i in ir[:ir.index(('ENDFUNC', 'sum'))])
+    mc = generate_machine_code(ir)
+    assert 'TAILCALL odd, %t1' in mc and 'TAILCALL even, %t4' in mc
+    with contextlib.redirect_stdout(io.StringIO()):
+        for engine in ('switch', 'closure'):
+            res = run_machine_code(load_machine_code(mc), engine=engine, max_steps=10**6)
+            assert res['output'] == ['0', '200010000']
+        res = run_machine_code(load_machine_code(mc), max_steps=10**6, profile=True)
+    # every activation replaced its caller's: no call path is deeper than one
+    assert max(line.count(';') for line in res['profile'].collapsed().splitlines()) == 1
@@ -1,141 +1,835 @@
 import re
+from enum import IntEnum
+from itertools import repeat
+from operator import itemgetter
+from typing import Dict, List, Optional, Tuple
 
-def parse_token(tok, registers, memory):
-    tok = str(tok).strip().rstrip(',')
+class Op(IntEnum):
+    MOV = 0
+    ADD = 1
+    SUB = 2
+    MUL = 3
+    DIV = 4
+    GT = 5
+    LT = 6
+    EQ = 7
+    NE = 8
+    GE = 9
+    LE = 10
+    JMP = 11
+    JZ = 12
+    CALL = 13
+    RET = 14
+    PRINT = 15
+    EVAL = 16   # legacy 'x = <expr>' line, evaluated with eval()
+    TRAP = 17   # raises RuntimeError(a); target of unresolved jumps
+    HALT = 18   # end of the top-level code
+    # superinstructions, formed by fuse() at load time
+    GTJZ = 19   # relop into a temp, then JZ on that temp
+    LTJZ = 20
+    EQJZ = 21
+    NEJZ = 22
+    GEJZ = 23
+    LEJZ = 24
+    CALLA = 25  # CALL that reads its arguments straight from caller slots
+    TAILCALL = 26  # 'CALL f / RET result' in a function, replacing its frame
+
+MNEMONICS = {
+    'MOV': Op.MOV,
+    '+': Op.ADD, '-': Op.SUB, '*': Op.MUL, '/': Op.DIV,
+    'GT': Op.GT, 'LT': Op.LT, 'EQ': Op.EQ, 'NE': Op.NE, 'GE': Op.GE, 'LE': Op.LE,
+    'JMP': Op.JMP, 'JZ': Op.JZ, 'CALL': Op.CALL, 'RET': Op.RET, 'PRINT': Op.PRINT,
+    'HALT': Op.HALT,
+    'GTJZ': Op.GTJZ, 'LTJZ': Op.LTJZ, 'EQJZ': Op.EQJZ, 'NEJZ': Op.NEJZ,
+    'GEJZ': Op.GEJZ, 'LEJZ': Op.LEJZ, 'CALLA': Op.CALLA, 'TAILCALL': Op.TAILCALL,
+}
+BRANCH_OF = {op: Op(op + Op.GTJZ - Op.GT) for op in (Op.GT, Op.LT, Op.EQ, Op.NE, Op.GE, Op.LE)}
+
+# Decoded instruction: (op, a, b, c, d). Register operands and immediates are
+# both frame slot indexes (immediates live in constant slots); jump targets
+# are resolved to ips and CALL carries a function index.
+#   GTJZ..LEJZ  (op, temp, x, y, target)
+#   CALL        (CALL, fid, argc, dest, None)  args already in _arg0.._argN
+#   CALLA       (CALLA, fid, (src, ...), dest, None)
+#   TAILCALL    (TAILCALL, fid, (src, ...), None, None)
+# CALL/CALLA store the callee's return value into the caller's dest slot.
+# TAILCALL releases the running frame first and leaves the callstack alone,
+# so the callee returns straight to whoever called the tail-calling function.
+DInstr = Tuple
+
+TOPLEVEL = '<toplevel>'
+RET_SLOT = 0   # every frame: slot 0 is _ret, slots 1..nargs are _arg0.._argN
+
+class Function:
+    def __init__(self, name: str, entry: int, names: List[str], template: List[int],
+                 outputs: List[int], imports: Tuple[Tuple[int, int], ...]):
+        self.name = name
+        self.entry = entry
+        self.names = names        # slot -> register name ('' for constants)
+        self.template = template  # initial frame: 0 for registers, value for constants
+        self.outputs = outputs    # slots reported back in the 'registers' dict
+        self.imports = imports    # (global slot, local slot) copied in on CALL
+
+    def frame_to_dict(self, frame: List[int]) -> Dict[str, int]:
+        return {self.names[s]: frame[s] for s in self.outputs}
+
+class Program:
+    def __init__(self, code: List[DInstr], source: List[str], labels: Dict[str, int],
+                 functions: List[Function], owner: List[int], nargs: int, halt_ip: int,
+                 fused: Optional[Dict[str, int]] = None):
+        self.code = code
+        self.source = source        # original text per decoded ip (for trace)
+        self.labels = labels        # label name -> ip
+        self.functions = functions  # [0] is the top-level code
+        self.owner = owner          # ip -> index into functions
+        self.nargs = nargs          # number of _argN slots in every frame
+        self.halt_ip = halt_ip      # the HALT appended after the last instruction
+        self.jit_loops = {}         # loop header ip -> compiled loop, False if unsupported
+        self.fused = fused or {}    # superinstruction kind -> number formed at load time
+
+def decode_operand(tok: str):
+    tok = tok.strip().rstrip(',')
     try:
         return int(tok)
     except ValueError:
-        pass
-    if tok in memory:
-        return memory[tok]
-    return registers.get(tok, 0)
+        return tok
+
+def dest_name(parts: List[str]) -> Optional[str]:
+    op = MNEMONICS.get(parts[0])
+    if op is not None and (Op.MOV <= op <= Op.LE or Op.GTJZ <= op <= Op.LEJZ):
+        return parts[1].rstrip(',')
+    if op is Op.CALLA:
+        return parts[2].rstrip(',')
+    if op is None:
+        m = re.match(r'^(\w+)\s*=', ' '.join(parts))
+        return m.group(1) if m else None
+    return None
+
+def fuse(parsed: List[List[str]], region: List[int], labels: Dict[str, int]):
+    # Superinstruction pass over the split lines:
+    #   GT t, x, y / JZ t, L                 ->  GTJZ t, x, y, L
+    #   MOV _arg0, x / ... / CALL f, n       ->  CALLA f, _ret, x, ...
+    #   CALL f, n / MOV t, _ret              ->  CALLA f, t, ...
+    # A pair is only fused when no label points between its parts. The fused
+    # forms still write the compare temp, but leave the caller's _argN/_ret
+    # slots alone: those are call scratch registers nobody else reads.
+    # Returns the new lists, old index -> new index and the fused counts.
+    starts = set(labels.values())
+    out: List[List[str]] = []
+    out_region: List[int] = []
+    remap: Dict[int, int] = {}
+    counts = {'cmp_branch': 0, 'call_args': 0, 'call_store': 0}
+
+    def arg_index(p: List[str]) -> Optional[int]:
+        if p[0] == 'MOV' and len(p) == 3 and not p[2].startswith('_arg'):
+            m = re.match(r'_arg(\d+),$', p[1])
+            if m:
+                return int(m.group(1))
+        return None
+
+    i = 0
+    while i < len(parsed):
+        parts, r = parsed[i], region[i]
+        op = MNEMONICS.get(parts[0])
+        nxt = parsed[i + 1] if i + 1 < len(parsed) and i + 1 not in starts else None
+        if op in BRANCH_OF and len(parts) == 4 and nxt and nxt[0] == 'JZ' and len(nxt) == 3 \
+                and nxt[1].rstrip(',') == parts[1].rstrip(','):
+            remap[i] = remap[i + 1] = len(out)
+            out.append([BRANCH_OF[op].name, parts[1], parts[2], parts[3].rstrip(',') + ',', nxt[2]])
+            out_region.append(r)
+            counts['cmp_branch'] += 1
+            i += 2
+            continue
+        # MOV _argN run, then CALL
+        j = i
+        args: Dict[int, str] = {}
+        while j < len(parsed) and (j == i or j not in starts) and arg_index(parsed[j]) is not None:
+            args.setdefault(arg_index(parsed[j]), parsed[j][2])
+            j += 1
+        call = parsed[j] if j < len(parsed) and (j == i or j not in starts) else None
+        if call and call[0] == 'CALL' and len(call) == 3 and j - i == len(args) \
+                and sorted(args) == list(range(int(call[2]))):
+            dst = '_ret'
+            k = j + 1
+            ret = parsed[k] if k < len(parsed) and k not in starts else None
+            if ret and ret[0] == 'MOV' and len(ret) == 3 and ret[2] == '_ret':
+                dst = ret[1].rstrip(',')
+                k += 1
+            if args or dst != '_ret':
+                for p in range(i, k):
+                    remap[p] = len(out)
+                ops = [dst] + [args[n].rstrip(',') for n in range(len(args))]
+                out.append(['CALLA', call[1].rstrip(',') + ','] + [t + ',' for t in ops[:-1]] + ops[-1:])
+                out_region.append(r)
+                counts['call_args'] += bool(args)
+                counts['call_store'] += dst != '_ret'
+                i = k
+                continue
+        remap[i] = len(out)
+        out.append(parts)
+        out_region.append(r)
+        i += 1
+    remap[len(parsed)] = len(out)
+    return out, out_region, remap, counts
 
-def run_machine_code(lines, *, max_steps=500_000, trace=False):
+def load_machine_code(lines, fuse_pairs: bool = True) -> Program:
     if isinstance(lines, str):
         lines = [l.strip() for l in lines.splitlines() if l.strip()]
 
-    # Build label map
-    label_map = {}
-    for i, line in enumerate(lines):
+    # Pass 1: drop labels/comments, remember where each label lands and
+    # split the stream into regions. Top-level code runs up to the first
+    # 'LABEL FUNC_<name>'; each function runs up to the next one.
+    parsed: List[List[str]] = []
+    region: List[int] = []
+    labels: Dict[str, int] = {}
+    func_names = [TOPLEVEL]
+    func_entry = [0]
+    nargs = 0
+    for line in lines:
+        line = line.strip()
+        if not line or line.startswith('//'):
+            continue
         if line.startswith('LABEL'):
             parts = line.split()
             if len(parts) >= 2:
-                label_map[parts[1]] = i
+                labels[parts[1]] = len(parsed)
+                if parts[1].startswith('FUNC_'):
+                    func_names.append(parts[1][len('FUNC_'):])
+                    func_entry.append(len(parsed))
+            continue
+        parts = line.split()
+        for p in parts[1:]:
+            m = re.match(r'_arg(\d+),?$', p)
+            if m:
+                nargs = max(nargs, int(m.group(1)) + 1)
+        if parts[0] == 'CALL' and len(parts) > 2:
+            nargs = max(nargs, int(parts[2]))
+        if parts[0] == 'CALLA':
+            nargs = max(nargs, len(parts) - 3)
+        if parts[0] == 'TAILCALL':
+            nargs = max(nargs, len(parts) - 2)
+        parsed.append(parts)
+        region.append(len(func_names) - 1)
+
+    fused = {}
+    if fuse_pairs:
+        parsed, region, remap, fused = fuse(parsed, region, labels)
+        labels = {k: remap[v] for k, v in labels.items()}
+        func_entry = [remap[e] for e in func_entry]
+
+    # Names written per region: in a function these are locals, anything it
+    # only reads that the top-level code writes is a global copied in on CALL
+    written = [set() for _ in func_names]
+    for parts, r in zip(parsed, region):
+        d = dest_name(parts)
+        if d is not None:
+            written[r].add(d)
+
+    # Register resolution: every name and every immediate gets a dense slot
+    # in the frame layout of the region it appears in
+    tables = []
+    for r in range(len(func_names)):
+        names = ['_ret'] + [f'_arg{i}' for i in range(nargs)]
+        tables.append({
+            'names': names,
+            'template': [0] * len(names),
+            'name_slots': {n: i for i, n in enumerate(names)},
+            'const_slots': {},
+            'outputs': [],
+            'imports': [],
+        })
+
+    def slot(r: int, tok) -> int:
+        t = tables[r]
+        v = decode_operand(tok) if isinstance(tok, str) else tok
+        if isinstance(v, int):
+            if v not in t['const_slots']:
+                t['const_slots'][v] = len(t['names'])
+                t['names'].append('')
+                t['template'].append(v)
+            return t['const_slots'][v]
+        if v not in t['name_slots']:
+            s = t['name_slots'][v] = len(t['names'])
+            t['names'].append(v)
+            t['template'].append(0)
+            if r != 0 and v not in written[r] and v in written[0]:
+                t['imports'].append((slot(0, v), s))
+        return t['name_slots'][v]
+
+    def dest(r: int, tok) -> int:
+        # _ret/_argN (slots 0..nargs) are never reported: fused calls don't
+        # write them, so 'registers' would depend on fusion
+        s = slot(r, tok)
+        if s > nargs and s not in tables[r]['outputs']:
+            tables[r]['outputs'].append(s)
+        return s
 
-    registers = {}
-    memory = {}
+    code: List[DInstr] = []
+    source: List[str] = []
+    traps: Dict[str, int] = {}
+
+    def target(label: str, msg: str, r: int) -> int:
+        if label in labels:
+            ip = labels[label]
+            if ip < len(region) and region[ip] != r:
+                raise ValueError(f"Jump from {func_names[r]} into {func_names[region[ip]]}: {label}")
+            return ip
+        # unknown labels only fail when the jump is actually taken
+        if msg not in traps:
+            traps[msg] = len(parsed) + 1 + len(traps)
+        return traps[msg]
+
+    # Pass 2: decode operands and resolve jump targets
+    for parts, r in zip(parsed, region):
+        line = ' '.join(parts)
+        op = MNEMONICS.get(parts[0])
+        if op is Op.MOV:
+            instr = (op, dest(r, parts[1]), slot(r, parts[2]), None, None)
+        elif op is not None and Op.ADD <= op <= Op.LE:
+            instr = (op, dest(r, parts[1]), slot(r, parts[2]), slot(r, parts[3]), None)
+        elif op is not None and Op.GTJZ <= op <= Op.LEJZ:
+            label = parts[4]
+            instr = (op, dest(r, parts[1]), slot(r, parts[2]), slot(r, parts[3]),
+                     target(label, f'Unknown label: {label}', r))
+        elif op is Op.JMP:
+            instr = (op, target(parts[1], f'Unknown label: {parts[1]}', r), None, None, None)
+        elif op is Op.JZ:
+            label = parts[2]
+            instr = (op, slot(r, parts[1]), target(label, f'Unknown label: {label}', r), None, None)
+        elif op is Op.CALL or op is Op.CALLA:
+            name = parts[1].rstrip(',')
+            if op is Op.CALL:
+                args = int(parts[2]) if len(parts) > 2 else 0
+                ret = dest(r, '_ret') if r == 0 else RET_SLOT
+            else:
+                args = tuple(slot(r, p) for p in parts[3:])
+                ret = dest(r, parts[2])
+            if name in func_names[1:]:
+                instr = (op, func_names.index(name, 1), args, ret, None)
+            else:
+                instr = (Op.JMP, target(f'FUNC_{name}', f'Unknown function: {name}', r), None, None, None)
+        elif op is Op.TAILCALL:
+            name = parts[1].rstrip(',')
+            if r == 0:
+                raise ValueError(f"TAILCALL outside a function: {line}")
+            args = tuple(slot(r, p) for p in parts[2:])
+            if name in func_names[1:]:
+                instr = (op, func_names.index(name, 1), args, None, None)
+            else:
+                instr = (Op.JMP, target(f'FUNC_{name}', f'Unknown function: {name}', r), None, None, None)
+        elif op is Op.RET:
+            instr = (op, slot(r, parts[1]) if len(parts) > 1 else slot(r, 0), dest(r, '_ret'), None, None)
+        elif op is Op.PRINT:
+            instr = (op, slot(r, parts[1]), None, None, None)
+        elif op is Op.HALT:
+            instr = (op, None, None, None, None)
+        else:
+            m = re.match(r'^(?P<lhs>\w+)\s*=\s*(?P<rhs>.+)$', line)
+            if not m:
+                raise ValueError(f"Unknown instruction: '{line}'")
+            instr = (Op.EVAL, dest(r, m.group('lhs')), m.group('rhs'), None, None)
+        code.append(instr)
+        source.append(line)
+
+    owner = list(region)
+    halt_ip = len(code)
+    code.append((Op.HALT, None, None, None, None))
+    source.append('// end')
+    owner.append(0)
+    for msg in traps:
+        code.append((Op.TRAP, msg, None, None, None))
+        source.append(f'// trap: {msg}')
+        owner.append(0)
+
+    functions = [
+        Function(name, entry, t['names'], t['template'], t['outputs'], tuple(t['imports']))
+        for name, entry, t in zip(func_names, func_entry, tables)
+    ]
+    return Program(code, source, labels, functions, owner, nargs, halt_ip, fused)
+
+ENGINES = ('switch', 'closure')
+CHUNK = 1024   # closure engine: steps run between termination checks
+
+def run_machine_code(lines, *, max_steps=500_000, trace=False, engine='switch', jit_threshold=None,
+                     profile=False):
+    # profile=True runs on the switch engine without the JIT and adds a
+    # guestprof.Profiler under 'profile'
+    prog = lines if isinstance(lines, Program) else load_machine_code(lines)
+    if engine not in ENGINES:
+        raise ValueError(f"Unknown engine: {engine!r} (expected one of {', '.join(ENGINES)})")
+    prof = None
+    if profile:
+        from guestprof import Profiler
+        prof = Profiler(prog)
+    if engine == 'closure' and not trace and prof is None:
+        gregs, output, steps = _run_closure(prog, max_steps)
+    else:
+        gregs, output, steps = _run_switch(prog, max_steps, trace, jit_threshold, prof)
+    res = {'registers': prog.functions[0].frame_to_dict(gregs), 'memory': {}, 'output': output,
+           'stats': {'steps': steps, 'fused': dict(prog.fused)}}
+    if prof is not None:
+        res['profile'] = prof
+    return res
+
+def _run_switch(prog: Program, max_steps: int, trace: bool, jit_threshold: Optional[int] = None,
+                prof=None):
+    code = prog.code
+    funcs = prog.functions
+    watch = trace or prof is not None
+    counts = prof.counts if prof is not None else None
+    jit = jit_threshold is not None and not watch
+    if jit:
+        from jit import compile_loop
+        hot = {}  # loop header ip -> backward JMPs taken
+
+    gregs = regs = list(funcs[0].template)
+    cur = 0         # index of the function owning regs
+    pools = [[] for _ in funcs]  # released frames, reused by later calls
     ip = 0
     output = []
     steps = 0
-    callstack = []  # stores return ip
+    callstack = []  # (return ip, caller frame, caller function, result slot)
 
-    def step_debug():
-        if not trace:
-            return
-        print(f"[ip={ip:04d}] {lines[ip]}  | regs={registers}")
+    MOV, ADD, SUB, MUL, DIV = Op.MOV, Op.ADD, Op.SUB, Op.MUL, Op.DIV
+    GT, LT, EQ, NE, GE, LE = Op.GT, Op.LT, Op.EQ, Op.NE, Op.GE, Op.LE
+    JMP, JZ, CALL, RET, PRINT, EVAL = Op.JMP, Op.JZ, Op.CALL, Op.RET, Op.PRINT, Op.EVAL
+    HALT, CALLA, TAILCALL = Op.HALT, Op.CALLA, Op.TAILCALL
+    GTJZ, LTJZ, EQJZ, NEJZ, GEJZ, LEJZ = Op.GTJZ, Op.LTJZ, Op.EQJZ, Op.NEJZ, Op.GEJZ, Op.LEJZ
 
-    while ip < len(lines):
+    while True:
         if steps >= max_steps:
+            if code[ip][0] is HALT:
+                break
             raise RuntimeError(f"Execution step limit exceeded ({max_steps}).")
         steps += 1
 
-        line = lines[ip].strip()
-        if not line or line.startswith('//'):
-            ip += 1; continue
-        if line.startswith('LABEL'):
-            ip += 1; continue
+        op, a, b, c, d = code[ip]
+        if watch:
+            if trace:
+                print(f"[ip={ip:04d}] {prog.source[ip]}  | regs={funcs[cur].frame_to_dict(regs)}")
+            if counts is not None:
+                counts[ip] += 1
 
-        parts = line.split()
-        op = parts[0]
-        step_debug()
-
-        if op == 'MOV':
-            dest = parts[1].rstrip(',')
-            val = parse_token(parts[2], registers, memory)
-            registers[dest] = val
+        if op is MOV:
+            regs[a] = regs[b]
             ip += 1; continue
 
-        if op in ('+','-','*','/'):
-            dest = parts[1].rstrip(',')
-            a = parse_token(parts[2], registers, memory)
-            b = parse_token(parts[3], registers, memory)
-            if op == '+': registers[dest] = a + b
-            elif op == '-': registers[dest] = a - b
-            elif op == '*': registers[dest] = a * b
-            elif op == '/': registers[dest] = a // b if b != 0 else 0
+        if ADD <= op <= LE:
+            x = regs[b]
+            y = regs[c]
+            if op is ADD: regs[a] = x + y
+            elif op is SUB: regs[a] = x - y
+            elif op is MUL: regs[a] = x * y
+            elif op is DIV: regs[a] = x // y if y != 0 else 0
+            elif op is GT: regs[a] = int(x > y)
+            elif op is LT: regs[a] = int(x < y)
+            elif op is EQ: regs[a] = int(x == y)
+            elif op is NE: regs[a] = int(x != y)
+            elif op is GE: regs[a] = int(x >= y)
+            else: regs[a] = int(x <= y)
             ip += 1; continue
 
-        if op in ('GT','LT','EQ','NE','GE','LE'):
-            dest = parts[1].rstrip(',')
-            a = parse_token(parts[2], registers, memory)
-            b = parse_token(parts[3], registers, memory)
-            registers[dest] = int(
-                (op == 'GT' and a > b) or
-                (op == 'LT' and a < b) or
-                (op == 'EQ' and a == b) or
-                (op == 'NE' and a != b) or
-                (op == 'GE' and a >= b) or
-                (op == 'LE' and a <= b)
-            )
-            ip += 1; continue
+        if GTJZ <= op <= LEJZ:
+            x = regs[b]
+            y = regs[c]
+            if op is GTJZ: t = x > y
+            elif op is LTJZ: t = x < y
+            elif op is EQJZ: t = x == y
+            elif op is NEJZ: t = x != y
+            elif op is GEJZ: t = x >= y
+            else: t = x <= y
+            if t:
+                regs[a] = 1
+                ip += 1
+            else:
+                regs[a] = 0
+                ip = d
+            continue
 
-        if op == 'JMP':
-            label = parts[1]
-            if label not in label_map:
-                raise RuntimeError(f'Unknown label: {label}')
-            ip = label_map[label]
+        if op is JZ:
+            ip = b if regs[a] == 0 else ip + 1
             continue
 
-        if op == 'JZ':
-            reg = parts[1].rstrip(',')
-            label = parts[2]
-            val = parse_token(reg, registers, memory)
-            if val == 0:
-                if label not in label_map:
-                    raise RuntimeError(f'Unknown label: {label}')
-                ip = label_map[label]
-                continue
-            ip += 1; continue
+        if op is JMP:
+            if jit and a < ip:
+                loop = prog.jit_loops.get(a)
+                if loop is None:
+                    n = hot[a] = hot.get(a, 0) + 1
+                    if n >= jit_threshold:
+                        loop = prog.jit_loops[a] = compile_loop(prog, a, ip) or False
+                if loop:
+                    ip, n = loop(regs, max_steps - steps)
+                    steps += n
+                    if steps > max_steps:
+                        raise RuntimeError(f"Execution step limit exceeded ({max_steps}).")
+                    continue
+            ip = a
+            continue
 
-        if op == 'CALL':
-            # CALL name, nargs
-            name = parts[1].rstrip(',')
-            # push return address
-            callstack.append(ip + 1)
-            label = f'FUNC_{name}'
-            if label not in label_map:
-                raise RuntimeError(f'Unknown function: {name}')
-            ip = label_map[label]
+        if op is CALL or op is CALLA:
+            f = funcs[a]
+            pool = pools[a]
+            if pool:
+                frame = pool.pop()
+                frame[:] = f.template
+            else:
+                frame = list(f.template)
+            if op is CALLA:
+                for i, s in enumerate(b, 1):
+                    frame[i] = regs[s]
+            elif b:
+                frame[1:b + 1] = regs[1:b + 1]
+            for g, l in f.imports:
+                frame[l] = gregs[g]
+            callstack.append((ip + 1, regs, cur, c))
+            regs = frame
+            cur = a
+            ip = f.entry
+            if prof is not None:
+                prof.call(a, steps)
             continue
 
-        if op == 'RET':
-            val = parse_token(parts[1], registers, memory) if len(parts) > 1 else 0
-            registers['_ret'] = val
+        if op is TAILCALL:
+            f = funcs[a]
+            pool = pools[a]
+            if pool:
+                frame = pool.pop()
+                frame[:] = f.template
+            else:
+                frame = list(f.template)
+            for i, s in enumerate(b, 1):
+                frame[i] = regs[s]
+            for g, l in f.imports:
+                frame[l] = gregs[g]
+            pools[cur].append(regs)
+            regs = frame
+            cur = a
+            ip = f.entry
+            if prof is not None:
+                prof.ret(steps)
+                prof.call(a, steps)
+            continue
+
+        if op is RET:
+            val = regs[a]
             if not callstack:
                 # return at top level: just stop
+                regs[b] = val
                 break
-            ip = callstack.pop()
+            pools[cur].append(regs)
+            ip, regs, cur, c = callstack.pop()
+            regs[c] = val
+            if prof is not None:
+                prof.ret(steps)
             continue
 
-        if op == 'PRINT':
-            val = parse_token(parts[1], registers, memory)
+        if op is PRINT:
+            val = regs[a]
             output.append(str(val))
             print(val)
             ip += 1; continue
 
-        m = re.match(r'^(?P<lhs>\w+)\s*=\s*(?P<rhs>.+)$', line)
-        if m:
-            lhs = m.group('lhs')
-            rhs = m.group('rhs')
-            for k, v in registers.items():
+        if op is EVAL:
+            rhs = b
+            for k, v in funcs[cur].frame_to_dict(regs).items():
                 rhs = re.sub(r'\b' + re.escape(k) + r'\b', str(v), rhs)
             try:
                 val = int(eval(rhs))
             except Exception:
                 val = 0
-            registers[lhs] = val
+            regs[a] = val
             ip += 1; continue
 
-        raise ValueError(f"Unknown instruction: '{line}'")
+        if op is HALT:
+            break
+
+        raise RuntimeError(a)
+
+    if prof is not None:
+        prof.finish(steps)
+    return gregs, output, steps
+
+def _run_closure(prog: Program, max_steps: int):
+    # Threaded engine: every instruction becomes a closure with its operands
+    # bound that runs the instruction and returns the next ip. HALT returns
+    # its own ip, so the main loop can run in fixed-size chunks and only
+    # look for termination between chunks.
+    funcs = prog.functions
+    gregs = regs = list(funcs[0].template)
+    cur = 0
+    pools = [[] for _ in funcs]
+    output = []
+    callstack = []
+    spins = 0         # HALT executions, the driver keeps calling it until the chunk ends
+    stopped = False   # set by a top-level RET
+
+    def mov(a, b, nxt):
+        def f():
+            regs[a] = regs[b]
+            return nxt
+        return f
+
+    def add(a, b, c, nxt):
+        def f():
+            regs[a] = regs[b] + regs[c]
+            return nxt
+        return f
+
+    def sub(a, b, c, nxt):
+        def f():
+            regs[a] = regs[b] - regs[c]
+            return nxt
+        return f
+
+    def mul(a, b, c, nxt):
+        def f():
+            regs[a] = regs[b] * regs[c]
+            return nxt
+        return f
+
+    def div(a, b, c, nxt):
+        def f():
+            y = regs[c]
+            regs[a] = regs[b] // y if y != 0 else 0
+            return nxt
+        return f
+
+    def gt(a, b, c, nxt):
+        def f():
+            regs[a] = 1 if regs[b] > regs[c] else 0
+            return nxt
+        return f
+
+    def lt(a, b, c, nxt):
+        def f():
+            regs[a] = 1 if regs[b] < regs[c] else 0
+            return nxt
+        return f
+
+    def eq(a, b, c, nxt):
+        def f():
+            regs[a] = 1 if regs[b] == regs[c] else 0
+            return nxt
+        return f
+
+    def ne(a, b, c, nxt):
+        def f():
+            regs[a] = 1 if regs[b] != regs[c] else 0
+            return nxt
+        return f
+
+    def ge(a, b, c, nxt):
+        def f():
+            regs[a] = 1 if regs[b] >= regs[c] else 0
+            return nxt
+        return f
+
+    def le(a, b, c, nxt):
+        def f():
+            regs[a] = 1 if regs[b] <= regs[c] else 0
+            return nxt
+        return f
+
+    def gtjz(a, b, c, target, nxt):
+        def f():
+            if regs[b] > regs[c]:
+                regs[a] = 1
+                return nxt
+            regs[a] = 0
+            return target
+        return f
+
+    def ltjz(a, b, c, target, nxt):
+        def f():
+            if regs[b] < regs[c]:
+                regs[a] = 1
+                return nxt
+            regs[a] = 0
+            return target
+        return f
 
-    return {'registers': registers, 'memory': memory, 'output': output}
\ No newline at end of file
+    def eqjz(a, b, c, target, nxt):
+        def f():
+            if regs[b] == regs[c]:
+                regs[a] = 1
+                return nxt
+            regs[a] = 0
+            return target
+        return f
+
+    def nejz(a, b, c, target, nxt):
+        def f():
+            if regs[b] != regs[c]:
+                regs[a] = 1
+                return nxt
+            regs[a] = 0
+            return target
+        return f
+
+    def gejz(a, b, c, target, nxt):
+        def f():
+            if regs[b] >= regs[c]:
+                regs[a] = 1
+                return nxt
+            regs[a] = 0
+            return target
+        return f
+
+    def lejz(a, b, c, target, nxt):
+        def f():
+            if regs[b] <= regs[c]:
+                regs[a] = 1
+                return nxt
+            regs[a] = 0
+            return target
+        return f
+
+    def jz(a, target, nxt):
+        def f():
+            return target if regs[a] == 0 else nxt
+        return f
+
+    def jmp(target):
+        def f():
+            return target
+        return f
+
+    def call(fid, args, dst, nxt):
+        # args: argc (already in _arg0..) or, for CALLA, the caller source slots
+        fn = funcs[fid]
+        template, imports, entry, pool = fn.template, fn.imports, fn.entry, pools[fid]
+        argc, src, get = args, None, None
+        if not isinstance(args, int):
+            argc = len(args)
+            if argc == 1:
+                src = args[0]
+            elif argc > 1:
+                get = itemgetter(*args)
+        def f():
+            nonlocal regs, cur
+            if pool:
+                frame = pool.pop()
+                frame[:] = template
+            else:
+                frame = list(template)
+            if get is not None:
+                frame[1:argc + 1] = get(regs)
+            elif src is not None:
+                frame[1] = regs[src]
+            elif argc:
+                frame[1:argc + 1] = regs[1:argc + 1]
+            for g, l in imports:
+                frame[l] = gregs[g]
+            callstack.append((nxt, regs, cur, dst))
+            regs = frame
+            cur = fid
+            return entry
+        return f
+
+    def tailcall(fid, args):
+        fn = funcs[fid]
+        template, imports, entry, pool = fn.template, fn.imports, fn.entry, pools[fid]
+        argc = len(args)
+        get = itemgetter(*args) if argc > 1 else None
+        src = args[0] if argc == 1 else None
+        def f():
+            nonlocal regs, cur
+            if pool:
+                frame = pool.pop()
+                frame[:] = template
+            else:
+                frame = list(template)
+            if get is not None:
+                frame[1:argc + 1] = get(regs)
+            elif src is not None:
+                frame[1] = regs[src]
+            for g, l in imports:
+                frame[l] = gregs[g]
+            pools[cur].append(regs)
+            regs = frame
+            cur = fid
+            return entry
+        return f
+
+    def ret(a, b):
+        def f():
+            nonlocal regs, cur, stopped
+            val = regs[a]
+            if not callstack:
+                regs[b] = val
+                stopped = True
+                return halt_ip
+            pools[cur].append(regs)
+            ip, regs, cur, dst = callstack.pop()
+            regs[dst] = val
+            return ip
+        return f
+
+    def prnt(a, nxt):
+        def f():
+            val = regs[a]
+            output.append(str(val))
+            print(val)
+            return nxt
+        return f
+
+    def evl(a, rhs, nxt):
+        def f():
+            expr = rhs
+            for k, v in funcs[cur].frame_to_dict(regs).items():
+                expr = re.sub(r'\b' + re.escape(k) + r'\b', str(v), expr)
+            try:
+                regs[a] = int(eval(expr))
+            except Exception:
+                regs[a] = 0
+            return nxt
+        return f
+
+    def halt(ip):
+        def f():
+            nonlocal spins
+            spins += 1
+            return ip
+        return f
+
+    def trap(msg):
+        def f():
+            raise RuntimeError(msg)
+        return f
+
+    arith = {Op.ADD: add, Op.SUB: sub, Op.MUL: mul, Op.DIV: div,
+             Op.GT: gt, Op.LT: lt, Op.EQ: eq, Op.NE: ne, Op.GE: ge, Op.LE: le}
+    branch = {Op.GTJZ: gtjz, Op.LTJZ: ltjz, Op.EQJZ: eqjz,
+              Op.NEJZ: nejz, Op.GEJZ: gejz, Op.LEJZ: lejz}
+    halt_ip = prog.halt_ip
+    code = []
+    for ip, (op, a, b, c, d) in enumerate(prog.code):
+        nxt = ip + 1
+        if op is Op.MOV: code.append(mov(a, b, nxt))
+        elif op in arith: code.append(arith[op](a, b, c, nxt))
+        elif op in branch: code.append(branch[op](a, b, c, d, nxt))
+        elif op is Op.JZ: code.append(jz(a, b, nxt))
+        elif op is Op.JMP: code.append(jmp(a))
+        elif op is Op.CALL or op is Op.CALLA: code.append(call(a, b, c, nxt))
+        elif op is Op.TAILCALL: code.append(tailcall(a, b))
+        elif op is Op.RET: code.append(ret(a, b))
+        elif op is Op.PRINT: code.append(prnt(a, nxt))
+        elif op is Op.EVAL: code.append(evl(a, b, nxt))
+        elif op is Op.HALT: code.append(halt(ip))
+        else: code.append(trap(a))
+
+    ip = 0
+    remaining = max_steps
+    while prog.code[ip][0] is not Op.HALT:
+        if remaining <= 0:
+            raise RuntimeError(f"Execution step limit exceeded ({max_steps}).")
+        n = min(remaining, CHUNK)
+        remaining -= n
+        for _ in repeat(None, n):
+            ip = code[ip]()
+    # steps as the switch engine counts them: HALT itself is one step unless
+    # the limit was reached on it, the repeats past it are not
+    steps = max_steps - remaining - spins
+    if not stopped and steps < max_steps:
+        steps += 1
+    return gregs, output, steps
@@ -1,5 +1,7 @@
 # Converts TAC to simple stack-VM assembly.
-# Supported ops: PUSH n, LOAD x, STORE x, ADD,SUB,MUL,DIV,MOD, CMP<,CMP<=,CMP>,CMP>=,CMPEQ,CMPNE, JZ label, JMP label, LABEL, CALL name n, RET, PARAM
+# Supported ops: PUSH n, LOAD x, STORE x, ADD,SUB,MUL,DIV,MOD, CMP<,CMP<=,CMP>,CMP>=,CMPEQ,CMPNE, JZ label, JMP label, LABEL, CALL name n, RET, PARAM, POP
+# Directives: FUNC name params..., ENDFUNC
+# Every CALL leaves one value on the stack (print leaves 0); statement calls POP it.
 
 import re
 
@@ -7,13 +9,13 @@ def asm_from_tac(tac):
     asm=[]
     def label(name): asm.append(f"LABEL {name}")
     for ln in tac:
-        if ln.startswith('func '):
-            asm.append(f"; {ln}")
+        if m:=re.match(r"func (\w+)\(([\w, ]*)\):$", ln):
+            asm.append(" ".join(["FUNC", m.group(1)] + m.group(2).replace(',', ' ').split()))
             continue
         if ln.startswith('endfunc'):
-            asm.append('; endfunc')
+            asm.append('ENDFUNC')
             continue
-        if m:=re.match(r"(\w+) = (\d+)$", ln):
+        if m:=re.match(r"(\w+) = (-?\d+)$", ln):
             var,val=m.groups(); asm+= [f"PUSH {val}", f"STORE {var}"]; continue
         if m:=re.match(r"(\w+) = (\w+)$", ln):
             var,src=m.groups(); asm+= [f"LOAD {src}", f"STORE {var}"]; continue
@@ -25,10 +27,11 @@ def asm_from_tac(tac):
             asm.append(f"STORE {dst}")
             continue
         if m:=re.match(r"param (\w+)$", ln): asm.append(f"PARAM {m.group(1)}"); continue
-        if m:=re.match(r"call (\w+), (\d+)$", ln): asm.append(f"CALL {m.group(1)} {m.group(2)}"); continue
+        if m:=re.match(r"call (\w+), (\d+)$", ln): asm+= [f"CALL {m.group(1)} {m.group(2)}", "POP"]; continue
         if m:=re.match(r"(t\d+) = call (\w+), (\d+)$", ln):
             t,fn,argc=m.groups(); asm.append(f"CALL {fn} {argc}"); asm.append(f"STORE {t}"); continue
         if m:=re.match(r"return (\w+)$", ln): asm+= [f"LOAD {m.group(1)}","RET"]; continue
+        if ln=='return': asm+= ["PUSH 0","RET"]; continue
         if m:=re.match(r"(L_[\w]+_\d+):$", ln): label(m.group(1)); continue
         if m:=re.match(r"if (\w+) goto (\w+)$", ln):
             tmp=m.group(1); lab=m.group(2)
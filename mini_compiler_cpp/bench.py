@@ -0,0 +1,123 @@
+# Stack VM (this compiler) vs register VM (../MiniCompiler/vm.py) on the same programs
+#   python bench.py [--repeat N] [--engine switch|closure] [-O 0|1|2]
+# Both compilers use module names like lexer/optimizer, so the register VM side
+# runs in a subprocess rooted in ../MiniCompiler.
+import argparse, json, os, re, subprocess, sys, time
+from lexer import lex
+from parsers import Parser
+from semantic import Sema
+from codegen_tac import Codegen
+from passes import LEVELS, PassManager
+from asmgen import asm_from_tac
+from stackvm import run as run_asm
+
+REGVM_DIR=os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'MiniCompiler')
+
+WORKLOADS={
+    'count': """
+        func main() {
+          int x = 1;
+          while (x <= 200000) { x = x + 1; }
+          print(x);
+          return x;
+        }
+    """,
+    'arith': """
+        func main() {
+          int i = 0; int s = 0;
+          while (i < 50000) {
+            s = s + i * 3 - i / 2;
+            if (s > 100000) { s = s - 100000; }
+            i = i + 1;
+          }
+          print(s);
+          return s;
+        }
+    """,
+    'nested': """
+        func main() {
+          int i = 0; int n = 0;
+          while (i < 300) {
+            int j = 0;
+            while (j < 300) { n = n + i * j; j = j + 1; }
+            i = i + 1;
+          }
+          print(n);
+          return n;
+        }
+    """,
+    'calls': """
+        func add(a, b) { return a + b; }
+        func main() {
+          int i = 0; int s = 0;
+          while (i < 20000) { s = add(s, i); i = add(i, 1); }
+          print(s);
+          return s;
+        }
+    """,
+    'fib': """
+        func fib(n) {
+          if (n < 2) { return n; }
+          return fib(n - 1) + fib(n - 2);
+        }
+        func main() { int r = fib(20); print(r); return r; }
+    """,
+}
+
+# register VM side: compile with MiniCompiler, run best-of-N, report as JSON
+REGVM_SCRIPT='''
+import io, contextlib, json, sys, time
+from main import compile_source
+from vm import load_machine_code, run_machine_code
+src, repeat, engine, level = sys.stdin.read(), int(sys.argv[1]), sys.argv[2], int(sys.argv[3])
+# no compile-time evaluation: both VMs have to run the same work
+prog = load_machine_code(compile_source(src, level, eval_steps=0))
+best = float('inf')
+for _ in range(repeat):
+    with contextlib.redirect_stdout(io.StringIO()):
+        t0 = time.perf_counter()
+        res = run_machine_code(prog, max_steps=50_000_000, engine=engine)
+        best = min(best, time.perf_counter() - t0)
+print(json.dumps({'time': best, 'steps': res['stats']['steps'], 'output': res['output']}))
+'''
+
+def to_minicompiler(src):
+    # MiniCompiler has no declarations: 'int x;' -> 'x = 0;', 'int x = e;' -> 'x = e;'
+    src=re.sub(r"\bint (\w+);", r"\1 = 0;", src)
+    return re.sub(r"\bint ", "", src)
+
+def bench_stack(src, repeat, level):
+    ast=Parser(lex(src)).parse(); Sema(ast).run()
+    asm=asm_from_tac(PassManager(LEVELS[level]).run(Codegen(ast).run()))
+    best=float('inf')
+    for _ in range(repeat):
+        t0=time.perf_counter()
+        res=run_asm(asm, max_steps=50_000_000, echo=False)
+        best=min(best, time.perf_counter()-t0)
+    return {'time':best, 'steps':res['steps'], 'output':res['output']}
+
+def bench_register(src, repeat, engine, level):
+    p=subprocess.run([sys.executable, '-c', REGVM_SCRIPT, str(repeat), engine, str(level)], input=to_minicompiler(src),
+                     capture_output=True, text=True, cwd=REGVM_DIR, check=True)
+    return json.loads(p.stdout)
+
+def main():
+    ap=argparse.ArgumentParser()
+    ap.add_argument('--repeat', type=int, default=3)
+    ap.add_argument('--engine', default='switch', help='register VM engine')
+    ap.add_argument('-O', dest='level', type=int, choices=sorted(LEVELS), default=1,
+                    help='optimization level for both compilers (register side without compile-time evaluation)')
+    args=ap.parse_args()
+    print(f"-O{args.level} on both sides, register VM engine: {args.engine}, no compile-time evaluation")
+    header=f"{'workload':<10}{'stack':>12}{'steps':>10}{'register':>12}{'steps':>10}{'stack/reg':>11}"
+    print(header) ; print("-"*len(header))
+    for name,src in WORKLOADS.items():
+        s=bench_stack(src, args.repeat, args.level)
+        r=bench_register(src, args.repeat, args.engine, args.level)
+        if s['output']!=r['output']:
+            print(f"{name:<10}output mismatch: stack={s['output']} register={r['output']}") ; continue
+        print(f"{name:<10}{s['time']*1000:>10.1f}ms{s['steps']:>10}{r['time']*1000:>10.1f}ms{r['steps']:>10}"
+              f"{s['time']/r['time']:>10.2f}x")
+
+if __name__=='__main__':
+    main()
@@ -3,10 +3,11 @@ from lexer import lex
 from parsers import Parser
 from semantic import Sema, SemaError
 from codegen_tac import Codegen
-from optimizer import optimize
+from passes import LEVELS, PASSES, PassManager, VerifyError, pipeline
 from asmgen import asm_from_tac
+from stackvm import run as run_asm, VMError
 
-PHASES=["lex","parse","sema","tac","opt","asm","all"]
+PHASES=["lex","parse","sema","tac","opt","asm","run","all"]
 
 # -------- pretty printers --------
 
@@ -69,7 +70,14 @@ def main():
     ap=argparse.ArgumentParser()
     ap.add_argument('file')
     ap.add_argument('--phase', choices=PHASES, default='all')
+    ap.add_argument('-O', dest='level', type=int, choices=sorted(LEVELS), default=1,
+                    help="0: no TAC passes, 1: selfcopy+fold (the default), 2: all")
+    ap.add_argument('--passes', metavar='LIST', help=f"comma-separated, instead of -O ({','.join(PASSES)})")
+    ap.add_argument('--time-passes', action='store_true', help="print runs/changes/removed/time per pass")
+    ap.add_argument('--verify', action='store_true', help="check the TAC after every pass")
     args=ap.parse_args()
+    try: names=LEVELS[args.level] if args.passes is None else pipeline(args.passes)
+    except ValueError as e: ap.error(str(e))
 
     src=open(args.file,'r').read()
 
@@ -108,10 +116,16 @@ def main():
         if args.phase=='tac': return
 
     # Phase 5: Optimizer
-    tac_opt=optimize(tac)
+    pm=PassManager(names, debug=args.verify)
+    try:
+        tac_opt=pm.run(tac)
+    except VerifyError as e:
+        print('VerifyError:', e) ; return
     if args.phase in ('opt','all'):
         banner('PHASE 5: OPTIMIZED TAC')
         print("\n".join(tac_opt))
+        if args.time_passes:
+            print() ; print(pm.report())
         if args.phase=='opt': return
 
     # Phase 6: ASM gen
@@ -119,6 +133,16 @@ def main():
     if args.phase in ('asm','all'):
         banner('PHASE 6: ASM (Toy Stack VM)')
         print("\n".join(asm))
+        if args.phase=='asm': return
+
+    # Phase 7: run on the stack VM
+    banner('PHASE 7: RUN (Toy Stack VM)')
+    try:
+        res=run_asm(asm)
+    except VMError as e:
+        print('RuntimeError:', e) ; return
+    print('return value:', res['result'])
+    print('steps:', res['steps'])
 
 if __name__=='__main__':
     main()
@@ -11,7 +11,7 @@ class Codegen:
     def __init__(self, ast): self.ast=ast; self.tac=TAC()
     def run(self):
         for f in self.ast.funcs:
-            self.tac.emit(f"func {f.name}:")
+            self.tac.emit(f"func {f.name}({', '.join(p.name for p in f.params)}):")
             self._block(f.body)
             if f.name!='main': self.tac.emit("return")
             self.tac.emit("endfunc\n")
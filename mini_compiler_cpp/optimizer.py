@@ -1,4 +1,5 @@
 import re
+from collections import Counter
 
 def optimize(tac_lines):
     # very small: remove "x = x" and fold simple const ops
@@ -27,6 +28,41 @@ def optimize(tac_lines):
     return out
 
 
+# Passes for passes.py: lines -> (lines, changes)
+
+def selfcopy(tac_lines):
+    # "x = x"
+    out=[ln for ln in tac_lines if not re.match(r"^(\w+) = \1$", ln)]
+    return out, len(tac_lines)-len(out)
+
+def fold(tac_lines):
+    # "tN = 2 * 3" -> "tN = 6", the way optimize() folds it
+    out=[optimize([ln])[0] if re.match(r"^t\d+ = \d+ ", ln) else ln for ln in tac_lines]
+    return out, sum(a!=b for a,b in zip(tac_lines,out))
+
+def temps(tac_lines):
+    # "tN = a op b / x = tN" -> "x = a op b" when that copy is tN's only use
+    uses=Counter(w for ln in tac_lines for w in re.findall(r"\bt\d+\b", ln))
+    out=[]; n=0
+    for ln in tac_lines:
+        m=re.match(r"^(\w+) = (t\d+)$", ln)
+        d=re.match(r"^(t\d+) = (?!call )(.+)$", out[-1]) if out and m else None
+        if d and d.group(1)==m.group(2) and uses[m.group(2)]==2:
+            out[-1]=f"{m.group(1)} = {d.group(2)}"; n+=1; continue
+        out.append(ln)
+    return out, n
+
+def jumps(tac_lines):
+    # "goto L" right before "L:"
+    out=[]; n=0
+    for i,ln in enumerate(tac_lines):
+        m=re.match(r"goto (\w+)$", ln)
+        if m and i+1<len(tac_lines) and tac_lines[i+1]==f"{m.group(1)}:":
+            n+=1; continue
+        out.append(ln)
+    return out, n
+
+
 
 
 
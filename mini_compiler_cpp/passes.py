@@ -0,0 +1,63 @@
+# TAC pass manager: -O levels, a fixed-point worklist, per-pass stats and
+# an optional check of the TAC after every pass.
+#   python cli.py prog.mc -O2 --time-passes --verify
+import re, time
+from collections import deque
+from optimizer import selfcopy, fold, temps, jumps
+
+PASSES={'selfcopy':selfcopy, 'fold':fold, 'temps':temps, 'jumps':jumps}
+LEVELS={0:[], 1:['selfcopy','fold'], 2:['selfcopy','fold','temps','jumps']}
+MAX_RUNS=4
+
+class VerifyError(Exception): pass
+
+def pipeline(spec):
+    names=[n.strip() for n in spec.split(',') if n.strip()]
+    bad=[n for n in names if n not in PASSES]
+    if bad: raise ValueError(f"unknown pass: {', '.join(bad)} (known: {', '.join(PASSES)})")
+    return names
+
+def verify(tac):
+    # func/endfunc balanced, every goto target defined in its function
+    infunc=False; labels=set(); targets=[]
+    for ln in tac:
+        if ln.startswith('func '):
+            if infunc: raise VerifyError(f"'{ln}' inside another function")
+            infunc=True; labels=set(); targets=[]
+        elif ln.startswith('endfunc'):
+            if not infunc: raise VerifyError("endfunc without func")
+            for t in targets:
+                if t not in labels: raise VerifyError(f"goto {t}: label not defined")
+            infunc=False
+        elif ln.endswith(':'): labels.add(ln[:-1])
+        elif m:=re.search(r"goto (\w+)$", ln): targets.append(m.group(1))
+    if infunc: raise VerifyError("func without endfunc")
+
+class PassManager:
+    def __init__(self, names, debug=False):
+        self.names=list(names); self.debug=debug
+        self.stats={n:{'runs':0,'changes':0,'removed':0,'seconds':0.0} for n in self.names}
+
+    def run(self, tac):
+        work=deque(self.names); runs={}
+        while work:
+            name=work.popleft()
+            if runs.get(name,0)>=MAX_RUNS: continue
+            runs[name]=runs.get(name,0)+1
+            t0=time.perf_counter(); new,n=PASSES[name](tac)
+            s=self.stats[name]; s['seconds']+=time.perf_counter()-t0
+            s['runs']+=1; s['changes']+=n; s['removed']+=len(tac)-len(new)
+            tac=new
+            if self.debug:
+                try: verify(tac)
+                except VerifyError as e: raise VerifyError(f"after {name}: {e}") from None
+            if n:
+                work.extend(x for x in self.names if x!=name and x not in work)
+        return tac
+
+    def report(self):
+        w=max([len(n) for n in self.names]+[4])
+        rows=[f"{'pass'.ljust(w)}  {'runs':>5} {'changes':>8} {'removed':>8} {'ms':>9}"]
+        for n,s in self.stats.items():
+            rows.append(f"{n.ljust(w)}  {s['runs']:>5} {s['changes']:>8} {s['removed']:>8} {s['seconds']*1000:>9.2f}")
+        return "\n".join(rows)
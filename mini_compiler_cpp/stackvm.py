@@ -0,0 +1,125 @@
+# Toy stack VM: executes the assembly produced by asmgen.asm_from_tac.
+# Locals and operands share one preallocated array. A call's frame starts at
+# fp with its parameters, then its other locals; the operand stack grows
+# above the frame. Names and labels are resolved to slots/ips at load time.
+
+# opcodes
+PUSH,LOAD,STORE,POP,ADD,SUB,MUL,DIV,MOD,LT,LE,GT,GE,EQ,NE,JZ,JMP,CALL,PRINT,RET=range(20)
+OPNAMES=['PUSH','LOAD','STORE','POP','ADD','SUB','MUL','DIV','MOD','CMP<','CMP<=','CMP>','CMP>=','CMPEQ','CMPNE',
+         'JZ','JMP','CALL','PRINT','RET']
+BINOPS={name:op for op,name in enumerate(OPNAMES) if ADD<=op<=NE}
+STACK_SIZE=1<<16
+
+class VMError(Exception): pass
+
+class Function:
+    def __init__(self, name, params):
+        self.name=name; self.params=params; self.entry=0; self.depth=0; self.zeros=[]
+        self.slots={p:i for i,p in enumerate(params)}
+    def slot(self, var):
+        if var not in self.slots: self.slots[var]=len(self.slots)
+        return self.slots[var]
+    @property
+    def nlocals(self): return len(self.slots)
+
+def _lines(asm):
+    for ln in asm:
+        ln=ln.split(';',1)[0].strip()
+        if ln: yield ln.split()
+
+def load(asm):
+    # pass 1: functions and label ips; pass 2: decode to (op, a, b) tuples
+    funcs={}; labels={}; ip=0
+    for parts in _lines(asm):
+        if parts[0]=='FUNC':
+            if parts[1] in funcs: raise VMError(f"Function '{parts[1]}' redefined")
+            funcs[parts[1]]=f=Function(parts[1], parts[2:]); f.entry=ip
+        elif parts[0]=='LABEL': labels[parts[1]]=ip
+        else: ip+=1   # ENDFUNC decodes to an implicit 'PUSH 0; RET'
+    if ip and not funcs: raise VMError("code outside of a function")
+
+    code=[]; fn=None; depth=0
+    def operand(tok):
+        try: return PUSH, int(tok)
+        except ValueError: return LOAD, fn.slot(tok)
+    for parts in _lines(asm):
+        op=parts[0]
+        if op=='FUNC': fn=funcs[parts[1]]; depth=0; continue
+        if op=='LABEL': continue
+        if fn is None: raise VMError(f"'{' '.join(parts)}' outside of a function")
+        if op in ('PUSH','LOAD','PARAM'): ins=operand(parts[1])+(None,)
+        elif op=='STORE': ins=(STORE, fn.slot(parts[1]), None)
+        elif op=='POP': ins=(POP, None, None)
+        elif op in BINOPS: ins=(BINOPS[op], None, None)
+        elif op in ('JZ','JMP'):
+            if parts[1] not in labels: raise VMError(f"Unknown label '{parts[1]}'")
+            ins=(JZ if op=='JZ' else JMP, labels[parts[1]], None)
+        elif op=='CALL':
+            name=parts[1]; argc=int(parts[2]) if len(parts)>2 else 0
+            if name in funcs: ins=(CALL, funcs[name], argc)
+            elif name=='print': ins=(PRINT, argc, None)
+            else: raise VMError(f"Call to unknown function '{name}'")
+        elif op=='RET': ins=(RET, None, None)
+        elif op=='ENDFUNC': ins=(RET, 0, None); fn=None
+        else: raise VMError(f"Unknown instruction '{' '.join(parts)}'")
+        # straight-line operand depth, used for the overflow check on CALL
+        if ins[0] in (PUSH,LOAD): depth+=1
+        elif ins[0] in (STORE,POP,JZ) or ADD<=ins[0]<=NE: depth-=1
+        elif ins[0] in (CALL,PRINT): depth+=1-(ins[2] if ins[0]==CALL else ins[1])
+        if fn is not None: fn.depth=max(fn.depth, depth)
+        code.append(ins)
+    if 'main' not in funcs: raise VMError("Missing entry function 'main'")
+    for f in funcs.values(): f.zeros=[0]*f.nlocals
+    return code, funcs
+
+def run(asm, max_steps=10_000_000, echo=True):
+    code,funcs=load(asm)
+    main=funcs['main']
+    stack=[0]*STACK_SIZE
+    fp=0; sp=main.nlocals; ip=main.entry
+    calls=[]   # (return ip, caller fp)
+    output=[]; steps=0; result=0
+    while True:
+        if steps>=max_steps: raise VMError(f"Execution step limit exceeded ({max_steps}).")
+        steps+=1
+        op,a,b=code[ip]; ip+=1
+        if op==LOAD: stack[sp]=stack[fp+a]; sp+=1
+        elif op==STORE: sp-=1; stack[fp+a]=stack[sp]
+        elif op==PUSH: stack[sp]=a; sp+=1
+        elif op<=NE and op>=ADD:
+            sp-=1; y=stack[sp]; x=stack[sp-1]
+            if op==ADD: x=x+y
+            elif op==SUB: x=x-y
+            elif op==MUL: x=x*y
+            elif op==DIV: x=x//y if y!=0 else x
+            elif op==MOD: x=x%y if y!=0 else 0
+            elif op==LT: x=int(x<y)
+            elif op==LE: x=int(x<=y)
+            elif op==GT: x=int(x>y)
+            elif op==GE: x=int(x>=y)
+            elif op==EQ: x=int(x==y)
+            else: x=int(x!=y)
+            stack[sp-1]=x
+        elif op==JZ:
+            sp-=1
+            if stack[sp]==0: ip=a
+        elif op==JMP: ip=a
+        elif op==CALL:
+            # arguments are already on top of the stack: they become the first locals
+            nfp=sp-b; k=min(b, len(a.params)); n=a.nlocals
+            if nfp+n+a.depth>=STACK_SIZE: raise VMError("stack overflow")
+            stack[nfp+k:nfp+n]=a.zeros[k:]
+            calls.append((ip, fp))
+            fp=nfp; sp=nfp+n; ip=a.entry
+        elif op==RET:
+            val=stack[sp-1] if a is None else a
+            if not calls: result=val; break
+            sp=fp; stack[sp]=val; sp+=1
+            ip,fp=calls.pop()
+        elif op==POP: sp-=1
+        elif op==PRINT:
+            for v in stack[sp-a:sp]:
+                output.append(str(v))
+                if echo: print(v)
+            sp-=a; stack[sp]=0; sp+=1
+    return {'result':result, 'output':output, 'steps':steps}